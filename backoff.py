@@ -0,0 +1,10 @@
+import random
+
+"""
+Exponential backoff with jitter for reconnect attempts: the delay doubles with
+each consecutive failure up to maximum, and is randomized between half and the
+full delay so several clients don't retry in lockstep.
+"""
+def reconnect_delay(failures, initial, maximum):
+    delay = min(maximum, initial * 2 ** max(0, failures - 1))
+    return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import gc
+import logging
+import time
+
+from benchmarks.synthetic import SyntheticNotificationSource, create_receiver
+from ble_connection import VesselViewMobileReceiver
+
+logger = logging.getLogger("bench_notification")
+
+"""
+Micro-benchmark of the per-notification cost of notification_handler, with
+publishing stubbed out. Each mode replays the same pre-generated notifications:
+
+    trigger-all  every notification probes the correlation registry (the
+                 behaviour before the streaming fast path)
+    fast-path    notifications only trigger the registry when something is
+                 waiting on their UUID
+"""
+def prepare_notifications(ticks):
+    source = SyntheticNotificationSource()
+    notifications = []
+    for _ in range(ticks):
+        for characteristic, payload, _ in source.next_tick():
+            notifications.append((characteristic, payload))
+    return notifications
+
+
+def measure_once(notifications, skip_unawaited_triggers):
+    VesselViewMobileReceiver.skip_unawaited_triggers = skip_unawaited_triggers
+    gc.disable()
+    try:
+        receiver = create_receiver(lambda path, value, timestamp: None)
+        handler = receiver.notification_handler
+        start = time.perf_counter()
+        for characteristic, payload in notifications:
+            handler(characteristic, payload)
+        return (time.perf_counter() - start) / len(notifications)
+    finally:
+        gc.enable()
+        VesselViewMobileReceiver.skip_unawaited_triggers = True
+
+
+"""
+Runs the modes alternately so warm-up, frequency scaling and garbage
+collection affect both equally, and reports the fastest run of each
+"""
+def measure(notifications, repeat):
+    before = []
+    after = []
+    for _ in range(repeat):
+        before.append(measure_once(notifications, False))
+        after.append(measure_once(notifications, True))
+    return min(before), min(after)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure the per-notification cost of the receiver")
+    parser.add_argument("--ticks", type=int, default=20000, help="engine ticks (one notification per UUID per tick)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per mode, the fastest is reported")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
+
+    # receivers are created inside a running loop, as they are in the bridge
+    notifications = prepare_notifications(args.ticks)
+    before, after = measure(notifications, args.repeat)
+
+    print(f"notifications:       {len(notifications)}")
+    print(f"trigger-all:         {before * 1e9:.0f} ns/notification")
+    print(f"fast-path:           {after * 1e9:.0f} ns/notification")
+    print(f"saved:               {(before - after) * 1e9:.0f} ns/notification ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import collections
+import logging
+import sys
+import time
+
+from benchmarks.report import summarize_latencies, rss_bytes, format_ms, format_mb
+from benchmarks.signalk_server import SignalKStandIn
+from benchmarks.synthetic import SyntheticNotificationSource, create_receiver
+from loop_watchdog import LoopWatchdog, WatchdogConfig, install_uvloop
+from signalk_publisher import SignalKPublisher, SignalKConfig
+
+logger = logging.getLogger("bench_pipeline")
+
+"""
+End-to-end benchmark: synthetic notifications -> VesselViewMobileReceiver ->
+SignalKPublisher -> websocket -> local SignalK stand-in.
+
+Latency is measured from the start of notification_handler until the delta
+carrying that value is received by the stand-in. Each published value is
+replaced by a unique sequence number, so a sample on the wire identifies the
+notification that produced it even when values repeat. Values which are
+superseded by a newer value for the same path before they are sent are
+counted as coalesced rather than as latency samples.
+"""
+class PipelineBenchmark:
+    def __init__(self, args):
+        self.__args = args
+        self.__pending = collections.defaultdict(collections.deque)
+        self.__notification_time = 0.0
+        self.latencies = []
+        self.notifications = 0
+        self.published = 0
+        self.coalesced = 0
+
+    def publish_func(self, publisher: SignalKPublisher):
+        def publish(path, value, timestamp):
+            self.published += 1
+            sequence = self.published
+            self.__pending[path].append((sequence, self.__notification_time))
+            publisher.publish_delta(path, sequence, timestamp)
+        return publish
+
+    def on_delta(self, delta, received):
+        for update in delta["updates"]:
+            for item in update["values"]:
+                pending = self.__pending[item["path"]]
+                # values for a path are sent in order, earlier sequence numbers were coalesced
+                while len(pending) > 0:
+                    sequence, sent = pending.popleft()
+                    if sequence == item["value"]:
+                        self.latencies.append(received - sent)
+                        break
+                    self.coalesced += 1
+
+    async def run(self):
+        args = self.__args
+        server = SignalKStandIn("benchmark", "benchmark")
+        server.on_delta = self.on_delta
+        url = await server.start()
+
+        config = SignalKConfig()
+        config.websocket_url = url
+        config.username = "benchmark"
+        config.password = "benchmark"
+        config.batch_window = args.batch_window_ms / 1000.0
+        config.send_queue_size = args.queue_size
+        config.overflow_policy = args.overflow_policy
+        publisher = SignalKPublisher(config)
+
+        receiver = create_receiver(self.publish_func(publisher))
+        handler = receiver.notification_handler
+        source = SyntheticNotificationSource()
+
+        # measures how late the loop runs timers while it is under load
+        watchdog_config = WatchdogConfig()
+        watchdog_config.interval_ms = 10
+        watchdog_config.lag_threshold_ms = float("inf")
+        watchdog_config.report_interval = 0
+        watchdog = LoopWatchdog(watchdog_config)
+
+        rss_start = rss_bytes()
+        async with asyncio.TaskGroup() as tg:
+            watchdog_task = tg.create_task(watchdog.run())
+            publisher_task = tg.create_task(publisher.run(tg))
+            while not publisher.socket_connected:
+                await asyncio.sleep(0.01)
+
+            start = time.perf_counter()
+            end = start + args.duration
+            tick_interval = 1.0 / args.rate if args.rate > 0 else 0
+            next_tick = start
+            while time.perf_counter() < end:
+                for characteristic, payload, _ in source.next_tick():
+                    self.__notification_time = time.perf_counter()
+                    handler(characteristic, payload)
+                    self.notifications += 1
+
+                if tick_interval > 0:
+                    next_tick += tick_interval
+                    await asyncio.sleep(max(0, next_tick - time.perf_counter()))
+                else:
+                    await asyncio.sleep(0)
+            elapsed = time.perf_counter() - start
+
+            # let the sender drain before shutting down
+            drain_deadline = time.perf_counter() + 5
+            while publisher.queue_depth > 0 and time.perf_counter() < drain_deadline:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(args.batch_window_ms / 1000.0 + 0.1)
+
+            await publisher.close()
+            publisher_task.cancel()
+            watchdog.close()
+            watchdog_task.cancel()
+
+        rss_end = rss_bytes()
+        await server.stop()
+        self.report(elapsed, server, publisher, watchdog, rss_start, rss_end)
+
+    def report(self, elapsed, server: SignalKStandIn, publisher: SignalKPublisher, watchdog: LoopWatchdog,
+               rss_start, rss_end):
+        latency = summarize_latencies(self.latencies)
+        lag = watchdog.percentiles()
+        print(f"event loop:          {type(asyncio.get_running_loop()).__module__}")
+        print(f"duration:            {elapsed:.2f}s")
+        print(f"notifications:       {self.notifications} ({self.notifications / elapsed:.0f}/s)")
+        print(f"values published:    {self.published} ({self.published / elapsed:.0f}/s)")
+        print(f"deltas received:     {server.delta_count} ({server.delta_count / elapsed:.0f}/s)")
+        print(f"values received:     {server.value_count} ({server.value_count / elapsed:.0f}/s)")
+        print(f"coalesced values:    {self.coalesced}")
+        print(f"dropped by queue:    {publisher.dropped_count}")
+        print(f"latency p50:         {format_ms(latency['p50'])}")
+        print(f"latency p99:         {format_ms(latency['p99'])}")
+        print(f"latency max:         {format_ms(latency['max'])}")
+        print(f"loop lag p50:        <= {format_ms(lag['p50'])}")
+        print(f"loop lag p99:        <= {format_ms(lag['p99'])}")
+        print(f"loop lag max:        {format_ms(lag['max'])}")
+        print(f"rss:                 {format_mb(rss_start)} -> {format_mb(rss_end)}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the notification to SignalK websocket pipeline")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to generate notifications for")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="engine ticks per second (one notification per UUID per tick), 0 for max")
+    parser.add_argument("--batch-window-ms", type=float, default=100)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--overflow-policy", default="drop-oldest")
+    parser.add_argument("--loop", choices=["asyncio", "uvloop"], default="asyncio", help="event loop implementation")
+    parser.add_argument("-d", "--debug", action="store_true", help="sets the log level to debug")
+    return parser.parse_args()
+
+
+async def main(args):
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s",
+    )
+
+    await PipelineBenchmark(args).run()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    # uvloop has to be installed before the loop is created
+    if args.loop == "uvloop" and not install_uvloop():
+        sys.exit(1)
+    asyncio.run(main(args))
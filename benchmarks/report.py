@@ -0,0 +1,48 @@
+import resource
+import sys
+
+"""
+Helpers shared by the benchmark scripts for summarizing measurements
+"""
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize_latencies(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 0.50),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if len(ordered) > 0 else 0.0,
+    }
+
+
+"""
+Current resident set size in bytes. Uses /proc on Linux and falls back to the
+peak RSS reported by getrusage elsewhere.
+"""
+def rss_bytes():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.3f}ms"
+
+
+def format_mb(value):
+    return f"{value / (1024 * 1024):.1f}MB"
@@ -0,0 +1,87 @@
+import json
+import logging
+import time
+import uuid
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+"""
+In-process stand-in for a SignalK server's /signalk/v1/stream websocket. It
+speaks enough of the protocol for SignalKPublisher (hello message, login
+requests and deltas) and records when each delta arrives.
+"""
+class SignalKStandIn:
+
+    stream_path = "/signalk/v1/stream"
+
+    def __init__(self, username = None, password = None):
+        self.__username = username
+        self.__password = password
+        self.__server = None
+        self.delta_count = 0
+        self.value_count = 0
+        self.login_count = 0
+        self.on_delta = None
+
+    @property
+    def url(self):
+        port = self.__server.sockets[0].getsockname()[1]
+        return f"ws://127.0.0.1:{port}{SignalKStandIn.stream_path}?subscribe=none"
+
+    async def start(self):
+        self.__server = await websockets.serve(self.handle_client, "127.0.0.1", 0)
+        logger.info("SignalK stand-in listening on %s", self.url)
+        return self.url
+
+    async def stop(self):
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    async def handle_client(self, websocket):
+        if not websocket.path.startswith(SignalKStandIn.stream_path):
+            await websocket.close(code=1008, reason="Unknown path")
+            return
+
+        await websocket.send(json.dumps({
+            "name": "signalk-server",
+            "version": "2.0.0",
+            "self": "vessels.urn:mrn:signalk:uuid:" + str(uuid.uuid4()),
+            "roles": ["master", "main"],
+        }))
+
+        try:
+            async for message in websocket:
+                received = time.perf_counter()
+                data = json.loads(message)
+                if "login" in data:
+                    await websocket.send(json.dumps(self.login_response(data)))
+                elif "updates" in data:
+                    self.record_delta(data, received)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def login_response(self, data):
+        login = data["login"]
+        if self.__username is not None and (login.get("username") != self.__username
+                                            or login.get("password") != self.__password):
+            return {"requestId": data.get("requestId"), "state": "COMPLETED", "statusCode": 401}
+
+        self.login_count += 1
+        return {
+            "requestId": data.get("requestId"),
+            "state": "COMPLETED",
+            "statusCode": 200,
+            "login": {"token": str(uuid.uuid4())}
+        }
+
+    def record_delta(self, delta, received):
+        self.delta_count += 1
+        for update in delta["updates"]:
+            self.value_count += len(update["values"])
+
+        if self.on_delta is not None:
+            self.on_delta(delta, received)
@@ -0,0 +1,77 @@
+from ble_connection import UUIDs, BleConnectionConfig, VesselViewMobileReceiver
+
+"""
+Synthetic VVM notifications. Header bytes and payload sizes follow the values
+documented in docs/decoding.md so the payloads look like those from a real
+device.
+"""
+
+# uuid: (header, payload size, minimum value, maximum value)
+NOTIFICATION_LAYOUTS = {
+    UUIDs.ENGINE_RPM_UUID: (bytes([0x01, 0x00]), 10, 600, 6000),
+    UUIDs.COOLANT_TEMPERATURE_UUID: (bytes([0xd2, 0x00]), 10, 20, 95),
+    UUIDs.BATTERY_VOLTAGE_UUID: (bytes([0xe8, 0x00]), 10, 11500, 14500),
+    UUIDs.UNK_105_UUID: (bytes([0x70, 0x17]), 18, 204557, 208986),
+    UUIDs.ENGINE_RUNTIME_UUID: (bytes([0x96, 0x00]), 18, 5800, 500000),
+    UUIDs.CURRENT_FUEL_FLOW_UUID: (bytes([0x0a, 0x00]), 10, 100, 8000),
+    UUIDs.UNK_108_UUID: (bytes([0x40, 0x1f]), 10, 8000, 8000),
+    UUIDs.UNK_109_UUID: (bytes([0x10, 0x27]), 3, 1, 1),
+    UUIDs.OIL_PRESSURE_UUID: (bytes([0xb5, 0x00]), 10, 0, 60000),
+    UUIDs.UNK_10B_UUID: (bytes([0xd4, 0x00]), 10, 0, 19247),
+    UUIDs.UNK_10C_UUID: (bytes([0xb6, 0x00]), 10, 0, 0),
+    UUIDs.UNK_10D_UUID: (bytes([0xfb, 0x00]), 10, 0, 0),
+    UUIDs.DEVICE_201_UUID: (bytes([0x00, 0x00]), 6, 0, 0),
+}
+
+
+"""
+Minimal stand-in for BleakGATTCharacteristic, the receiver only needs the UUID
+"""
+class SyntheticCharacteristic:
+    __slots__ = ("uuid",)
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+"""
+Generates notifications for every streaming UUID. The value for each UUID
+steps through its range so consecutive notifications carry different values.
+"""
+class SyntheticNotificationSource:
+    def __init__(self, uuids = None):
+        if uuids is None:
+            uuids = list(NOTIFICATION_LAYOUTS.keys())
+
+        self.__uuids = uuids
+        self.__characteristics = {uuid: SyntheticCharacteristic(uuid) for uuid in uuids}
+        self.__sequence = 0
+
+    @property
+    def uuids(self):
+        return self.__uuids
+
+    def value_for_sequence(self, uuid, sequence):
+        _, _, minimum, maximum = NOTIFICATION_LAYOUTS[uuid]
+        return minimum + sequence % (maximum - minimum + 1)
+
+    def payload(self, uuid, value):
+        header, size, _, _ = NOTIFICATION_LAYOUTS[uuid]
+        return bytearray(header + value.to_bytes(size - len(header), byteorder="little"))
+
+    """
+    Yields (characteristic, payload, raw value) for one notification on every UUID
+    """
+    def next_tick(self):
+        sequence = self.__sequence
+        self.__sequence += 1
+        for uuid in self.__uuids:
+            value = self.value_for_sequence(uuid, sequence)
+            yield self.__characteristics[uuid], self.payload(uuid, value), value
+
+
+def create_receiver(publish_func):
+    config = BleConnectionConfig()
+    config.device_name = "benchmark"
+    config.csv_output_enabled = False
+    return VesselViewMobileReceiver(config, publish_func)
@@ -1,47 +1,78 @@
-import argparse
 import asyncio
 import logging
+import time
 
 from bleak import BleakClient, BleakScanner
 from bleak.backends.characteristic import BleakGATTCharacteristic
 from bleak.uuids import normalize_uuid_16, uuid16_dict
-from bleak.exc import BleakCharacteristicNotFoundError
+from bleak.exc import BleakCharacteristicNotFoundError, BleakError
 
+import metrics
+from backoff import reconnect_delay
+from change_filter import ChangeFilter
+from clock import now_stamp
 from data_logger import CSVLogger
-from futures_queue import FuturesQueue
+from device_cache import DeviceCache
+from loop_watchdog import SlowHandlerMonitor
+from telemetry_log import TelemetryLogWriter
+from correlation_registry import CorrelationRegistry
+from parameter_decoder import compile_decoders, compile_header_decoders, header_key
 
 logger = logging.getLogger(__name__)
 
+NOTIFICATIONS = metrics.REGISTRY.counter("vvm_ble_notifications_total", "BLE notifications received",
+                                         labels=("engine", "uuid"))
+DECODE_SECONDS = metrics.REGISTRY.histogram("vvm_decode_seconds",
+                                            "Time to decode, filter, queue and record an engine data notification",
+                                            metrics.SECONDS_BUCKETS_FAST, labels=("engine",))
+BLE_CONNECTIONS = metrics.REGISTRY.counter("vvm_ble_connections_total", "BLE connection attempts",
+                                           labels=("engine", "result"))
+BLE_SCAN_SECONDS = metrics.REGISTRY.histogram("vvm_ble_scan_seconds", "Duration of BLE device scans",
+                                              metrics.SECONDS_BUCKETS_SLOW, labels=("engine",))
+
 class VesselViewMobileReceiver:
 
     rescan_timeout_seconds = 10
 
+    # engine data notifications only trigger the correlation registry when
+    # something is waiting on their UUID
+    skip_unawaited_triggers = True
+
+    # engine data notifications taking longer than this are counted and logged as slow
+    slow_handler_seconds = 0.01
+    connect_timeout_seconds = 10
+    parameter_config_timeout_seconds = 10
+    configuration_data_timeout_seconds = 5
+    reconnect_initial_delay_seconds = 1
+
     def __init__(self, config: 'BleConnectionConfig', publish_delta_func):
         logger.debug("Created a new instance of decoder class")
         self.__config = config
         
-        self.__device = None
+        self.__last_address = None
         self.__abort = False
-        self.__engine_id = "0"
+        self.__closed = asyncio.Event()
+        self.__engine_id = config.engine_id
         self.__signalk_root_path = "propulsion"
-        self.__signalk_parameter_map = {
-            UUIDs.ENGINE_RPM_UUID: { "path": "revolutions", "convert": Conversion.rpm_to_hertz },
-            UUIDs.COOLANT_TEMPERATURE_UUID: { "path": "temperature", "convert": Conversion.celsius_to_kelvin  },
-            UUIDs.BATTERY_VOLTAGE_UUID: { "path": "alternatorVoltage", "convert": Conversion.millivolts_to_volts },
-            UUIDs.ENGINE_RUNTIME_UUID: { "path": "runTime", "convert": Conversion.minutes_to_seconds },
-            UUIDs.CURRENT_FUEL_FLOW_UUID: {"path": "fuel.rate", "convert": Conversion.centiliters_to_cubic_meters},
-            UUIDs.OIL_PRESSURE_UUID: { "path": "oilPressure", "convert": Conversion.decapascals_to_pascals },
-            UUIDs.UNK_105_UUID: {},
-            UUIDs.UNK_108_UUID: {},
-            UUIDs.UNK_109_UUID: {},
-            UUIDs.UNK_10B_UUID: {},
-            UUIDs.UNK_10C_UUID: {},
-            UUIDs.UNK_10D_UUID: {},
-            UUIDs.DEVICE_201_UUID: {}
-        }
+        self.__signalk_parameter_map = SIGNALK_PARAMETER_MAP
+        self.__decoders = dict()
+        self.__header_decoders = dict()
+        self.compile_decoders()
         self.__cancel_signal = asyncio.Future()
         self.__publish_delta_func = publish_delta_func
-        self.__notification_queue = FuturesQueue()
+        self.__notification_waiters = CorrelationRegistry()
+        self.__awaited_uuids = dict()
+        self.__notification_counters = dict()
+        self.__decode_seconds = DECODE_SECONDS.labels(self.__engine_id)
+        self.__connection_successes = BLE_CONNECTIONS.labels(self.__engine_id, "success")
+        self.__connection_failures = BLE_CONNECTIONS.labels(self.__engine_id, "failure")
+        self.__scan_seconds = BLE_SCAN_SECONDS.labels(self.__engine_id)
+        self.__slow_handlers = SlowHandlerMonitor(self.__engine_id)
+        self.__publish_filter = ChangeFilter(config.publish_filters, config.default_publish_filter)
+        self.__device_cache = DeviceCache(config.device_cache_file)
+        self.__firmware_revision = None
+        self.__refresh_device_cache = False
+        self.__config_notifications = False
         self.configure_csv_output()
 
     @property
@@ -55,78 +86,197 @@ class VesselViewMobileReceiver:
     @property
     def retry_interval(self):
         return self.__config.retry_interval
+
+    @property
+    def engine_id(self):
+        return self.__engine_id
     
    
     """
-    Main run loop for detecting the BLE device and processing data from it
+    Main run loop for detecting the BLE device and processing data from it.
+
+    When the device address is known (configured, or from the last connection)
+    it is connected to directly. A filtered scan is only used to find the device
+    by name or after a direct connection has failed, and failed attempts are
+    retried with exponential backoff.
     """
-    async def run(self, task_group):
-        #loop = asyncio.get_event_loop()
-        
+    async def run(self):
+        failures = 0
+        direct_connect = True
         while not self.__abort:
-            # Loop on device discovery
-            while self.__device is None:
-                if self.device_address is not None:
-                    logger.info(f"Scanning for bluetooth device with ID: '{self.device_address}'...")
-                elif self.device_name is not None:
-                    logger.info(f"Scanning for bluetooth device with name: '{self.device_name}'...")
-                
-                async with BleakScanner(service_uuids=[UUIDs.DEVICE_CONFIG_UUID]) as scanner:
-                    async for tuple in scanner.advertisement_data():
-                        device = tuple[0]
-                        logging.info(f"Found BLE device: {device}")
-                        if self.device_address is not None and device.address == self.device_address:
-                            logging.info(f"Found matching device by address: {device}")
-                            self.__device = device
-                            break
-                        if self.device_name is not None and device.name == self.device_name:
-                            logging.info(f"Found matching device by name: {device}")
-                            self.__device = device
-                            break
+            self.__cancel_signal = asyncio.get_running_loop().create_future()
+
+            address = self.device_address or self.__last_address
+            direct_attempt = direct_connect and address is not None
+            if direct_attempt:
+                logger.info(f"Connecting to bluetooth device {address}...")
+                target = address
+            else:
+                target = await self.scan_for_device()
+
+            if self.__abort:
+                logger.debug("Aborting BLE connection and exiting loop")
+                return
+
+            if target is None:
+                failures += 1
+                direct_connect = True
+                await self.wait_before_retry(failures)
+                continue
 
+            try:
+                await self.connect_and_stream(target)
+                failures = 0
+                direct_connect = True
+            except Exception as e:
                 if self.__abort:
-                    logger.debug("Aborting BLE connection and exiting loop")
                     return
-                else:
-                    logger.info("Restarting BLE device scan")
-
-            def disconnected():
-                logger.info("BLE device has disconnected")
-                self.__cancel_signal.done()
-
-            # Run until the device is disconnected or the process is cancelled
-            logger.info(f"Found BLE device {self.__device}")
-            async with BleakClient(self.device,
-                                   disconnected_callback=disconnected()
-                                   ) as client:
-                logger.debug("Connected.")
-
-                logger.debug("Retriving device identification metadata...")
-                await self.retrieve_device_info(client)
-                
-                logger.debug("Initalizing VVM...")
-                await self.initalize_vvm(client)
-                
-                logger.debug("Configuring data streaming notifications...")
-                await self.setup_data_notifications(client)
-
-                logger.info("Enabling data streaming from BLE device")
-                await self.set_streaming_mode(client, enabled=True)
+                self.__connection_failures.inc()
+                failures += 1
+                logger.warning(f"Unable to connect to bluetooth device {target}: {e}")
+                # a failed direct connection falls back to scanning
+                direct_connect = not direct_attempt
+                await self.wait_before_retry(failures)
+        #end of self.abort loop
+
+    """
+    Runs the data recorder until the receiver is closed. It runs once for the
+    receiver, independently of the BLE connection attempts, and is restarted
+    with backoff if it fails so a recording error doesn't stop streaming.
+    """
+    async def run_recorder(self):
+        if self.data_recorder is None:
+            return
+
+        failures = 0
+        while not self.__abort:
+            try:
+                await self.data_recorder.run()
+                return
+            except Exception as e:
+                failures += 1
+                delay = reconnect_delay(failures, self.reconnect_initial_delay_seconds, self.retry_interval)
+                logger.exception(f"Data recording for engine {self.__engine_id} failed, "
+                                 f"restarting in {delay:.1f} seconds: {e}")
+                try:
+                    await asyncio.wait_for(self.__closed.wait(), delay)
+                except TimeoutError:
+                    pass
+
+    """
+    Scans for a device advertising the VVM service that matches the configured
+    address or name. Returns None if no device is found within rescan_timeout_seconds.
+    """
+    async def scan_for_device(self):
+        if self.device_address is not None:
+            logger.info(f"Scanning for bluetooth device with ID: '{self.device_address}'...")
+        elif self.device_name is not None:
+            logger.info(f"Scanning for bluetooth device with name: '{self.device_name}'...")
+
+        started = time.perf_counter()
+        device = await BleakScanner.find_device_by_filter(self.matches_device,
+                                                          timeout=self.rescan_timeout_seconds,
+                                                          service_uuids=[UUIDs.DEVICE_CONFIG_UUID])
+        self.__scan_seconds.observe(time.perf_counter() - started)
+        if device is None:
+            logger.info("No matching BLE device found within %s seconds", self.rescan_timeout_seconds)
+        else:
+            logger.info(f"Found BLE device {device}")
+        return device
+
+    def matches_device(self, device, advertisement_data):
+        logger.debug(f"Found BLE device: {device}")
+        if self.device_address is not None and device.address == self.device_address:
+            return True
+        return self.device_name is not None and device.name == self.device_name
+
+    """
+    Sleeps for the backoff delay, returns early when the receiver is closed
+    """
+    async def wait_before_retry(self, failures):
+        delay = reconnect_delay(failures, self.reconnect_initial_delay_seconds, self.retry_interval)
+        logger.info("Retrying BLE connection in %.1f seconds", delay)
+        await asyncio.wait([self.__cancel_signal], timeout=delay)
+
+    """
+    Connects to the device (a BLEDevice or an address) and streams engine data
+    until it disconnects or the receiver is closed
+    """
+    async def connect_and_stream(self, target):
+        timings = dict()
+        started = time.perf_counter()
+        async with BleakClient(target, disconnected_callback=self.device_disconnected,
+                               timeout=self.connect_timeout_seconds) as client:
+            timings["connect"] = time.perf_counter() - started
+            self.__connection_successes.inc()
+            logger.debug("Connected.")
+            self.__last_address = client.address
+            self.compile_decoders()
+            self.__publish_filter.reset()
+
+            device_info_task = None
+            try:
+                await self.bring_up_streaming(client, timings)
+                logger.info("Engine data streaming in %.3fs (%s)", time.perf_counter() - started,
+                            ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items()))
+
+                # identification data and cache refreshes aren't needed for streaming,
+                # so they run after data is flowing
+                device_info_task = asyncio.create_task(self.refresh_device_cache(client))
 
                 # run until the device is disconnected or
                 # the operation is terminated
-                self.__cancel_signal = asyncio.Future()
                 await self.__cancel_signal
-            
-            self.__device = None
-        #end of self.abort loop
+            finally:
+                if device_info_task is not None:
+                    if not device_info_task.done():
+                        device_info_task.cancel()
+                    elif not device_info_task.cancelled() and device_info_task.exception() is not None:
+                        logger.warning(f"Unable to read the device information: {device_info_task.exception()}")
 
+    """
+    Initializes the VVM and subscribes to the engine data notifications. The
+    subscriptions for the known parameters are issued concurrently with the
+    VVM initialization round trips, parameters that are only known from the
+    device's parameter configuration are subscribed to once it has been read.
+    """
+    async def bring_up_streaming(self, client: BleakClient, timings: dict):
+        phase_started = time.perf_counter()
+        self.__config_notifications = False
+
+        async def initialize():
+            logger.debug("Initalizing VVM...")
+            await self.initalize_vvm(client)
+            timings["initialize"] = time.perf_counter() - phase_started
+
+        async def subscribe():
+            logger.debug("Configuring data streaming notifications...")
+            await self.setup_data_notifications(client, list(self.__decoders))
+            timings["notifications"] = time.perf_counter() - phase_started
+
+        known_uuids = set(self.__decoders)
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(initialize())
+            tg.create_task(subscribe())
+
+        reported_uuids = [uuid for uuid in self.__decoders if uuid not in known_uuids]
+        if len(reported_uuids) > 0:
+            phase_started = time.perf_counter()
+            await self.setup_data_notifications(client, reported_uuids)
+            timings["reported notifications"] = time.perf_counter() - phase_started
+
+        logger.info("Enabling data streaming from BLE device")
+        phase_started = time.perf_counter()
+        await self.set_streaming_mode(client, enabled=True)
+        timings["streaming"] = time.perf_counter() - phase_started
 
-        def device_disconnected(self):
-            # handle the device disconnecting from the system
-            logger.warn("BLE device was disconnected. Will attempt to reconnect.")
-            self.abort = False
-            self.cancel_signal.done()
+    """
+    Called by bleak when the device disconnects, wakes up the run loop so it reconnects
+    """
+    def device_disconnected(self, client: BleakClient):
+        logger.warning("BLE device was disconnected. Will attempt to reconnect.")
+        if not self.__cancel_signal.done():
+            self.__cancel_signal.set_result(None)
 
     def configure_csv_output(self):
         fieldnames = ["timestamp",
@@ -144,10 +294,24 @@ class VesselViewMobileReceiver:
                 UUIDs.UNK_10D_UUID,
                 ]
         
-        if self.__config.csv_output_enabled:
-            self.csv_logger = CSVLogger(self.__config.csv_output_file, fieldnames)
+        options = {
+            "write_interval": self.__config.csv_write_interval,
+            "fsync_interval": self.__config.csv_fsync_interval,
+            "rotate_size": self.__config.csv_rotate_size,
+            "rotate_daily": self.__config.csv_rotate_daily,
+            "keep": self.__config.csv_output_keep,
+            "compression": self.__config.csv_compression
+        }
+
+        self.__record_notifications = False
+        if not self.__config.csv_output_enabled:
+            self.data_recorder = None
+        elif self.__config.recording_format == RecordingFormat.BINARY:
+            # every notification is recorded as-is in the binary telemetry log
+            self.data_recorder = TelemetryLogWriter(self.__config.csv_output_file, **options)
+            self.__record_notifications = True
         else:
-            self.csv_logger = None
+            self.data_recorder = CSVLogger(self.__config.csv_output_file, fieldnames, **options)
 
     """
     Disconnect from the BLE device and clean up anything we were doing to close down the loop
@@ -155,64 +319,140 @@ class VesselViewMobileReceiver:
     async def close(self):
         logger.info("Disconnecting from bluetooth device...")
         self.__abort = True
-        self.__cancel_signal.done()  # cancels the loop if we have a device and disconnects
+        self.__closed.set()
+        # cancels the loop if we have a device and disconnects
+        if not self.__cancel_signal.done():
+            self.__cancel_signal.set_result(None)
+        self.__notification_waiters.clear()
+        if self.data_recorder is not None:
+            await self.data_recorder.close()
         logger.debug("completed close operations")
 
     """
-    Enable BLE notifications for the charateristics that we're interested in
+    Enable BLE notifications for the charateristics that we're interested in.
+    The subscriptions are issued together so the backend can pipeline them
+    rather than waiting for a round trip per characteristic.
     """
-    async def setup_data_notifications(self, client: BleakClient):
-        logger.debug("enabling notifications on data chars")
+    async def setup_data_notifications(self, client: BleakClient, uuids):
+        logger.debug("enabling notifications on data chars: %s", uuids)
+
+        results = await asyncio.gather(*[client.start_notify(uuid, self.notification_handler) for uuid in uuids],
+                                       return_exceptions=True)
+        for uuid, result in zip(uuids, results):
+            if isinstance(result, BleakError):
+                logger.warning("Unable to enable notifications on %s: %s", uuid, result)
+            elif isinstance(result, BaseException):
+                raise result
 
-        for uuid in self.__signalk_parameter_map:
-            logger.debug("enabling notification on %s", uuid)
-            await client.start_notify(uuid, self.notification_handler)
+    """
+    Compiles the parameter map into immutable per-UUID decoders with the full
+    SignalK path and conversion resolved up front
+    """
+    def compile_decoders(self):
+        root_path = self.__signalk_root_path + "." + self.__engine_id
+        self.__decoders = compile_decoders(self.__signalk_parameter_map, root_path)
+        self.__header_decoders = dict()
+        self.__header_dispatch_uuids = frozenset()
+
+    """
+    Builds the header-indexed dispatch table from the parameter configuration
+    reported by the device. Parameters that aren't in the SignalK parameter map
+    are subscribed to and decoded as raw values.
+    """
+    def apply_parameter_configuration(self, parameters: dict):
+        known_parameters = dict()
+        for uuid, options in self.__signalk_parameter_map.items():
+            if "header" in options:
+                known_parameters[header_key(options["header"])] = (uuid, options)
+
+        unknown_path_prefix = None
+        if self.__config.publish_unknown_parameters:
+            unknown_path_prefix = "vvm"
+
+        root_path = self.__signalk_root_path + "." + self.__engine_id
+        self.__header_decoders = compile_header_decoders(parameters, known_parameters, root_path,
+                                                         UUIDs.engine_parameter_uuid, unknown_path_prefix)
+
+        for decoder in self.__header_decoders.values():
+            if decoder.uuid not in self.__decoders:
+                logger.info("Device reported parameter with header %s on %s", decoder.header.hex(), decoder.uuid)
+                self.__decoders[decoder.uuid] = decoder
+
+        # only engine parameters carry headers, other characteristics keep their own decoder
+        self.__header_dispatch_uuids = frozenset(uuid for uuid in self.__decoders
+                                                 if UUIDs.is_engine_parameter_uuid(uuid))
 
     """
     Handles BLE notifications and indications
     """
     def notification_handler(self, characteristic: BleakGATTCharacteristic, data: bytearray):
-        #Simple notification handler which prints the data received
         uuid = characteristic.uuid
-        logger.debug(f"Received notification from BLE - UUID: {uuid}; data: {data.hex()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received notification from BLE - UUID: %s; data: %s", uuid, data.hex())
+
+        counter = self.__notification_counters.get(uuid)
+        if counter is None:
+            counter = NOTIFICATIONS.labels(self.__engine_id, uuid)
+            self.__notification_counters[uuid] = counter
+        counter.value += 1
 
         # If the notification is about an engine property, we need to push
         # that information into the SignalK client as a property delta
-        if uuid in self.__signalk_parameter_map:
+        decoder = self.__decoders.get(uuid)
+        if decoder is not None:
+            # stamp the values once, the timestamp travels with them to SignalK and the recordings
+            timestamp, received = now_stamp()
+            started = time.perf_counter()
+            # route by the header bytes when the device told us which parameter
+            # each header carries, otherwise fall back to the characteristic
+            if uuid in self.__header_dispatch_uuids and len(data) >= 2:
+                decoder = self.__header_decoders.get(header_key(data), decoder)
+                # waiters and recordings follow the parameter that was published
+                uuid = decoder.uuid
+
             # decode data from byte array to underlying value (remove header bytes and convert to int)
-            decoded_value = self.strip_header_and_convert_to_int(data)
-            self.trigger_event_listener(uuid, decoded_value, False)
-            self.convert_and_publish_data(uuid, decoded_value)
+            decoded_value = decoder.decode(data)
+            # once streaming nobody waits on engine data, so skip the correlation lookups
+            if not self.skip_unawaited_triggers or uuid in self.__awaited_uuids:
+                self.trigger_event_listener(uuid, decoded_value, False)
+            self.convert_and_publish_data(decoder, decoded_value, timestamp, received)
 
             try:
-                if self.csv_logger is not None:
-                    if self.__config.csv_output_raw:
-                        self.csv_logger.update_property(uuid, data.hex())
+                if self.data_recorder is not None:
+                    if self.__record_notifications:
+                        self.data_recorder.record(uuid, data, timestamp)
+                    elif self.__config.csv_output_raw:
+                        self.data_recorder.update_property(uuid, data.hex(), timestamp)
                     else:
-                        self.csv_logger.update_property(uuid, decoded_value)
+                        self.data_recorder.update_property(uuid, decoded_value, timestamp)
             except Exception as e:
-                logger.warn(f"Unable to write data to CSV: {e}")
+                logger.warn(f"Unable to record data: {e}")
+
+            elapsed = time.perf_counter() - started
+            self.__decode_seconds.observe(elapsed)
+            if elapsed > self.slow_handler_seconds:
+                self.__slow_handlers.record(uuid, elapsed)
         else:
             logger.debug("Triggering notification for %s with data %s", uuid, data)
             self.trigger_event_listener(uuid, data, True)
 
-    def convert_and_publish_data(self, uuid, decoded_value):
-        options = self.__signalk_parameter_map[uuid]
-        if "convert" in options:
-            convert = options["convert"]
-            new_value = convert(decoded_value)
-            logger.debug("Converted value from %s to %s", decoded_value, new_value)
-        else:
-            new_value = decoded_value
-            logger.debug("No data conversion: %s", decoded_value)
+    """
+    Publish a decoded value stamped with timestamp, received is the monotonic
+    time it was stamped (see clock.now_stamp), both default to now
+    """
+    def convert_and_publish_data(self, decoder: 'ParameterDecoder', decoded_value, timestamp = None, received = None):
+        new_value = decoder.convert_value(decoded_value)
+        if decoder.path is None:
+            return
 
-        if "path" in options:        
-            path = self.__signalk_root_path + "." + self.__engine_id + "." + options["path"]
-            logger.debug(f"Publishing value {new_value} to path '{path}'")
-            self.publish_to_signalk(path, new_value)
-        else:
-            logger.debug(f"No path found for uuid: {uuid}")
+        if timestamp is None:
+            timestamp, received = now_stamp()
+        elif received is None:
+            received = time.monotonic()
+        if not self.__publish_filter.should_publish(decoder.key, new_value, received):
+            return
 
+        self.publish_to_signalk(decoder.path, new_value, timestamp)
 
     """
     Parses the byte stream from a device notification, strips
@@ -220,21 +460,17 @@ class VesselViewMobileReceiver:
     little endian byte order
     """
     def strip_header_and_convert_to_int(self, data):
-        logger.debug("Recieved data from device: %s" ,data)
         data = data[2:]  # remove the header bytes
-        value = int.from_bytes(data, byteorder='little')
-        logger.debug("Converted to value: %s", value)
-        return value
+        return int.from_bytes(data, byteorder='little')
 
     """
     Submits the latest information received from the device to the SignalK
-    websocket
+    send queue, with the time it was received (see clock.py). The publish
+    function must not block.
     """
-    def publish_to_signalk(self, path, value):
-        logger.debug("Publishing delta to path: '%s', value '%s'", path, value)
+    def publish_to_signalk(self, path, value, timestamp):
         if self.__publish_delta_func is not None:
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.__publish_delta_func(path, value))
+            self.__publish_delta_func(path, value, timestamp)
         else:
             logging.info("Cannot publish to signalk")
 
@@ -246,6 +482,18 @@ class VesselViewMobileReceiver:
     async def initalize_vvm(self, client: BleakClient):
         logger.debug("initalizing VVM device...")
 
+        # the cached configuration is only valid for the same firmware revision
+        self.__firmware_revision = await self.read_text(client, UUIDs.FIRMWARE_REV_UUID)
+        cached = self.__device_cache.get(client.address, self.__firmware_revision)
+        if cached is not None and cached.get("parameters") is not None and self.handshakes_match(cached):
+            logger.info("Using cached device configuration for %s (firmware %s)",
+                        client.address, self.__firmware_revision)
+            self.apply_parameter_configuration(cached["parameters"])
+            self.__refresh_device_cache = True
+            return
+
+        self.__refresh_device_cache = False
+
         # read 0302 as byte array
         try:
             data1 = await self.read_char(client, UUIDs.DEVICE_STARTUP_UUID)
@@ -258,21 +506,85 @@ class VesselViewMobileReceiver:
 
         # Indicates which parameters are available on the device
         parameters = await self.request_device_parameter_config(client)
+        if parameters is None:
+            cached = self.__device_cache.get(client.address)
+            if cached is not None and cached.get("parameters") is not None:
+                logger.info("Using cached device parameter configuration")
+                parameters = cached["parameters"]
+
+        if parameters is not None:
+            self.apply_parameter_configuration(parameters)
+
+        handshakes = await self.perform_handshakes(client)
+        self.__device_cache.update(client.address, self.__firmware_revision,
+                                   parameters=parameters, handshakes=handshakes)
+
+    """
+    Requests sent to DEVICE_NEXT_UUID during initialization, with the responses
+    that have been observed from the VVM
+    """
+    handshakes = [
+        (bytes([0x10, 0x27, 0x0]), "00102701010001"),
+        (bytes([0xCA, 0x0F, 0x0]), "00ca0f01010000"),
+        (bytes([0xC8, 0x0F, 0x0]), "00c80f01040000000000"),
+    ]
 
-        data = bytes([0x10, 0x27, 0x0])
-        result = await self.request_configuration_data(client, UUIDs.DEVICE_NEXT_UUID, data)
-        logger.info("Response: %s, expected: 00102701010001", result.hex())
-        # expected result = 00102701010001
+    """
+    Sends the initialization handshakes and returns the responses, keyed by request
+    """
+    async def perform_handshakes(self, client: BleakClient):
+        responses = dict()
+        for data, expected in self.handshakes:
+            result = await self.request_configuration_data(client, UUIDs.DEVICE_NEXT_UUID, data)
+            if result is None:
+                logger.info("No response to %s, expected: %s", data.hex(), expected)
+                continue
+            if result.hex() == expected:
+                logger.info("Response: %s", result.hex())
+            else:
+                logger.warning("Unexpected response to %s: %s, expected: %s", data.hex(), result.hex(), expected)
+            responses[data.hex()] = result.hex()
+        return responses
 
-        data = bytes([0xCA, 0x0F, 0x0])
-        result = await self.request_configuration_data(client, UUIDs.DEVICE_NEXT_UUID, data)
-        logger.info("Response: %s, expected: 00ca0f01010000", result.hex())
-        # expected result = 00ca0f01010000
+    """
+    A cached configuration is only used if every handshake got the expected response
+    """
+    def handshakes_match(self, cached: dict):
+        responses = cached.get("handshakes") or dict()
+        return all(responses.get(data.hex()) == expected for data, expected in self.handshakes)
 
-        data = bytes([0xC8, 0x0F, 0x0])
-        result = await self.request_configuration_data(client, UUIDs.DEVICE_NEXT_UUID, data)
-        logger.info("Response: %s, expected: 00c80f01040000000000", result.hex())
-        # expected result = 00c80f01040000000000
+    """
+    Runs in the background once data is streaming: reads the device identification
+    and, when the connection was set up from the device cache, repeats the parameter
+    dump and handshakes to refresh the cache. Streaming is paused while they run,
+    as it is during a cold initialization.
+    """
+    async def refresh_device_cache(self, client: BleakClient):
+        try:
+            device_info = await self.retrieve_device_info(client)
+            if not self.__refresh_device_cache:
+                self.__device_cache.update(client.address, self.__firmware_revision, device_info=device_info)
+                return
+
+            logger.debug("Refreshing cached device configuration...")
+            cached = self.__device_cache.get(client.address, self.__firmware_revision) or dict()
+            await self.set_streaming_mode(client, enabled=False)
+            try:
+                parameters = await self.request_device_parameter_config(client)
+                if parameters is not None and parameters != cached.get("parameters"):
+                    logger.info("Device parameter configuration has changed since it was cached")
+                    subscribed = set(self.__decoders)
+                    self.apply_parameter_configuration(parameters)
+                    await self.setup_data_notifications(client, [uuid for uuid in self.__decoders
+                                                                 if uuid not in subscribed])
+
+                handshakes = await self.perform_handshakes(client)
+            finally:
+                await self.set_streaming_mode(client, enabled=True)
+            self.__device_cache.update(client.address, self.__firmware_revision,
+                                       parameters=parameters, device_info=device_info, handshakes=handshakes)
+        except (BleakError, TimeoutError) as e:
+            logger.warning(f"Unable to refresh the device configuration: {e}")
 
     """
     Enable or disable engine data streaming via characteristic notifications
@@ -293,7 +605,10 @@ class VesselViewMobileReceiver:
     async def request_device_parameter_config(self, client: BleakClient):
         
         logger.info("Requesting device parameter configuration data")
-        await client.start_notify(UUIDs.DEVICE_CONFIG_UUID, self.notification_handler)
+        # the indications stay enabled for the rest of the connection
+        if not self.__config_notifications:
+            await client.start_notify(UUIDs.DEVICE_CONFIG_UUID, self.notification_handler)
+            self.__config_notifications = True
         
         # Requests the initial data dump from 001
         data = bytes([0x28, 0x00, 0x03, 0x01])
@@ -301,20 +616,24 @@ class VesselViewMobileReceiver:
         uuid = UUIDs.DEVICE_CONFIG_UUID
         keys = [0,1,2,3,4,5,6,7,8,9]        # data is returned as a series of 10 updates to the UUID
         
-        future_data = [self.future_data_for_uuid(uuid, key) for key in keys]
+        # the registry fails the futures after the timeout, that's the only deadline
+        future_data = [self.future_data_for_uuid(uuid, key, timeout=self.parameter_config_timeout_seconds) for key in keys]
 
         try:
-            async with asyncio.timeout(10):
-                await client.write_gatt_char(uuid, data, response=True)
-                result_data = await asyncio.gather(*future_data)
+            await client.write_gatt_char(uuid, data, response=True)
+            result_data = await asyncio.gather(*future_data)
 
-                parameters = self.decode_parameter_configuration(result_data)
-                logger.info(f"Device parameters: {parameters}")
-                return parameters
+            parameters = self.decode_parameter_configuration(result_data)
+            logger.info(f"Device parameters: {parameters}")
+            return parameters
             
         except TimeoutError:
             logger.debug("timeout waiting for configuration data to return")
             return None
+        finally:
+            # nothing waits on the rest once the write or a segment has failed
+            for future in future_data:
+                future.cancel()
     
 
     """
@@ -361,50 +680,56 @@ class VesselViewMobileReceiver:
         # add an event lisener to the queue
         logger.debug("writing data to char %s with value %s", uuid, data.hex())
 
-        future_data_result = self.future_data_for_uuid(uuid)
-        await client.write_gatt_char(uuid, data, response=True)
-        
+        future_data_result = self.future_data_for_uuid(uuid, timeout=self.configuration_data_timeout_seconds)
+
         # wait for an indication to arrive on the UUID specified, and then
         # return that data to the caller here.
 
         try:
-            async with asyncio.timeout(5):
-                result = await future_data_result
-                logger.debug("received future data %s on %s", result.hex(), uuid)
-                return result
+            await client.write_gatt_char(uuid, data, response=True)
+            result = await future_data_result
+            logger.debug("received future data %s on %s", result.hex(), uuid)
+            return result
         except TimeoutError:
             logger.debug("timeout waiting for configuration data to return")
         finally:
+            future_data_result.cancel()
             await client.stop_notify(uuid)
 
 
     """
-    Generate a promise for the data that will be received in the future for a given characteristic
+    Generate a promise for the data that will be received in the future for a given
+    characteristic. With a key the promise is for the next raw notification whose
+    first byte matches the key (e.g. a segment of the parameter dump).
     """
-    def future_data_for_uuid(self, uuid: str, key = None):
+    def future_data_for_uuid(self, uuid: str, key = None, timeout = None):
         logger.debug("future promise for data on uuid: %s, key: %s", uuid, key)
-        id = uuid
-        if key is not None:
-            id = f"{uuid}+{key}"
-
-        return self.__notification_queue.register(id)
+        future = self.__notification_waiters.register((uuid, key), timeout)
+
+        # count the waiters for each UUID so notifications nobody awaits skip triggering
+        awaited = self.__awaited_uuids
+        awaited[uuid] = awaited.get(uuid, 0) + 1
+        future.add_done_callback(lambda _: self.release_awaited_uuid(uuid))
+        return future
+
+    def release_awaited_uuid(self, uuid: str):
+        count = self.__awaited_uuids.get(uuid, 0) - 1
+        if count > 0:
+            self.__awaited_uuids[uuid] = count
+        else:
+            self.__awaited_uuids.pop(uuid, None)
 
 
     """
     Trigger the waiting Futures when data is received
     """
     def trigger_event_listener(self, uuid: str, data, raw_bytes_from_device):
-        logger.debug(f"triggering event listener for {uuid} with data: {data}")
-        self.__notification_queue.trigger(uuid, data)
+        waiters = self.__notification_waiters
+        waiters.trigger((uuid, None), data)
         
         # handle promises for data based on the uuid + first byte of the response if raw data
-        if raw_bytes_from_device:
-            try:
-                id = f"{uuid}+{int(data[0])}"
-                logger.debug(f"triggering notification handler on id: {id}")
-                self.__notification_queue.trigger(id, data)
-            except Exception as e:
-                logger.warning(f"Exception triggering notification: {e}")
+        if raw_bytes_from_device and len(data) > 0:
+            waiters.trigger((uuid, data[0]), data)
 
     """
     Read data from the BLE device with consistent error handling
@@ -427,18 +752,34 @@ class VesselViewMobileReceiver:
     Retrieves the BLE standard data for the device
     """
     async def retrieve_device_info(self, client: BleakClient):
+        fields = [
+            ("Model Number", UUIDs.MODEL_NBR_UUID),
+            ("Device Name", UUIDs.DEVICE_NAME_UUID),
+            ("Manufacturer Name", UUIDs.MANUFACTURER_NAME_UUID),
+            ("Firmware Revision", UUIDs.FIRMWARE_REV_UUID),
+        ]
 
-        model_number = await self.read_char(client, UUIDs.MODEL_NBR_UUID)
-        logger.info("Model Number: {0}".format("".join(map(chr, model_number))))
-        
-        device_name = await self.read_char(client, UUIDs.DEVICE_NAME_UUID)
-        logger.info("Device Name: {0}".format("".join(map(chr, device_name))))
+        try:
+            values = await asyncio.gather(*[self.read_text(client, uuid) for _, uuid in fields])
+        except BleakError as e:
+            logger.warning(f"Unable to read device identification: {e}")
+            return None
 
-        manufacturer_name = await self.read_char(client, UUIDs.MANUFACTURER_NAME_UUID)
-        logger.info("Manufacturer Name: {0}".format("".join(map(chr, manufacturer_name))))
+        device_info = dict()
+        for (name, _), value in zip(fields, values):
+            if value is not None:
+                logger.info("{0}: {1}".format(name, value))
+                device_info[name] = value
+        return device_info
 
-        firmware_revision = await self.read_char(client, UUIDs.FIRMWARE_REV_UUID)
-        logger.info("Firmware Revision: {0}".format("".join(map(chr, firmware_revision))))
+    """
+    Read a string characteristic, returns None if it isn't available
+    """
+    async def read_text(self, client: BleakClient, uuid: str):
+        value = await self.read_char(client, uuid)
+        if value is None:
+            return None
+        return "".join(map(chr, value))
 
 
 class UUIDs:
@@ -470,6 +811,18 @@ class UUIDs:
     UNK_10C_UUID = "0000010c-0000-1000-8000-ec55f9f5b963"
     UNK_10D_UUID = "0000010d-0000-1000-8000-ec55f9f5b963"
 
+    """
+    Engine parameters are reported in order on consecutive characteristics
+    starting at 0102 (parameter 0000 is RPM on 0102, 0008 is oil pressure on 010a)
+    """
+    def engine_parameter_uuid(index: int):
+        return f"{0x0102 + index:08x}-0000-1000-8000-ec55f9f5b963"
+
+    def is_engine_parameter_uuid(uuid: str):
+        if not uuid.endswith("-0000-1000-8000-ec55f9f5b963"):
+            return False
+        return 0x0102 <= int(uuid[:8], 16) <= 0x01ff
+
 class Conversion:
     def rpm_to_hertz(rpm):
         return rpm / 60.0
@@ -494,15 +847,52 @@ class Conversion:
     def millivolts_to_volts(value):
         return value / 1000.0
 
+"""
+Engine parameters published to SignalK, keyed by characteristic UUID. Paths are
+relative to propulsion.<engine id>, header and width are the header bytes and
+value size documented in docs/decoding.md.
+"""
+SIGNALK_PARAMETER_MAP = {
+    UUIDs.ENGINE_RPM_UUID: { "path": "revolutions", "convert": Conversion.rpm_to_hertz, "header": [0x01, 0x00], "width": 8 },
+    UUIDs.COOLANT_TEMPERATURE_UUID: { "path": "temperature", "convert": Conversion.celsius_to_kelvin, "header": [0xd2, 0x00], "width": 8 },
+    UUIDs.BATTERY_VOLTAGE_UUID: { "path": "alternatorVoltage", "convert": Conversion.millivolts_to_volts, "header": [0xe8, 0x00], "width": 8 },
+    UUIDs.ENGINE_RUNTIME_UUID: { "path": "runTime", "convert": Conversion.minutes_to_seconds, "header": [0x96, 0x00], "width": 16 },
+    UUIDs.CURRENT_FUEL_FLOW_UUID: {"path": "fuel.rate", "convert": Conversion.centiliters_to_cubic_meters, "header": [0x0a, 0x00], "width": 16 },
+    UUIDs.OIL_PRESSURE_UUID: { "path": "oilPressure", "convert": Conversion.decapascals_to_pascals, "header": [0xb5, 0x00], "width": 16 },
+    UUIDs.UNK_105_UUID: { "header": [0x70, 0x17], "width": 16 },
+    UUIDs.UNK_108_UUID: { "header": [0x40, 0x1f], "width": 8 },
+    UUIDs.UNK_109_UUID: { "header": [0x10, 0x27], "width": 1 },
+    UUIDs.UNK_10B_UUID: { "header": [0xd4, 0x00], "width": 8 },
+    UUIDs.UNK_10C_UUID: { "header": [0xb6, 0x00], "width": 8 },
+    UUIDs.UNK_10D_UUID: { "header": [0xfb, 0x00], "width": 8 },
+    UUIDs.DEVICE_201_UUID: {}
+}
+
+class RecordingFormat:
+    DECODED = "decoded"         # CSV of decoded values, one row per second
+    RAW = "raw"                 # CSV of payload hex strings, one row per second
+    BINARY = "binary"           # binary telemetry log of every notification
+    ALL = [DECODED, RAW, BINARY]
+
 class BleConnectionConfig:
     def __init__(self):
         self.__device_address = None
         self.__device_name = None
+        self.__engine_id = "0"
         self.__retry_interval = 30
+        self.__device_cache_file = "./config/device_cache.json"
         self.__csv_output_enabled = True
         self.__csv_output_file = "./logs/data.csv"
         self.__csv_output_keep = 0
-        self.__csv_output_format_raw = False
+        self.__recording_format = RecordingFormat.DECODED
+        self.__csv_write_interval = 10
+        self.__csv_fsync_interval = 60
+        self.__csv_rotate_size = 0
+        self.__csv_rotate_daily = False
+        self.__csv_compression = "gzip"
+        self.__publish_filters = dict()
+        self.__default_publish_filter = None
+        self.__publish_unknown_parameters = False
 
     @property
     def device_address(self):
@@ -520,6 +910,14 @@ class BleConnectionConfig:
     def device_name(self, value):
         self.__device_name = value
 
+    @property
+    def engine_id(self):
+        return self.__engine_id
+
+    @engine_id.setter
+    def engine_id(self, value):
+        self.__engine_id = value
+
     @property
     def retry_interval(self):
         return self.__retry_interval
@@ -528,6 +926,14 @@ class BleConnectionConfig:
     def retry_interval(self, value):
         self.__retry_interval = value
 
+    @property
+    def device_cache_file(self):
+        return self.__device_cache_file
+
+    @device_cache_file.setter
+    def device_cache_file(self, value):
+        self.__device_cache_file = value
+
     @property
     def csv_output_enabled(self):
         return self.__csv_output_enabled
@@ -552,6 +958,70 @@ class BleConnectionConfig:
     def csv_output_keep(self, value):
         self.__csv_output_keep = value
 
+    @property
+    def publish_filters(self):
+        return self.__publish_filters
+
+    @publish_filters.setter
+    def publish_filters(self, value):
+        self.__publish_filters = value
+
+    @property
+    def default_publish_filter(self):
+        return self.__default_publish_filter
+
+    @default_publish_filter.setter
+    def default_publish_filter(self, value):
+        self.__default_publish_filter = value
+
+    @property
+    def publish_unknown_parameters(self):
+        return self.__publish_unknown_parameters
+
+    @publish_unknown_parameters.setter
+    def publish_unknown_parameters(self, value):
+        self.__publish_unknown_parameters = value
+
+    @property
+    def csv_write_interval(self):
+        return self.__csv_write_interval
+
+    @csv_write_interval.setter
+    def csv_write_interval(self, value):
+        self.__csv_write_interval = value
+
+    @property
+    def csv_fsync_interval(self):
+        return self.__csv_fsync_interval
+
+    @csv_fsync_interval.setter
+    def csv_fsync_interval(self, value):
+        self.__csv_fsync_interval = value
+
+    @property
+    def csv_rotate_size(self):
+        return self.__csv_rotate_size
+
+    @csv_rotate_size.setter
+    def csv_rotate_size(self, value):
+        self.__csv_rotate_size = value
+
+    @property
+    def csv_rotate_daily(self):
+        return self.__csv_rotate_daily
+
+    @csv_rotate_daily.setter
+    def csv_rotate_daily(self, value):
+        self.__csv_rotate_daily = value
+
+    @property
+    def csv_compression(self):
+        return self.__csv_compression
+
+    @csv_compression.setter
+    def csv_compression(self, value):
+        self.__csv_compression = value
+
     @property
     def valid(self):
         return self.__device_name is not None or self.__device_address is not None
@@ -559,9 +1029,19 @@ class BleConnectionConfig:
 
     @property
     def csv_output_raw(self):
-        return self.__csv_output_format_raw
+        return self.__recording_format == RecordingFormat.RAW
     
     @csv_output_raw.setter
     def csv_output_raw(self, value):
-        self.__csv_output_format_raw = value
+        self.__recording_format = RecordingFormat.RAW if value else RecordingFormat.DECODED
+
+    @property
+    def recording_format(self):
+        return self.__recording_format
+
+    @recording_format.setter
+    def recording_format(self, value):
+        if value not in RecordingFormat.ALL:
+            raise ValueError(f"Unknown data recording output: {value}")
+        self.__recording_format = value
     
\ No newline at end of file
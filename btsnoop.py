@@ -0,0 +1,201 @@
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+"""
+Streaming reader for btsnoop HCI captures (e.g. the Android 'btsnoop_hci.log'
+files in bt-logs). Pulls the ATT notifications and indications out of the
+capture so they can be replayed without a BLE device.
+
+File format: https://fte.com/webhelpii/hsu/Content/Technical_Information/BT_Snooper/BTSnoop_File_Format.htm
+"""
+
+BTSNOOP_MAGIC = b"btsnoop\x00"
+FILE_HEADER = struct.Struct(">8sII")
+RECORD_HEADER = struct.Struct(">IIIIq")
+
+DATALINK_HCI_UNENCAPSULATED = 1001
+DATALINK_HCI_UART = 1002
+
+# microseconds between 0000-01-01 (btsnoop epoch) and 1970-01-01
+BTSNOOP_EPOCH_DELTA_US = 0x00DCDDB30F2F8000
+
+HCI_ACL_PACKET = 0x02
+L2CAP_ATT_CID = 0x0004
+
+ATT_READ_BY_TYPE_RSP = 0x09
+ATT_HANDLE_VALUE_NTF = 0x1B
+ATT_HANDLE_VALUE_IND = 0x1D
+
+ACL_PB_CONTINUATION = 0x01
+
+BLUETOOTH_BASE_UUID = "0000{:04x}-0000-1000-8000-00805f9b34fb"
+
+
+class BtSnoopFormatError(Exception):
+    pass
+
+
+"""
+A single ATT notification or indication read from the capture
+"""
+class AttNotification:
+    __slots__ = ("timestamp_us", "connection", "handle", "value", "indication")
+
+    def __init__(self, timestamp_us, connection, handle, value, indication):
+        self.timestamp_us = timestamp_us
+        self.connection = connection
+        self.handle = handle
+        self.value = value
+        self.indication = indication
+
+    def __repr__(self):
+        return (f"AttNotification(timestamp_us={self.timestamp_us}, handle=0x{self.handle:04x}, "
+                f"value={self.value.hex()}, indication={self.indication})")
+
+
+class BtSnoopReader:
+    def __init__(self, file):
+        self.__file = file
+        self.__datalink = None
+        self.__acl_buffers = dict()
+        self.__handle_uuids = dict()
+
+    """
+    Characteristic value handle to UUID mappings discovered from GATT
+    discovery traffic in the capture so far
+    """
+    @property
+    def handle_uuids(self):
+        return self.__handle_uuids
+
+    def read_header(self):
+        header = self.__file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise BtSnoopFormatError("File is too short to be a btsnoop capture")
+
+        magic, version, datalink = FILE_HEADER.unpack(header)
+        if magic != BTSNOOP_MAGIC:
+            raise BtSnoopFormatError("Missing btsnoop file signature")
+        if datalink not in (DATALINK_HCI_UNENCAPSULATED, DATALINK_HCI_UART):
+            raise BtSnoopFormatError(f"Unsupported btsnoop datalink type: {datalink}")
+
+        logger.debug("btsnoop version %s, datalink %s", version, datalink)
+        self.__datalink = datalink
+
+    """
+    Yields (timestamp_us, flags, packet) for every record in the capture.
+    Timestamps are converted to microseconds since the unix epoch.
+    """
+    def records(self):
+        if self.__datalink is None:
+            self.read_header()
+
+        read = self.__file.read
+        header_size = RECORD_HEADER.size
+        while True:
+            header = read(header_size)
+            if len(header) < header_size:
+                return
+
+            _, included_length, flags, _, timestamp = RECORD_HEADER.unpack(header)
+            packet = read(included_length)
+            if len(packet) < included_length:
+                logger.warning("Truncated record at the end of the capture")
+                return
+
+            yield timestamp - BTSNOOP_EPOCH_DELTA_US, flags, packet
+
+    """
+    Yields every ATT notification and indication received from the remote device
+    """
+    def notifications(self):
+        for timestamp, flags, packet in self.records():
+            if self.__datalink == DATALINK_HCI_UART:
+                if len(packet) == 0 or packet[0] != HCI_ACL_PACKET:
+                    continue
+                acl = packet[1:]
+            elif flags & 0x02:
+                # command or event in an un-encapsulated capture
+                continue
+            else:
+                acl = packet
+
+            pdu = self.__reassemble(acl)
+            if pdu is None:
+                continue
+
+            connection, att = pdu
+            if len(att) == 0:
+                continue
+
+            opcode = att[0]
+            if opcode == ATT_HANDLE_VALUE_NTF or opcode == ATT_HANDLE_VALUE_IND:
+                if len(att) < 3:
+                    continue
+                handle = att[1] | (att[2] << 8)
+                yield AttNotification(timestamp, connection, handle, bytes(att[3:]),
+                                      opcode == ATT_HANDLE_VALUE_IND)
+            elif opcode == ATT_READ_BY_TYPE_RSP:
+                self.__record_characteristic_declarations(att)
+
+    """
+    Rebuilds L2CAP frames which were fragmented over several ACL packets and
+    returns (connection handle, ATT PDU) once a complete ATT frame is available
+    """
+    def __reassemble(self, acl):
+        if len(acl) < 4:
+            return None
+
+        handle_flags, length = struct.unpack_from("<HH", acl)
+        connection = handle_flags & 0x0FFF
+        boundary = (handle_flags >> 12) & 0x03
+        payload = acl[4:4 + length]
+
+        if boundary == ACL_PB_CONTINUATION:
+            buffer = self.__acl_buffers.get(connection)
+            if buffer is None:
+                return None
+            buffer.extend(payload)
+        else:
+            buffer = bytearray(payload)
+            self.__acl_buffers[connection] = buffer
+
+        if len(buffer) < 4:
+            return None
+
+        l2cap_length, cid = struct.unpack_from("<HH", buffer)
+        if len(buffer) < l2cap_length + 4:
+            return None
+
+        del self.__acl_buffers[connection]
+        if cid != L2CAP_ATT_CID:
+            return None
+        return connection, buffer[4:4 + l2cap_length]
+
+    def __record_characteristic_declarations(self, att):
+        if len(att) < 2:
+            return
+
+        # Characteristic declarations are 2 byte handle, 1 byte properties,
+        # 2 byte value handle and a 16-bit or 128-bit UUID
+        entry_length = att[1]
+        if entry_length not in (7, 21):
+            return
+
+        for offset in range(2, len(att) - entry_length + 1, entry_length):
+            entry = att[offset:offset + entry_length]
+            value_handle = entry[3] | (entry[4] << 8)
+            self.__handle_uuids[value_handle] = format_uuid(entry[5:])
+
+
+"""
+Formats a little endian 16-bit or 128-bit UUID from an ATT PDU
+"""
+def format_uuid(data):
+    if len(data) == 2:
+        return BLUETOOTH_BASE_UUID.format(data[0] | (data[1] << 8))
+
+    value = bytes(reversed(data)).hex()
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
@@ -0,0 +1,95 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Settings that control when a new value for a path is worth publishing
+"""
+class FilterRule:
+    def __init__(self, deadband = 0, relative_deadband = 0, min_interval = 0, heartbeat_interval = None):
+        self.deadband = deadband
+        self.relative_deadband = relative_deadband
+        self.min_interval = min_interval
+        self.heartbeat_interval = heartbeat_interval
+
+    """
+    Create a rule from a dictionary loaded from the YAML configuration file
+    """
+    def from_config(values: dict, base: 'FilterRule' = None):
+        if base is None:
+            base = FilterRule()
+
+        heartbeat = values.get('heartbeat-seconds', base.heartbeat_interval)
+        min_interval = values.get('min-interval-ms')
+        relative_deadband = values.get('deadband-percent')
+
+        return FilterRule(
+            deadband=values.get('deadband', base.deadband),
+            relative_deadband=base.relative_deadband if relative_deadband is None else relative_deadband / 100.0,
+            min_interval=base.min_interval if min_interval is None else min_interval / 1000.0,
+            heartbeat_interval=heartbeat
+        )
+
+    def __repr__(self):
+        return (f"FilterRule(deadband={self.deadband}, relative_deadband={self.relative_deadband}, "
+                f"min_interval={self.min_interval}, heartbeat_interval={self.heartbeat_interval})")
+
+
+"""
+Per-path change detection. Suppresses values which have not moved outside of
+the deadband since the last published value, while still publishing at least
+once per heartbeat interval so consumers know the data is live.
+"""
+class ChangeFilter:
+    def __init__(self, rules: dict = None, default_rule: FilterRule = None):
+        self.__rules = rules if rules is not None else dict()
+        self.__default_rule = default_rule
+        self.__last_published = dict()
+        self.__suppressed_count = 0
+
+    @property
+    def suppressed_count(self):
+        return self.__suppressed_count
+
+    def rule_for_path(self, path):
+        return self.__rules.get(path, self.__default_rule)
+
+    """
+    Returns True if the value should be published for the path and records it
+    as the last published value
+    """
+    def should_publish(self, path, value, now = None):
+        rule = self.rule_for_path(path)
+        if rule is None:
+            return True
+
+        if now is None:
+            now = time.monotonic()
+
+        last = self.__last_published.get(path)
+        if last is None or self.__value_changed(rule, last[0], value, now - last[1]):
+            self.__last_published[path] = (value, now)
+            return True
+
+        self.__suppressed_count += 1
+        return False
+
+    def __value_changed(self, rule: FilterRule, last_value, value, elapsed):
+        if elapsed < rule.min_interval:
+            return False
+
+        if rule.heartbeat_interval is not None and elapsed >= rule.heartbeat_interval:
+            return True
+
+        if value == last_value:
+            return False
+
+        delta = abs(value - last_value)
+        return delta > rule.deadband and delta > rule.relative_deadband * abs(last_value)
+
+    """
+    Forget the last published values, e.g. after reconnecting to a device
+    """
+    def reset(self):
+        self.__last_published.clear()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Timestamps for engine data. A notification is stamped once, when it is
+received, and the stamp travels with its values through publishing, buffering
+and recording as integer nanoseconds since the unix epoch.
+
+Stamps come from the monotonic clock anchored to the wall clock, so they are
+cheap to take and don't follow small adjustments of the system clock. When
+the system clock is stepped by more than STEP_THRESHOLD_NS, for example when
+NTP first syncs on a Pi without an RTC after the bridge has started,
+check_wall_clock() re-anchors to the new wall clock and logs the step. The
+watchdog calls it on every tick. Stamps then jump with the system clock, so
+anything that measures intervals keeps the monotonic time it took with the
+stamp (see now_stamp), and telemetry queries don't rely on stamps being in
+order (see telemetry_query.py). Stamps are only turned into text when they
+are written out, by formatters that cache the rendered second and millisecond.
+"""
+
+ANCHOR_WALL_NS = time.time_ns()
+ANCHOR_MONOTONIC_NS = time.monotonic_ns()
+OFFSET_NS = ANCHOR_WALL_NS - ANCHOR_MONOTONIC_NS
+
+STEP_THRESHOLD_NS = 100_000_000
+
+
+def now_ns():
+    return time.monotonic_ns() + OFFSET_NS
+
+
+"""
+(timestamp ns, monotonic seconds) for now, from one reading of the monotonic
+clock. Keep the monotonic time for interval checks on values that are
+stamped, monotonic_seconds() is off for stamps taken before a re-anchor.
+"""
+def now_stamp():
+    monotonic = time.monotonic_ns()
+    return monotonic + OFFSET_NS, monotonic / 1e9
+
+
+"""
+Re-anchor to the wall clock if it has been stepped since the last anchor,
+returns the step in nanoseconds (0 if the clock wasn't stepped)
+"""
+def check_wall_clock(threshold_ns = None):
+    global ANCHOR_WALL_NS, ANCHOR_MONOTONIC_NS, OFFSET_NS
+    wall = time.time_ns()
+    monotonic = time.monotonic_ns()
+    step = (wall - monotonic) - OFFSET_NS
+    if abs(step) <= (STEP_THRESHOLD_NS if threshold_ns is None else threshold_ns):
+        return 0
+
+    ANCHOR_WALL_NS = wall
+    ANCHOR_MONOTONIC_NS = monotonic
+    OFFSET_NS = wall - monotonic
+    logger.warning("System clock was stepped by %.3f seconds, timestamps follow the new time", step / 1e9)
+    return step
+
+
+"""
+Checks the wall clock periodically, for when the watchdog isn't running
+"""
+async def watch_wall_clock(interval = 1.0):
+    while True:
+        await asyncio.sleep(interval)
+        check_wall_clock()
+
+
+"""
+Seconds on the monotonic clock for a timestamp, for comparing against
+time.monotonic(). Only valid for stamps taken since the last re-anchor.
+"""
+def monotonic_seconds(timestamp_ns):
+    return (timestamp_ns - OFFSET_NS) / 1e9
+
+
+"""
+Formats timestamps with a strftime pattern, optionally followed by milliseconds.
+The text for the last second and the last millisecond is cached, since values
+arrive many times per millisecond and strftime is comparatively slow.
+"""
+class TimestampFormatter:
+    def __init__(self, pattern, milliseconds = True, utc = True, suffix = ""):
+        self.__pattern = pattern
+        self.__convert = time.gmtime if utc else time.localtime
+        self.__suffix = suffix
+        self.__fractions = [f".{i:03d}{suffix}" for i in range(1000)] if milliseconds else None
+        self.__second = None
+        self.__prefix = None
+        self.__millisecond = None
+        self.__text = None
+
+    def format(self, timestamp_ns):
+        millisecond = timestamp_ns // 1_000_000
+        if millisecond == self.__millisecond:
+            return self.__text
+
+        second = millisecond // 1000
+        if second != self.__second:
+            self.__second = second
+            self.__prefix = time.strftime(self.__pattern, self.__convert(second))
+
+        if self.__fractions is not None:
+            text = self.__prefix + self.__fractions[millisecond % 1000]
+        else:
+            text = self.__prefix + self.__suffix
+        self.__millisecond = millisecond
+        self.__text = text
+        return text
+
+
+# ISO 8601 UTC with milliseconds, as SignalK expects in update timestamps
+ISO_FORMATTER = TimestampFormatter("%Y-%m-%dT%H:%M:%S", suffix="Z")
+
+
+def format_iso(timestamp_ns):
+    return ISO_FORMATTER.format(timestamp_ns)
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Correlates responses with the requests waiting for them. Waiters register a
+key (for example a (uuid, segment) tuple or a SignalK requestId) and get a
+Future that is resolved by the next trigger for that key. Any number of
+waiters can share a key.
+
+Each waiter has a deadline: waiters that are still pending when it passes
+fail with TimeoutError and are removed, so requests whose response never
+arrives don't leak. Deadlines are kept in a heap and swept by a single timer
+that is scheduled for the earliest one.
+"""
+class CorrelationRegistry:
+    def __init__(self, default_timeout = 30.0):
+        self.default_timeout = default_timeout
+        self.__waiters = dict()
+        self.__deadlines = []
+        self.__timer = None
+        self.__timer_deadline = None
+        self.__sequence = 0
+        self.__outstanding = 0
+        self.__expired = 0
+        self.__triggered = 0
+        self.__unmatched = 0
+
+    """
+    Number of waiters that have not been resolved yet
+    """
+    @property
+    def outstanding_count(self):
+        return self.__outstanding
+
+    """
+    Number of waiters that timed out before their key was triggered
+    """
+    @property
+    def expired_count(self):
+        return self.__expired
+
+    @property
+    def triggered_count(self):
+        return self.__triggered
+
+    """
+    Number of triggers that didn't have a waiter
+    """
+    @property
+    def unmatched_count(self):
+        return self.__unmatched
+
+    def __contains__(self, key):
+        return key in self.__waiters
+
+    """
+    Return a Future for the next value triggered for key. The Future fails
+    with TimeoutError if nothing is triggered within timeout seconds, None
+    uses the default timeout.
+    """
+    def register(self, key, timeout = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        waiters = self.__waiters.get(key)
+        if waiters is None:
+            self.__waiters[key] = [future]
+        else:
+            waiters.append(future)
+        self.__outstanding += 1
+        future.add_done_callback(lambda f: self.__discard(key, f))
+
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is not None:
+            deadline = loop.time() + timeout
+            self.__sequence += 1
+            heapq.heappush(self.__deadlines, (deadline, self.__sequence, future))
+            if self.__timer_deadline is None or deadline < self.__timer_deadline:
+                self.__schedule(loop, deadline)
+        return future
+
+    def register_callback(self, key, func: callable, timeout = None):
+        future = self.register(key, timeout)
+        future.add_done_callback(func)
+        return future
+
+    """
+    Resolve every waiter for key with value, returns the number of waiters resolved
+    """
+    def trigger(self, key, value):
+        waiters = self.__waiters.pop(key, None)
+        if waiters is None:
+            self.__unmatched += 1
+            return 0
+
+        resolved = 0
+        for future in waiters:
+            if not future.done():
+                future.set_result(value)
+                resolved += 1
+        self.__triggered += resolved
+        return resolved
+
+    """
+    Fail the waiters whose deadline has passed
+    """
+    def sweep(self):
+        self.__timer = None
+        self.__timer_deadline = None
+        if len(self.__deadlines) == 0:
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while len(self.__deadlines) > 0 and self.__deadlines[0][0] <= now:
+            _, _, future = heapq.heappop(self.__deadlines)
+            if not future.done():
+                self.__expired += 1
+                future.set_exception(TimeoutError())
+
+        # drop entries that were resolved before their deadline
+        while len(self.__deadlines) > 0 and self.__deadlines[0][2].done():
+            heapq.heappop(self.__deadlines)
+        if len(self.__deadlines) > 0:
+            self.__schedule(loop, self.__deadlines[0][0])
+
+    """
+    Cancel every outstanding waiter
+    """
+    def clear(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+            self.__timer_deadline = None
+        waiters = self.__waiters
+        self.__waiters = dict()
+        self.__deadlines = []
+        for futures in waiters.values():
+            for future in futures:
+                future.cancel()
+
+    def __schedule(self, loop, deadline):
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__timer = loop.call_at(deadline, self.sweep)
+        self.__timer_deadline = deadline
+
+    def __discard(self, key, future):
+        self.__outstanding -= 1
+        waiters = self.__waiters.get(key)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if len(waiters) == 0:
+                del self.__waiters[key]
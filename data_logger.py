@@ -1,36 +1,306 @@
+import asyncio
+import concurrent.futures
 import csv
-import threading
+import glob
+import gzip
+import logging
+import os
+import shutil
+import time
 from datetime import datetime
 
-class CSVLogger:
-    def __init__(self, filename, fieldnames):
+import metrics
+from clock import TimestampFormatter, now_ns
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.REGISTRY.histogram("vvm_recording_flush_seconds", "Time to write pending data to the recording file")
+
+"""
+Base class for recording files. Runs as a task on the event loop: pending data
+is written in batches through a file handle that stays open, and the file is
+fsync'd on a slower cadence so the SD card isn't hit on every write.
+
+The file is rotated when it grows past rotate_size bytes and/or when the day
+changes. Rotated segments are compressed on a worker thread and only the most
+recent `keep` segments are kept (0 keeps everything).
+"""
+class SegmentedRecorder:
+
+    binary = False
+
+    def __init__(self, filename, row_interval = 1.0, write_interval = 10.0, fsync_interval = 60.0,
+                 rotate_size = 0, rotate_daily = False, keep = 0, compression = "gzip"):
         self.filename = filename
+        self.row_interval = row_interval
+        self.write_interval = write_interval
+        self.fsync_interval = fsync_interval
+        self.rotate_size = rotate_size
+        self.rotate_daily = rotate_daily
+        self.keep = keep
+        self.compression = compression
+
+        self._file = None
+        self.__segment_date = None
+        self.__last_write = 0
+        self.__last_fsync = 0
+        self.__fsync = None
+        self.__segment_worker = None
+        self.__finishing = None
+        self.__closed = False
+
+    """
+    Main loop for the recorder, runs until close() is called
+    """
+    async def run(self):
+        if self.__closed:
+            return
+        self.open()
+        while not self.__closed:
+            await asyncio.sleep(self.row_interval)
+            if self.__closed:
+                break
+            self.snapshot()
+
+            now = time.monotonic()
+            if now - self.__last_write >= self.write_interval:
+                self.write_rows()
+                if self.should_rotate():
+                    self.rotate(asyncio.get_running_loop())
+            if now - self.__last_fsync >= self.fsync_interval and self._file is not None:
+                self.__last_fsync = now
+                await self.fsync()
+
+    """
+    fsync the current segment on a worker thread. close() waits for it, so the
+    file isn't closed underneath the worker.
+    """
+    async def fsync(self):
+        self.__fsync = asyncio.get_running_loop().run_in_executor(None, os.fsync, self._file.fileno())
+        try:
+            await self.__fsync
+        except OSError as e:
+            logger.warning(f"Unable to sync data recording {self.filename}: {e}")
+        finally:
+            self.__fsync = None
+
+    def open(self):
+        if self._file is not None:
+            return
+
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # append to an existing segment, and only write the header to new segments
+        new_segment = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        if new_segment:
+            self.__segment_date = datetime.now().date()
+        else:
+            self.__segment_date = datetime.fromtimestamp(os.path.getmtime(self.filename)).date()
+
+        if self.binary:
+            self._file = open(self.filename, 'ab')
+        else:
+            self._file = open(self.filename, 'a', newline='')
+        self.segment_opened(new_segment)
+        self.__last_write = self.__last_fsync = time.monotonic()
+
+    def should_rotate(self):
+        if self._file is None:
+            return False
+        if self.rotate_daily and datetime.now().date() != self.__segment_date:
+            return True
+        return self.rotate_size > 0 and self._file.tell() >= self.rotate_size
+
+    """
+    Close the current segment, rename it with a timestamp and start a new one.
+    Compression and pruning of old segments happen on a single worker thread,
+    so segments are finished one at a time and in order.
+    """
+    def rotate(self, loop = None):
+        self._file.close()
+        self._file = None
+
+        base, extension = os.path.splitext(self.filename)
+        segment = f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{extension}"
+        os.replace(self.filename, segment)
+        logger.info("Rotated data recording to %s", segment)
+        self.open()
+
+        if loop is not None:
+            if self.__segment_worker is None:
+                self.__segment_worker = concurrent.futures.ThreadPoolExecutor(1, "recording-segments")
+            self.__finishing = loop.run_in_executor(self.__segment_worker, finish_segment, segment,
+                                                    self.compression, self.filename, self.keep)
+            self.__finishing.add_done_callback(lambda future: segment_finished(segment, future))
+        else:
+            try:
+                finish_segment(segment, self.compression, self.filename, self.keep)
+            except Exception as e:
+                logger.warning(f"Unable to compress data recording segment {segment}: {e}")
+
+    def write_rows(self):
+        self.__last_write = time.monotonic()
+        if self._file is None:
+            return
+        started = time.perf_counter()
+        if self.write_pending():
+            self._file.flush()
+            FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    """
+    Write any pending data and close the file. The file is opened for data
+    recorded before run() opened it.
+    """
+    async def close(self):
+        self.__closed = True
+        if self.__fsync is not None:
+            await asyncio.wait([self.__fsync])
+
+        self.snapshot()
+        if self._file is None and self.has_pending():
+            self.open()
+        if self._file is not None:
+            self.write_rows()
+            await self.fsync()
+            self._file.close()
+            self._file = None
+
+        # segments are finished in order, so this waits for all of them
+        if self.__finishing is not None:
+            await asyncio.wait([self.__finishing])
+            self.__finishing = None
+        if self.__segment_worker is not None:
+            self.__segment_worker.shutdown()
+            self.__segment_worker = None
+
+    def segment_opened(self, new_segment):
+        pass
+
+    def snapshot(self):
+        pass
+
+    def has_pending(self):
+        return False
+
+    """
+    Write pending data to self._file, returns True if anything was written
+    """
+    def write_pending(self):
+        return False
+
+
+"""
+Records the latest value of each property to a CSV file. Once per row interval
+the current values are snapshotted into a row if anything changed. Rows are
+stamped, in local time with milliseconds, with the time the newest value in
+them was received.
+"""
+class CSVLogger(SegmentedRecorder):
+    def __init__(self, filename, fieldnames, **kwargs):
+        super().__init__(filename, **kwargs)
         self.fieldnames = fieldnames
         self.data = {field: None for field in fieldnames}
-        self.timer = None
-        
-        # Create the CSV file and write the header
-        with open(self.filename, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames)
-            writer.writeheader()
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.log_to_csv()
-    
+
+        self.__writer = None
+        self.__rows = []
+        self.__dirty = False
+        self.__timestamp = None
+        self.__formatter = TimestampFormatter("%Y-%m-%d %H:%M:%S", utc=False)
+
     def update_properties(self, **kwargs):
         for key, value in kwargs.items():
             if key in self.data:
-                self.data[key] = value
+                self.update_property(key, value)
 
-    def update_property(self, key, value):
+    def update_property(self, key, value, timestamp = None):
         self.data[key] = value
-        self.data["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if self.timer is None:
-            self.timer = threading.Timer(1.0, self.log_to_csv)
-            self.timer.start()
-    
-    def log_to_csv(self):
-        with open(self.filename, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames)
-            writer.writerow(self.data)
-        self.timer = None
\ No newline at end of file
+        self.__timestamp = timestamp
+        self.__dirty = True
+
+    def segment_opened(self, new_segment):
+        self.__writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction='ignore')
+        if new_segment:
+            self.__writer.writeheader()
+
+    """
+    Capture the current values as a row, if anything changed since the last row
+    """
+    def snapshot(self):
+        if not self.__dirty:
+            return
+
+        timestamp = self.__timestamp if self.__timestamp is not None else now_ns()
+        self.data["timestamp"] = self.__formatter.format(timestamp)
+        self.__rows.append(dict(self.data))
+        self.__dirty = False
+
+    def has_pending(self):
+        return len(self.__rows) > 0
+
+    def write_pending(self):
+        if len(self.__rows) == 0:
+            return False
+
+        self.__writer.writerows(self.__rows)
+        logger.debug("Wrote %s rows to %s", len(self.__rows), self.filename)
+        self.__rows.clear()
+        return True
+
+
+"""
+Compress a rotated segment and remove segments beyond the number to keep.
+Runs on the recorder's segment worker thread.
+"""
+def finish_segment(segment, compression, filename, keep):
+    target = compress_file(segment, compression)
+    prune_segments(filename, keep, target[len(segment):])
+
+
+def segment_finished(segment, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Unable to compress data recording segment {segment}: {future.exception()}")
+
+
+def compress_file(path, compression):
+    if compression is None or compression == "none":
+        return path
+
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, compressing with gzip instead")
+        compression = "gzip"
+
+    if compression == "zstd":
+        target = path + ".zst"
+        with open(path, "rb") as source, open(target + ".tmp", "wb") as destination:
+            zstandard.ZstdCompressor().copy_stream(source, destination)
+    else:
+        target = path + ".gz"
+        with open(path, "rb") as source, gzip.open(target + ".tmp", "wb") as destination:
+            shutil.copyfileobj(source, destination)
+
+    os.replace(target + ".tmp", target)
+    os.remove(path)
+    return target
+
+
+"""
+Remove the oldest finished segments, those ending in the compression suffix
+(".gz", ".zst" or "" when segments aren't compressed). Segments that are still
+waiting to be compressed are never removed.
+"""
+def prune_segments(filename, keep, suffix = ""):
+    if keep is None or keep <= 0:
+        return
+
+    base, extension = os.path.splitext(filename)
+    segments = sorted(glob.glob(f"{glob.escape(base)}-*{extension}{suffix}"))
+    for path in segments[:-keep]:
+        logger.debug("Removing old data recording segment %s", path)
+        os.remove(path)
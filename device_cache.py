@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+"""
+Persistent cache of what a VVM reports during connection setup: the decoded
+parameter configuration, the device identification and the responses to the
+initialization handshakes. Entries are keyed by device address and firmware
+revision, since the answers only change when the firmware does.
+
+The cache is a small JSON file that may be shared by several receivers, so
+each update re-reads the file and replaces it atomically.
+"""
+class DeviceCache:
+    def __init__(self, filename):
+        self.filename = filename
+        self.__entries = dict()
+        self.load()
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as file:
+                self.__entries = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable device cache {self.filename}: {e}")
+            self.__entries = dict()
+
+    """
+    Returns the cached entry for the device, or None. Without a firmware
+    revision the entry for any firmware revision is returned.
+    """
+    def get(self, address, firmware_revision = None):
+        entry = self.__entries.get(address)
+        if entry is None:
+            return None
+        if firmware_revision is not None and entry.get("firmware_revision") != firmware_revision:
+            return None
+        return entry
+
+    """
+    Updates the entry for a device with the values that aren't None and writes the cache file
+    """
+    def update(self, address, firmware_revision, parameters = None, device_info = None, handshakes = None):
+        self.load()
+        entry = self.__entries.get(address)
+        if entry is None or entry.get("firmware_revision") != firmware_revision:
+            entry = {"firmware_revision": firmware_revision}
+            self.__entries[address] = entry
+
+        if parameters is not None:
+            entry["parameters"] = parameters
+        if device_info is not None:
+            entry["device_info"] = device_info
+        if handshakes is not None:
+            entry["handshakes"] = handshakes
+        self.save()
+        return entry
+
+    def save(self):
+        if not self.filename:
+            return
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.filename + ".tmp", "w") as file:
+                json.dump(self.__entries, file, indent=2, sort_keys=True)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError as e:
+            logger.warning(f"Unable to write device cache {self.filename}: {e}")
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+
+import clock
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG_SECONDS = metrics.REGISTRY.histogram("vvm_event_loop_lag_seconds",
+                                              "How late the event loop ran the watchdog's timer", LAG_BUCKETS)
+SLOW_HANDLERS = metrics.REGISTRY.counter("vvm_slow_handlers_total",
+                                         "Notification handler calls that took longer than the threshold",
+                                         labels=("engine",))
+
+"""
+Measures event loop scheduling lag: the watchdog sleeps for a fixed interval
+and records how much later than requested it was woken up. Any callback that
+holds the loop (a slow handler, JSON encoding, a blocking file write) shows up
+as lag. Lag is exported as a histogram and percentiles are logged periodically.
+Each tick also checks whether the system clock was stepped (see clock.py).
+"""
+class LoopWatchdog:
+    def __init__(self, config: 'WatchdogConfig'):
+        self.__config = config
+        self.__abort = False
+        self.__lag = metrics.Histogram(LAG_BUCKETS)
+        self.__max_lag = 0.0
+
+    @property
+    def max_lag(self):
+        return self.__max_lag
+
+    """
+    Lag percentiles since the last report, in seconds (upper bound of the bucket)
+    """
+    def percentiles(self):
+        return {
+            "p50": self.__lag.quantile(0.5),
+            "p99": self.__lag.quantile(0.99),
+            "max": self.__max_lag,
+        }
+
+    def record_lag(self, lag):
+        self.__lag.observe(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag > self.__max_lag:
+            self.__max_lag = lag
+        if lag >= self.__config.lag_threshold_ms / 1000.0:
+            logger.warning("Event loop stalled for %.1f ms", lag * 1000)
+
+    def report(self):
+        if self.__lag.count > 0:
+            values = self.percentiles()
+            logger.info("Event loop lag over %s samples: p50 <= %.1f ms, p99 <= %.1f ms, max %.1f ms",
+                        self.__lag.count, values["p50"] * 1000, values["p99"] * 1000, values["max"] * 1000)
+        self.__lag = metrics.Histogram(LAG_BUCKETS)
+        self.__max_lag = 0.0
+
+    async def run(self):
+        interval = self.__config.interval_ms / 1000.0
+        report_interval = self.__config.report_interval
+        next_report = time.monotonic() + report_interval
+        while not self.__abort:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self.record_lag(max(0.0, now - expected))
+            clock.check_wall_clock()
+
+            if report_interval > 0 and now >= next_report:
+                self.report()
+                next_report = now + report_interval
+
+    def close(self):
+        self.__abort = True
+
+
+"""
+Counts slow notification handler calls and logs them, at most once per
+log_interval seconds so a struggling system isn't flooded
+"""
+class SlowHandlerMonitor:
+    log_interval = 10.0
+
+    def __init__(self, name):
+        self.name = name
+        self.__counter = SLOW_HANDLERS.labels(name)
+        self.__last_log = 0.0
+        self.__suppressed = 0
+
+    def record(self, description, duration):
+        self.__counter.inc()
+        now = time.monotonic()
+        if now - self.__last_log < self.log_interval:
+            self.__suppressed += 1
+            return
+        logger.warning("Slow notification handler for engine %s: %s took %.1f ms (%s more since last report)",
+                       self.name, description, duration * 1000, self.__suppressed)
+        self.__last_log = now
+        self.__suppressed = 0
+
+
+"""
+Switch asyncio to uvloop when it is installed, returns True if uvloop is used
+"""
+def install_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("uvloop is not installed, using the default asyncio event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+class WatchdogConfig:
+    def __init__(self):
+        self.__enabled = True
+        self.__interval_ms = 100
+        self.__lag_threshold_ms = 250
+        self.__handler_threshold_ms = 10
+        self.__report_interval = 300
+        self.__use_uvloop = False
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.__enabled = value
+
+    @property
+    def interval_ms(self):
+        return self.__interval_ms
+
+    @interval_ms.setter
+    def interval_ms(self, value):
+        self.__interval_ms = value
+
+    """
+    Lag above which a stall is logged as a warning
+    """
+    @property
+    def lag_threshold_ms(self):
+        return self.__lag_threshold_ms
+
+    @lag_threshold_ms.setter
+    def lag_threshold_ms(self, value):
+        self.__lag_threshold_ms = value
+
+    """
+    Notification handler duration above which the call is counted as slow
+    """
+    @property
+    def handler_threshold_ms(self):
+        return self.__handler_threshold_ms
+
+    @handler_threshold_ms.setter
+    def handler_threshold_ms(self, value):
+        self.__handler_threshold_ms = value
+
+    """
+    Seconds between lag percentile log lines, 0 disables them
+    """
+    @property
+    def report_interval(self):
+        return self.__report_interval
+
+    @report_interval.setter
+    def report_interval(self, value):
+        self.__report_interval = value
+
+    @property
+    def use_uvloop(self):
+        return self.__use_uvloop
+
+    @use_uvloop.setter
+    def use_uvloop(self, value):
+        self.__use_uvloop = value
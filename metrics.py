@@ -0,0 +1,280 @@
+import asyncio
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Minimal Prometheus-style metrics. Metrics are created once, up front, and
+updating them on the hot path is an attribute update: counters and histogram
+buckets are plain numbers in pre-allocated slots and labelled series are
+resolved to a child metric when the caller is set up, not per event. The
+text exposition format is only rendered when the endpoint is scraped.
+"""
+
+SECONDS_BUCKETS_FAST = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.01)
+SECONDS_BUCKETS_IO = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SECONDS_BUCKETS_SLOW = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(names, values):
+    if len(names) == 0:
+        return ""
+    pairs = ",".join('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+"""
+Counters and gauges either hold a value or, when func is set, read their
+value from func when they are scraped (for values another object already counts)
+"""
+class Counter:
+    __slots__ = ("value", "func")
+
+    def __init__(self):
+        self.value = 0
+        self.func = None
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def set_function(self, func):
+        self.func = func
+
+    def samples(self, name, label_text):
+        value = self.func() if self.func is not None else self.value
+        yield f"{name}{label_text} {format_value(value)}"
+
+
+class Gauge:
+    __slots__ = ("value", "func")
+
+    def __init__(self):
+        self.value = 0
+        self.func = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, func):
+        self.func = func
+
+    def samples(self, name, label_text):
+        value = self.func() if self.func is not None else self.value
+        yield f"{name}{label_text} {format_value(value)}"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    """
+    Approximate quantile from the bucket counts (upper bound of the bucket it falls in)
+    """
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def samples(self, name, label_text):
+        inner = label_text[1:-1] + "," if label_text else ""
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{inner}le="{format_value(float(bound))}"}} {cumulative}'
+        yield f"{name}_sum{label_text} {format_value(self.sum)}"
+        yield f"{name}_count{label_text} {self.count}"
+
+
+"""
+A named metric, optionally with labels. Each distinct set of label values is
+a child series, which callers should resolve once with labels() and keep.
+"""
+class Metric:
+    def __init__(self, kind, name, help, label_names, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.__factory = factory
+        self.__children = dict()
+        if len(self.label_names) == 0:
+            self.__default = self.labels()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        child = self.__children.get(values)
+        if child is None:
+            child = self.__factory()
+            self.__children[values] = child
+        return child
+
+    def inc(self, amount = 1):
+        self.__default.inc(amount)
+
+    def set(self, value):
+        self.__default.set(value)
+
+    def observe(self, value):
+        self.__default.observe(value)
+
+    """
+    Read the value of an unlabelled metric from func when it is scraped
+    """
+    def set_function(self, func):
+        self.__default.set_function(func)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.__children.items():
+            lines.extend(child.samples(self.name, format_labels(self.label_names, values)))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.__metrics = dict()
+
+    def counter(self, name, help, labels = ()):
+        return self.register(Metric("counter", name, help, labels, Counter))
+
+    def gauge(self, name, help, labels = ()):
+        return self.register(Metric("gauge", name, help, labels, Gauge))
+
+    def histogram(self, name, help, buckets = SECONDS_BUCKETS_IO, labels = ()):
+        buckets = tuple(sorted(buckets))
+        return self.register(Metric("histogram", name, help, labels, lambda: Histogram(buckets)))
+
+    """
+    Metrics are registered once per process, registering an existing name returns the existing metric
+    """
+    def register(self, metric: Metric):
+        existing = self.__metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self.__metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self.__metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# the process wide registry served by the metrics endpoint
+REGISTRY = MetricsRegistry()
+
+
+"""
+Serves the registry as Prometheus text on GET /metrics
+"""
+class MetricsServer:
+    def __init__(self, config: 'MetricsConfig', registry: MetricsRegistry = REGISTRY):
+        self.__config = config
+        self.__registry = registry
+        self.__server = None
+
+    @property
+    def port(self):
+        if self.__server is None:
+            return self.__config.port
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self.__server = await asyncio.start_server(self.handle_request, self.__config.host, self.__config.port)
+        logger.info("Serving metrics on http://%s:%s/metrics", self.__config.host, self.port)
+
+    async def close(self):
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # skip the request headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.__registry.render().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+                content_type = "text/plain; charset=utf-8"
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+
+class MetricsConfig:
+    def __init__(self):
+        self.__enabled = False
+        self.__host = "127.0.0.1"
+        self.__port = 9108
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.__enabled = value
+
+    @property
+    def host(self):
+        return self.__host
+
+    @host.setter
+    def host(self, value):
+        self.__host = value
+
+    @property
+    def port(self):
+        return self.__port
+
+    @port.setter
+    def port(self, value):
+        self.__port = value
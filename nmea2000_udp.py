@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import struct
+
+from clock import format_iso
+from publish_queue import PublishQueue
+from sinks import OutputSink
+
+logger = logging.getLogger(__name__)
+
+"""
+NMEA 2000 engine PGNs for the values the bridge publishes, sent as canboat
+"plain" text lines over UDP, the format the SignalK server's and canboat's
+NMEA 2000 inputs read:
+
+    <timestamp>,<priority>,<pgn>,<source>,<destination>,<length>,<hex byte>,...
+
+    127488  Engine Parameters, Rapid Update: speed, boost pressure, trim
+    127489  Engine Parameters, Dynamic: oil pressure and temperature, coolant
+            temperature, alternator voltage, fuel rate, engine hours, ...
+
+Fields are taken from the SignalK paths below propulsion.<engine id> and
+converted from SignalK units to the PGN's resolution. Fields without a value
+are sent as "not available".
+"""
+
+PGN_ENGINE_RAPID = 127488
+PGN_ENGINE_DYNAMIC = 127489
+
+RAPID_FIELDS = ("revolutions", "boostPressure", "drive.trimState")
+DYNAMIC_FIELDS = ("oilPressure", "oilTemperature", "temperature", "alternatorVoltage", "fuel.rate", "runTime",
+                  "coolantPressure", "fuel.pressure", "engineLoad", "engineTorque")
+
+ENGINE_RAPID = struct.Struct("<BHHbH")
+ENGINE_DYNAMIC = struct.Struct("<BHHHhhIHHBHHbb")
+
+
+def unsigned_field(value, resolution, bits):
+    not_available = (1 << bits) - 1
+    if value is None:
+        return not_available
+    raw = round(value / resolution)
+    if raw < 0 or raw > not_available - 2:
+        # out of range
+        return not_available - 1
+    return raw
+
+
+def signed_field(value, resolution, bits):
+    not_available = (1 << (bits - 1)) - 1
+    if value is None:
+        return not_available
+    raw = round(value / resolution)
+    if raw < -not_available - 1 or raw > not_available - 2:
+        return not_available - 1
+    return raw
+
+
+"""
+127488 payload from SignalK values: revolutions in Hz, boost pressure in Pa and trim as a ratio
+"""
+def encode_engine_rapid(instance, values: dict):
+    return ENGINE_RAPID.pack(
+        instance,
+        unsigned_field(none_or(values.get("revolutions"), lambda hz: hz * 60), 0.25, 16),
+        unsigned_field(values.get("boostPressure"), 100, 16),
+        signed_field(none_or(values.get("drive.trimState"), lambda ratio: ratio * 100), 1, 8),
+        0xffff)
+
+
+"""
+127489 payload from SignalK values: pressures in Pa, temperatures in K, voltage in V,
+fuel rate in m3/s, engine hours in s, load and torque as ratios
+"""
+def encode_engine_dynamic(instance, values: dict):
+    return ENGINE_DYNAMIC.pack(
+        instance,
+        unsigned_field(values.get("oilPressure"), 100, 16),
+        unsigned_field(values.get("oilTemperature"), 0.1, 16),
+        unsigned_field(values.get("temperature"), 0.01, 16),
+        signed_field(values.get("alternatorVoltage"), 0.01, 16),
+        signed_field(none_or(values.get("fuel.rate"), lambda rate: rate * 3600000), 0.1, 16),
+        unsigned_field(values.get("runTime"), 1, 32),
+        unsigned_field(values.get("coolantPressure"), 100, 16),
+        unsigned_field(values.get("fuel.pressure"), 1000, 16),
+        0xff,
+        0, 0,
+        signed_field(none_or(values.get("engineLoad"), lambda ratio: ratio * 100), 1, 8),
+        signed_field(none_or(values.get("engineTorque"), lambda ratio: ratio * 100), 1, 8))
+
+
+def none_or(value, convert):
+    return None if value is None else convert(value)
+
+
+def format_plain(timestamp_ns, priority, pgn, source, destination, data: bytes):
+    return f"{format_iso(timestamp_ns)},{priority},{pgn},{source},{destination},{len(data)}," + ",".join(f"{b:02x}" for b in data)
+
+
+class EngineState:
+    def __init__(self, instance):
+        self.instance = instance
+        self.values = dict()
+        self.rapid_timestamp = None
+        self.dynamic_timestamp = None
+        self.last_dynamic = None
+
+
+"""
+Sends engine PGNs to a UDP listener. Values are collected for
+rapid_interval, then 127488 is sent for each engine whose rapid fields
+changed and 127489 for each engine whose dynamic fields changed, at most
+once per dynamic_interval. A 127489 held back by dynamic_interval is sent
+when the interval expires, and when the sink is closed.
+"""
+class Nmea2000UdpSink(OutputSink):
+    def __init__(self, config: 'Nmea2000Config'):
+        super().__init__("nmea2000-udp", config.queue_size, PublishQueue.LATEST_PER_PATH)
+        self.__config = config
+        self.__transport = None
+        self.__engines = dict()
+        self.__paths = dict()
+        self.__unknown_engines = set()
+
+    async def send_loop(self):
+        loop = asyncio.get_running_loop()
+        self.__transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramErrorLogger(self._failures), remote_addr=(self.__config.host, self.__config.port))
+        logger.info("Sending NMEA 2000 engine PGNs to udp://%s:%s", self.__config.host, self.__config.port)
+        try:
+            while not self.closed:
+                values = await self.next_batch(self.__config.rapid_interval, self.dynamic_delay(loop.time()))
+                for line in self.update(values, loop.time()):
+                    self.__transport.sendto(line.encode() + b"\n")
+            for line in self.update(self.take_pending(), loop.time(), final=True):
+                self.__transport.sendto(line.encode() + b"\n")
+        finally:
+            self.__transport.close()
+            self.__transport = None
+
+    """
+    Seconds until a held back 127489 is due, None when there is none
+    """
+    def dynamic_delay(self, now):
+        delay = None
+        for engine in self.__engines.values():
+            if engine.dynamic_timestamp is not None and engine.last_dynamic is not None:
+                due = max(0, engine.last_dynamic + self.__config.dynamic_interval - now)
+                delay = due if delay is None else min(delay, due)
+        return delay
+
+    """
+    Apply a batch of path: (value, timestamp) and return the plain lines to
+    send, final sends held back 127489s regardless of dynamic_interval
+    """
+    def update(self, values: dict, now, final = False):
+        for path, (value, timestamp) in values.items():
+            field = self.field_for_path(path)
+            if field is None:
+                continue
+            engine, key = field
+            engine.values[key] = value
+            if key in RAPID_FIELDS:
+                engine.rapid_timestamp = timestamp
+            else:
+                engine.dynamic_timestamp = timestamp
+
+        config = self.__config
+        lines = []
+        for engine in self.__engines.values():
+            if engine.rapid_timestamp is not None:
+                lines.append(format_plain(engine.rapid_timestamp, config.priority, PGN_ENGINE_RAPID,
+                                          config.source_address, 255, encode_engine_rapid(engine.instance, engine.values)))
+                engine.rapid_timestamp = None
+            if engine.dynamic_timestamp is not None and (final or engine.last_dynamic is None or
+                                                         now - engine.last_dynamic >= config.dynamic_interval):
+                lines.append(format_plain(engine.dynamic_timestamp, config.priority, PGN_ENGINE_DYNAMIC,
+                                          config.source_address, 255, encode_engine_dynamic(engine.instance, engine.values)))
+                engine.dynamic_timestamp = None
+                engine.last_dynamic = now
+        return lines
+
+    """
+    The engine and field for a SignalK path, or None if the path isn't sent
+    """
+    def field_for_path(self, path):
+        field = self.__paths.get(path, False)
+        if field is not False:
+            return field
+
+        field = None
+        parts = path.split(".", 2)
+        if len(parts) == 3 and parts[0] == "propulsion" and parts[2] in RAPID_FIELDS + DYNAMIC_FIELDS:
+            instance = self.engine_instance(parts[1])
+            if instance is not None:
+                engine = self.__engines.get(instance)
+                if engine is None:
+                    engine = EngineState(instance)
+                    self.__engines[instance] = engine
+                field = (engine, parts[2])
+        self.__paths[path] = field
+        return field
+
+    def engine_instance(self, engine_id):
+        instance = self.__config.engine_instances.get(engine_id)
+        if instance is None and engine_id.isdigit():
+            instance = int(engine_id)
+        if instance is None or not 0 <= instance <= 252:
+            if engine_id not in self.__unknown_engines:
+                self.__unknown_engines.add(engine_id)
+                logger.warning("No NMEA 2000 engine instance for engine %s, add it to engine-instances", engine_id)
+            return None
+        return instance
+
+
+class DatagramErrorLogger(asyncio.DatagramProtocol):
+    def __init__(self, failures):
+        self.__failures = failures
+
+    def error_received(self, exc):
+        self.__failures.inc()
+        logger.debug(f"Error sending NMEA 2000 datagram: {exc}")
+
+
+class Nmea2000Config:
+    def __init__(self):
+        self.__enabled = False
+        self.__host = "127.0.0.1"
+        self.__port = 10110
+        self.__source_address = 0
+        self.__priority = 2
+        self.__rapid_interval = 0.1
+        self.__dynamic_interval = 0.5
+        self.__engine_instances = dict()
+        self.__queue_size = 100
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.__enabled = value
+
+    @property
+    def host(self):
+        return self.__host
+
+    @host.setter
+    def host(self, value):
+        self.__host = value
+
+    @property
+    def port(self):
+        return self.__port
+
+    @port.setter
+    def port(self, value):
+        self.__port = value
+
+    """
+    The NMEA 2000 source address the PGNs are sent from
+    """
+    @property
+    def source_address(self):
+        return self.__source_address
+
+    @source_address.setter
+    def source_address(self, value):
+        self.__source_address = value
+
+    @property
+    def priority(self):
+        return self.__priority
+
+    @priority.setter
+    def priority(self, value):
+        self.__priority = value
+
+    @property
+    def rapid_interval(self):
+        return self.__rapid_interval
+
+    @rapid_interval.setter
+    def rapid_interval(self, value):
+        self.__rapid_interval = value
+
+    @property
+    def dynamic_interval(self):
+        return self.__dynamic_interval
+
+    @dynamic_interval.setter
+    def dynamic_interval(self, value):
+        self.__dynamic_interval = value
+
+    """
+    NMEA 2000 engine instance for each engine id, numeric engine ids are used as is
+    """
+    @property
+    def engine_instances(self):
+        return self.__engine_instances
+
+    @engine_instances.setter
+    def engine_instances(self, value):
+        self.__engine_instances = value
+
+    @property
+    def queue_size(self):
+        return self.__queue_size
+
+    @queue_size.setter
+    def queue_size(self, value):
+        self.__queue_size = value
@@ -0,0 +1,181 @@
+import collections
+import logging
+import os
+
+from signalk_codec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+"""
+Holds deltas that couldn't be sent while the SignalK server was unreachable,
+oldest first. Each delta is a dictionary of path: (value, timestamp), so the
+values keep the time they were produced.
+
+Deltas are kept in memory until memory_size of them are waiting, then the
+whole batch is written to a segment file in directory and memory starts
+over. Segments are read back one at a time, oldest first, and a segment file
+is only deleted once all of its deltas have been removed, so deltas written to
+disk survive a restart of the bridge. When more than max_segments segments are
+waiting the oldest is dropped. Without a directory the buffer is a ring of
+memory_size deltas that drops the oldest.
+
+    segment-<sequence>.jsonl    one {"path": [value, timestamp]} object per line
+"""
+class OutboundBuffer:
+    def __init__(self, memory_size = 1000, directory = None, max_segments = 100):
+        self.__memory_size = memory_size
+        self.__directory = directory
+        self.__max_segments = max_segments
+        self.__memory = collections.deque()
+        self.__segments = collections.deque()
+        self.__head = None
+        self.__head_offset = 0
+        self.__next_sequence = 1
+        self.__length = 0
+        self.__dropped_count = 0
+        self.load()
+
+    def __len__(self):
+        return self.__length
+
+    @property
+    def dropped_count(self):
+        return self.__dropped_count
+
+    @property
+    def segment_count(self):
+        return len(self.__segments)
+
+    """
+    Pick up the segments left behind by a previous run
+    """
+    def load(self):
+        if not self.__directory or not os.path.isdir(self.__directory):
+            return
+        for name in sorted(os.listdir(self.__directory)):
+            if not (name.startswith("segment-") and name.endswith(".jsonl")):
+                continue
+            path = os.path.join(self.__directory, name)
+            try:
+                with open(path, "rb") as file:
+                    count = sum(1 for _ in file)
+                sequence = int(name[len("segment-"):-len(".jsonl")])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable buffer segment {path}: {e}")
+                continue
+            self.__segments.append([path, count])
+            self.__length += count
+            self.__next_sequence = max(self.__next_sequence, sequence + 1)
+        if len(self.__segments) > 0:
+            logger.info("Found %s buffered deltas in %s", self.__length, self.__directory)
+
+    def append(self, values: dict):
+        self.__memory.append(values)
+        self.__length += 1
+        if len(self.__memory) >= self.__memory_size:
+            self.spill()
+
+    """
+    Move the deltas held in memory to a new segment, or drop the oldest one
+    when there is no directory to write to
+    """
+    def spill(self):
+        if len(self.__memory) == 0:
+            return
+        if self.__directory:
+            try:
+                self.write_segment()
+                return
+            except OSError as e:
+                logger.warning(f"Unable to write buffer segment to {self.__directory}, buffering in memory only: {e}")
+                self.__directory = None
+        while len(self.__memory) > self.__memory_size:
+            self.__memory.popleft()
+            self.__length -= 1
+            self.__dropped_count += 1
+
+    def write_segment(self):
+        os.makedirs(self.__directory, exist_ok=True)
+        path = os.path.join(self.__directory, f"segment-{self.__next_sequence:08d}.jsonl")
+        with open(path, "w") as file:
+            file.write("\n".join(dumps(entry) for entry in self.__memory) + "\n")
+        self.__next_sequence += 1
+        self.__segments.append([path, len(self.__memory)])
+        self.__memory.clear()
+
+        while len(self.__segments) > self.__max_segments:
+            self.drop_oldest_segment()
+
+    def drop_oldest_segment(self):
+        path, count = self.__segments.popleft()
+        if self.__head is not None:
+            # the loaded head is always the oldest segment
+            count -= self.__head_offset
+            self.__head = None
+            self.__head_offset = 0
+        self.__length -= count
+        self.__dropped_count += count
+        self.remove_file(path)
+        logger.warning("Outbound buffer is full, dropped %s buffered deltas", count)
+
+    """
+    Returns up to limit of the oldest deltas, without removing them. Deltas
+    read back from a segment have [value, timestamp] lists for values.
+    """
+    def peek(self, limit):
+        while len(self.__segments) > 0:
+            head = self.load_head()
+            if len(head) > 0:
+                return head[self.__head_offset:self.__head_offset + limit]
+        return [self.__memory[i] for i in range(min(limit, len(self.__memory)))]
+
+    """
+    Remove the count oldest deltas, after they have been returned by peek() and sent
+    """
+    def remove(self, count):
+        if len(self.__segments) > 0:
+            self.__head_offset += count
+            self.__length -= count
+            if self.__head_offset >= len(self.__head):
+                path, _ = self.__segments.popleft()
+                self.__head = None
+                self.__head_offset = 0
+                self.remove_file(path)
+            return
+        for _ in range(count):
+            self.__memory.popleft()
+        self.__length -= count
+
+    def load_head(self):
+        if self.__head is not None:
+            return self.__head
+
+        path, count = self.__segments[0]
+        head = []
+        try:
+            with open(path, "rb") as file:
+                for line in file:
+                    try:
+                        head.append(loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable line in buffer segment {path}")
+        except OSError as e:
+            logger.warning(f"Unable to read buffer segment {path}: {e}")
+        # the segment may have fewer readable deltas than it was counted with
+        self.__length += len(head) - count
+        self.__segments[0][1] = len(head)
+        self.__head = head
+        self.__head_offset = 0
+
+        if len(head) == 0:
+            self.__segments.popleft()
+            self.__head = None
+            self.remove_file(path)
+            return []
+        return head
+
+    def remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Unable to remove buffer segment {path}: {e}")
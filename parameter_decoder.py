@@ -0,0 +1,97 @@
+import logging
+from typing import Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+Decoder for a single engine parameter, compiled from the SignalK parameter map
+when the receiver connects so the notification hot path is one lookup and a
+call. Instances are immutable.
+"""
+class ParameterDecoder(NamedTuple):
+    uuid: str
+    key: Optional[str]                  # path relative to propulsion.<engine id>
+    path: Optional[str]                 # full SignalK path, None if the value isn't published
+    convert: Optional[Callable]         # converts the raw value to SignalK units
+    header: Optional[bytes]             # header bytes expected at the start of the payload
+    width: Optional[int]                # number of value bytes after the header, None for the rest
+
+    """
+    Strips the header bytes and converts the value to an integer with little
+    endian byte order
+    """
+    def decode(self, data):
+        if self.width is None:
+            return int.from_bytes(data[HEADER_SIZE:], byteorder='little')
+        return int.from_bytes(data[HEADER_SIZE:HEADER_SIZE + self.width], byteorder='little')
+
+    def convert_value(self, value):
+        if self.convert is None:
+            return value
+        return self.convert(value)
+
+
+HEADER_SIZE = 2
+
+
+"""
+Integer key for the header bytes at the start of a notification payload
+"""
+def header_key(data):
+    return data[0] | (data[1] << 8)
+
+
+def compile_decoder(uuid: str, options: dict, root_path: str):
+    key = options.get("path")
+    path = None if key is None else f"{root_path}.{key}"
+    header = options.get("header")
+    decoder = ParameterDecoder(
+        uuid=uuid,
+        key=key,
+        path=path,
+        convert=options.get("convert"),
+        header=None if header is None else bytes(header),
+        width=options.get("width")
+    )
+    logger.debug("Compiled decoder: %s", decoder)
+    return decoder
+
+
+"""
+Compiles the parameter map into a dictionary of uuid -> ParameterDecoder
+"""
+def compile_decoders(parameter_map: dict, root_path: str):
+    return {uuid: compile_decoder(uuid, options, root_path) for uuid, options in parameter_map.items()}
+
+
+"""
+Builds a dictionary of header key -> ParameterDecoder from the parameter
+configuration reported by the device (see decode_parameter_configuration).
+
+known_parameters maps header keys to (uuid, options) for the parameters we
+know how to convert and publish. Parameters the device reports which are not
+known are decoded as raw integers, on the UUID returned by uuid_for_index, and
+published below unknown_path_prefix if it is set.
+"""
+def compile_header_decoders(parameters: dict, known_parameters: dict, root_path: str,
+                            uuid_for_index: Callable, unknown_path_prefix: Optional[str] = None):
+    decoders = dict()
+    for parameter_id, header_hex in parameters.items():
+        if parameter_id == "header":
+            continue
+
+        header = bytes.fromhex(header_hex)
+        if len(header) < HEADER_SIZE:
+            continue
+
+        key = header_key(header)
+        if key in known_parameters:
+            uuid, options = known_parameters[key]
+        else:
+            uuid = uuid_for_index(int(parameter_id, 16))
+            options = { "header": header }
+            if unknown_path_prefix is not None:
+                options["path"] = f"{unknown_path_prefix}.{header_hex}"
+
+        decoders[key] = compile_decoder(uuid, options, root_path)
+    return decoders
@@ -0,0 +1,233 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+"""
+Opt-in sampling profiler for the running bridge. While a profiling window is
+open a background thread samples the event loop thread's stack at a fixed
+interval and counts each distinct stack, so the overhead is bounded by the
+sample rate rather than by how much work the loop does. At the end of the
+window two files are written on a worker thread, so writing them doesn't
+hold up the loop being profiled:
+
+    profile-<time>.folded          collapsed stacks ("frame;frame;frame count"),
+                                   the input format of flamegraph.pl and speedscope
+    profile-<time>-slow-callbacks.txt
+                                   callbacks and tasks that held the loop longer than
+                                   slow_callback_ms, as reported by asyncio debug mode
+"""
+class SamplingProfiler:
+    def __init__(self, config: 'ProfilerConfig'):
+        self.__config = config
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__stacks = collections.Counter()
+        self.__samples = 0
+        self.__slow_callbacks = []
+        self.__log_handler = None
+        self.__stop_handle = None
+        self.__loop = None
+        self.__previous_debug = None
+        self.__previous_level = None
+        self.__started = None
+        self.__writing = None
+
+    @property
+    def running(self):
+        return self.__thread is not None
+
+    """
+    Start a profiling window on the running loop, it is stopped after
+    duration seconds (the configured duration by default, 0 runs until stop())
+    """
+    def start(self, duration = None):
+        if self.running:
+            return
+
+        self.__loop = asyncio.get_running_loop()
+        self.__stacks = collections.Counter()
+        self.__samples = 0
+        self.__slow_callbacks = []
+        self.__started = datetime.now()
+        self.__stop.clear()
+
+        # asyncio debug mode reports callbacks which block the loop for too long
+        self.__log_handler = SlowCallbackHandler(self.__slow_callbacks)
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(self.__log_handler)
+        # the reports are logged as warnings, make sure they aren't filtered out
+        self.__previous_level = asyncio_logger.level
+        if asyncio_logger.getEffectiveLevel() > logging.WARNING:
+            asyncio_logger.setLevel(logging.WARNING)
+        self.__previous_debug = (self.__loop.get_debug(), self.__loop.slow_callback_duration)
+        self.__loop.slow_callback_duration = self.__config.slow_callback_ms / 1000.0
+        self.__loop.set_debug(True)
+
+        target = threading.get_ident()
+        self.__thread = threading.Thread(target=self.sample_loop, args=(target,), name="sampling-profiler", daemon=True)
+        self.__thread.start()
+
+        if duration is None:
+            duration = self.__config.duration
+        if duration > 0:
+            self.__stop_handle = self.__loop.call_later(duration, self.stop)
+        logger.info("Started profiling for %s", f"{duration} seconds" if duration > 0 else "until stopped")
+
+    """
+    Stop the profiling window and write the reports on a worker thread. Returns
+    a future for the paths written (None if they couldn't be written).
+    """
+    def stop(self):
+        if not self.running:
+            return None
+
+        if self.__stop_handle is not None:
+            self.__stop_handle.cancel()
+            self.__stop_handle = None
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+
+        debug, slow_callback_duration = self.__previous_debug
+        self.__loop.set_debug(debug)
+        self.__loop.slow_callback_duration = slow_callback_duration
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.removeHandler(self.__log_handler)
+        asyncio_logger.setLevel(self.__previous_level)
+        self.__log_handler = None
+
+        base = os.path.join(self.__config.directory,
+                            f"profile-{self.__started.strftime('%Y%m%d-%H%M%S-%f')[:-3]}")
+        samples = self.__samples
+        writing = self.__loop.run_in_executor(None, write_reports, self.__config.directory, base,
+                                              self.__stacks, self.__slow_callbacks, self.__config.slow_callback_ms)
+        # keep a reference, nobody else waits for the reports when the window times out
+        self.__writing = self.__loop.create_task(self.reports_written(writing, samples))
+        return self.__writing
+
+    async def reports_written(self, writing, samples):
+        try:
+            paths = await writing
+        except OSError as e:
+            logger.warning(f"Unable to write profile: {e}")
+            return None
+        logger.info("Wrote profile with %s samples to %s", samples, paths[0])
+        return paths
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def sample_loop(self, target):
+        interval = self.__config.interval_ms / 1000.0
+        while not self.__stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            self.__stacks[collapse_stack(frame)] += 1
+            self.__samples += 1
+
+
+"""
+Write the reports of a profiling window, runs on a worker thread
+"""
+def write_reports(directory, base, stacks, slow_callbacks, slow_callback_ms):
+    os.makedirs(directory, exist_ok=True)
+
+    with open(base + ".folded", "w") as file:
+        for stack, count in stacks.most_common():
+            file.write(f"{stack} {count}\n")
+
+    with open(base + "-slow-callbacks.txt", "w") as file:
+        file.write(f"# callbacks holding the event loop for more than {slow_callback_ms} ms\n")
+        for timestamp, message in slow_callbacks:
+            file.write(f"{timestamp.isoformat(timespec='milliseconds')} {message}\n")
+
+    return base + ".folded", base + "-slow-callbacks.txt"
+
+
+"""
+Collapse a stack into "module:function;module:function" from the outermost frame
+"""
+def collapse_stack(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    frames.reverse()
+    return ";".join(frames)
+
+
+"""
+Collects the slow callback warnings that asyncio logs in debug mode
+"""
+class SlowCallbackHandler(logging.Handler):
+    def __init__(self, records):
+        super().__init__(logging.WARNING)
+        self.__records = records
+
+    def emit(self, record):
+        message = record.getMessage()
+        if "took" in message:
+            self.__records.append((datetime.fromtimestamp(record.created), message))
+
+
+class ProfilerConfig:
+    def __init__(self):
+        self.__enabled = False
+        self.__duration = 30
+        self.__interval_ms = 5
+        self.__slow_callback_ms = 50
+        self.__directory = "./logs/profiles"
+
+    """
+    Start a profiling window when the bridge starts
+    """
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.__enabled = value
+
+    @property
+    def duration(self):
+        return self.__duration
+
+    @duration.setter
+    def duration(self, value):
+        self.__duration = value
+
+    @property
+    def interval_ms(self):
+        return self.__interval_ms
+
+    @interval_ms.setter
+    def interval_ms(self, value):
+        self.__interval_ms = value
+
+    @property
+    def slow_callback_ms(self):
+        return self.__slow_callback_ms
+
+    @slow_callback_ms.setter
+    def slow_callback_ms(self, value):
+        self.__slow_callback_ms = value
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    @directory.setter
+    def directory(self, value):
+        self.__directory = value
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Bounded queue of path / value / timestamp entries waiting to be sent. When the queue is
+full the overflow policy decides which value is discarded, so memory stays
+flat no matter how far behind the consumer falls.
+"""
+class PublishQueue:
+
+    DROP_OLDEST = "drop-oldest"
+    LATEST_PER_PATH = "latest"
+    POLICIES = [DROP_OLDEST, LATEST_PER_PATH]
+
+    def __init__(self, maxsize: int = 1000, policy: str = DROP_OLDEST):
+        if policy not in PublishQueue.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+
+        self.__queue = asyncio.Queue(maxsize)
+        self.__policy = policy
+        self.__latest_values = dict()
+        self.__dropped_count = 0
+
+    @property
+    def policy(self):
+        return self.__policy
+
+    @property
+    def depth(self):
+        return self.__queue.qsize()
+
+    @property
+    def dropped_count(self):
+        return self.__dropped_count
+
+    def empty(self):
+        return self.__queue.empty()
+
+    """
+    Add a value to the queue without blocking the caller
+    """
+    def put(self, path, value, timestamp = None):
+        if self.__policy == PublishQueue.LATEST_PER_PATH:
+            self.__put_latest(path, value, timestamp)
+        else:
+            self.__put_drop_oldest(path, value, timestamp)
+
+    def __put_drop_oldest(self, path, value, timestamp):
+        if self.__queue.full():
+            self.__queue.get_nowait()
+            self.__dropped_count += 1
+        self.__queue.put_nowait((path, value, timestamp))
+
+    def __put_latest(self, path, value, timestamp):
+        if path in self.__latest_values:
+            # a value for this path is already waiting, replace it in place
+            self.__latest_values[path] = (value, timestamp)
+            self.__dropped_count += 1
+            return
+
+        if self.__queue.full():
+            oldest_path = self.__queue.get_nowait()
+            del self.__latest_values[oldest_path]
+            self.__dropped_count += 1
+
+        self.__latest_values[path] = (value, timestamp)
+        self.__queue.put_nowait(path)
+
+    """
+    Wait for the next value in the queue
+    """
+    async def get(self):
+        item = await self.__queue.get()
+        return self.__unwrap(item)
+
+    def get_nowait(self):
+        item = self.__queue.get_nowait()
+        return self.__unwrap(item)
+
+    def __unwrap(self, item):
+        if self.__policy == PublishQueue.LATEST_PER_PATH:
+            return (item,) + self.__latest_values.pop(item)
+        return item
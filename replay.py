@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from btsnoop import BtSnoopReader
+from ble_connection import VesselViewMobileReceiver, BleConnectionConfig, UUIDs
+
+logger = logging.getLogger("replay")
+
+"""
+Characteristic value handles observed on the VVM (see docs/characteristics_dump.md).
+Used when the capture starts after GATT discovery and the handles can't be learned
+from the capture itself.
+"""
+DEFAULT_HANDLE_UUIDS = {
+    0x0015: UUIDs.DEVICE_CONFIG_UUID,
+    0x001d: UUIDs.ENGINE_RPM_UUID,
+    0x0021: UUIDs.COOLANT_TEMPERATURE_UUID,
+    0x0025: UUIDs.BATTERY_VOLTAGE_UUID,
+    0x0029: UUIDs.UNK_105_UUID,
+    0x002d: UUIDs.ENGINE_RUNTIME_UUID,
+    0x0031: UUIDs.CURRENT_FUEL_FLOW_UUID,
+    0x0035: UUIDs.UNK_108_UUID,
+    0x0039: UUIDs.UNK_109_UUID,
+    0x003d: UUIDs.OIL_PRESSURE_UUID,
+    0x0041: UUIDs.UNK_10B_UUID,
+    0x0045: UUIDs.UNK_10C_UUID,
+    0x0049: UUIDs.UNK_10D_UUID,
+    0x0059: UUIDs.DEVICE_NEXT_UUID,
+    0x005e: UUIDs.DEVICE_201_UUID,
+    0x0068: UUIDs.DEVICE_STARTUP_UUID,
+}
+
+
+"""
+Minimal stand-in for BleakGATTCharacteristic, the receiver only needs the UUID
+"""
+class ReplayCharacteristic:
+    __slots__ = ("uuid", "handle")
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class ReplayStatistics:
+    def __init__(self):
+        self.notifications = 0
+        self.skipped = 0
+        self.elapsed_seconds = 0.0
+        self.capture_seconds = 0.0
+
+    @property
+    def notifications_per_second(self):
+        if self.elapsed_seconds == 0:
+            return 0
+        return self.notifications / self.elapsed_seconds
+
+    def __str__(self):
+        return (f"{self.notifications} notifications ({self.skipped} skipped) in {self.elapsed_seconds:.3f}s "
+                f"covering {self.capture_seconds:.1f}s of capture: {self.notifications_per_second:.0f} notifications/s")
+
+
+"""
+Feeds the notifications from a btsnoop capture into a receiver's notification
+handler. A speed of 1.0 replays in real time, larger values replay faster and
+0 replays as fast as the receiver can process the data.
+"""
+class CaptureReplayer:
+
+    # how often to yield to the event loop when replaying at max speed
+    yield_interval = 64
+
+    def __init__(self, receiver: VesselViewMobileReceiver, speed: float = 0):
+        self.__receiver = receiver
+        self.__speed = speed
+        self.__characteristics = dict()
+
+    def characteristic_for_handle(self, handle, discovered: dict):
+        characteristic = self.__characteristics.get(handle)
+        if characteristic is None:
+            uuid = discovered.get(handle, DEFAULT_HANDLE_UUIDS.get(handle))
+            if uuid is None:
+                return None
+            characteristic = ReplayCharacteristic(uuid, handle)
+            self.__characteristics[handle] = characteristic
+        return characteristic
+
+    async def replay_file(self, path):
+        with open(path, "rb") as file:
+            return await self.replay(BtSnoopReader(file))
+
+    async def replay(self, reader: BtSnoopReader):
+        stats = ReplayStatistics()
+        handler = self.__receiver.notification_handler
+        first_timestamp = None
+        last_timestamp = None
+        start = time.perf_counter()
+
+        for notification in reader.notifications():
+            characteristic = self.characteristic_for_handle(notification.handle, reader.handle_uuids)
+            if characteristic is None:
+                stats.skipped += 1
+                continue
+
+            if first_timestamp is None:
+                first_timestamp = notification.timestamp_us
+            last_timestamp = notification.timestamp_us
+
+            if self.__speed > 0:
+                offset = (notification.timestamp_us - first_timestamp) / 1_000_000 / self.__speed
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif stats.notifications % self.yield_interval == 0:
+                await asyncio.sleep(0)
+
+            handler(characteristic, bytearray(notification.value))
+            stats.notifications += 1
+
+        stats.elapsed_seconds = time.perf_counter() - start
+        if first_timestamp is not None:
+            stats.capture_seconds = (last_timestamp - first_timestamp) / 1_000_000
+        return stats
+
+
+"""
+Counts the values the receiver publishes so the replay doesn't need SignalK
+"""
+class PublishCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, path, value, timestamp):
+        self.count += 1
+
+
+def parse_speed(value):
+    if value == "max":
+        return 0
+    if value == "realtime":
+        return 1.0
+    return float(value)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay a btsnoop HCI capture through the VVM decoder")
+    parser.add_argument("capture", nargs="+", help="btsnoop capture file(s) to replay")
+    parser.add_argument("--speed", default="max", type=parse_speed,
+                        help="'realtime', 'max' or a speed multiplier (e.g. 10)")
+    parser.add_argument("-d", "--debug", action="store_true", help="sets the log level to debug")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s",
+    )
+
+    config = BleConnectionConfig()
+    config.device_name = "replay"
+    config.csv_output_enabled = False
+
+    counter = PublishCounter()
+    receiver = VesselViewMobileReceiver(config, counter)
+    replayer = CaptureReplayer(receiver, args.speed)
+
+    for capture in args.capture:
+        stats = await replayer.replay_file(capture)
+        logger.info("%s: %s, %s values published", capture, stats, counter.count)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
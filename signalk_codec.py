@@ -0,0 +1,129 @@
+import itertools
+import json
+import logging
+import math
+import os
+
+from clock import format_iso
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+"""
+JSON encoding and decoding for the SignalK websocket.
+
+Outbound deltas always have the same shape, so instead of building nested
+dicts for every message the encoder pastes the values between pre-rendered
+pieces of the envelope, with the '{"path":...,"value":' prefix rendered once
+per path. Inbound frames are only parsed when they carry a requestId, which
+is the only thing the publisher acts on.
+
+orjson is used for full encodes and parses when it is installed.
+"""
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value).decode()
+
+    loads = orjson.loads
+else:
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":"))
+
+    loads = json.loads
+
+
+def encode_value(value):
+    if type(value) is int:
+        return int.__repr__(value)
+    if isinstance(value, float):
+        # JSON has no NaN or infinity
+        return float.__repr__(value) if math.isfinite(value) else "null"
+    if value is None:
+        return "null"
+    return dumps(value)
+
+
+"""
+Returns the parsed frame, or None for frames without a requestId (the server's
+echo of other deltas), which are skipped without being parsed. Text and binary
+frames (str or bytes) are accepted.
+"""
+def decode_response(message):
+    marker = '"requestId"' if isinstance(message, str) else b'"requestId"'
+    if marker not in message:
+        return None
+    data = loads(message)
+    if not isinstance(data, dict) or "requestId" not in data:
+        return None
+    return data
+
+
+"""
+Renders SignalK delta messages from dictionaries of path: (value, timestamp)
+where the timestamp is nanoseconds since the epoch, see clock.py. Consecutive
+values produced in the same millisecond share an update, which carries that
+timestamp and the $source. Request ids come from a counter with a per-process
+prefix, since deltas don't need their responses correlated.
+"""
+class DeltaEncoder:
+    def __init__(self, context = "vessels.self", source = None):
+        self.__request_prefix = '{"requestId":"' + os.urandom(4).hex() + "-"
+        self.__request_ids = itertools.count(1)
+        self.__context = ',"context":' + dumps(context) + ',"updates":['
+        self.__update_prefix = ('{' if source is None else '{"$source":' + dumps(source) + ",") + '"timestamp":"'
+        self.__path_prefixes = dict()
+
+    def next_request_id(self):
+        return next(self.__request_ids)
+
+    def path_prefix(self, path):
+        prefix = self.__path_prefixes.get(path)
+        if prefix is None:
+            prefix = '{"path":' + dumps(path) + ',"value":'
+            self.__path_prefixes[path] = prefix
+        return prefix
+
+    def render_updates(self, values: dict):
+        if len(values) == 0:
+            return ""
+
+        path_prefix = self.path_prefix
+        parts = []
+        append = parts.append
+        last_millisecond = None
+        for path, (value, timestamp) in values.items():
+            millisecond = timestamp // 1_000_000
+            if millisecond != last_millisecond:
+                if last_millisecond is not None:
+                    append("]},")
+                append(self.__update_prefix)
+                append(format_iso(timestamp))
+                append('","values":[')
+                last_millisecond = millisecond
+            else:
+                append(",")
+            append(path_prefix(path))
+            append(encode_value(value))
+            append("}")
+        append("]}")
+        return "".join(parts)
+
+    """
+    A single delta message containing every path / value pair in the values dictionary
+    """
+    def encode(self, values: dict):
+        return (self.__request_prefix + str(next(self.__request_ids)) + '"' + self.__context +
+                self.render_updates(values) + "]}")
+
+    """
+    A single delta message containing the updates for several values
+    dictionaries, used to send buffered values in large batches
+    """
+    def encode_batches(self, batches):
+        return (self.__request_prefix + str(next(self.__request_ids)) + '"' + self.__context +
+                ",".join([self.render_updates(values) for values in batches if len(values) > 0]) + "]}")
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import urllib.parse
+
+from backoff import reconnect_delay
+from publish_queue import PublishQueue
+from signalk_codec import DeltaEncoder
+from sinks import OutputSink
+
+logger = logging.getLogger(__name__)
+
+
+class HttpStatusError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f"HTTP {status} {reason}")
+        self.status = status
+
+
+"""
+Sends values to a SignalK REST endpoint. Values are collected for
+batch_window and sent as one delta per request over a kept-alive HTTP
+connection. When a request fails the batch is dropped and the next one is
+sent after a backoff; the queue keeps the latest value of each path in the
+meantime, so the next request carries the newest values.
+"""
+class SignalKHttpSink(OutputSink):
+    def __init__(self, config: 'HttpSinkConfig'):
+        super().__init__("signalk-http", config.queue_size, PublishQueue.LATEST_PER_PATH)
+        self.__config = config
+        self.__encoder = DeltaEncoder(source=config.source)
+        self.__reader = None
+        self.__writer = None
+
+        url = urllib.parse.urlsplit(config.url)
+        self.__secure = url.scheme == "https"
+        self.__host = url.hostname
+        self.__port = url.port or (443 if self.__secure else 80)
+        self.__target = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        self.__host_header = url.netloc.rpartition("@")[2]
+
+    async def send_loop(self):
+        logger.info("Sending SignalK deltas to %s", self.__config.url)
+        failures = 0
+        try:
+            while not self.closed:
+                values = await self.next_batch(self.__config.batch_window)
+                if len(values) == 0:
+                    continue
+                if await self.send_values(values):
+                    failures = 0
+                else:
+                    failures += 1
+                    delay = reconnect_delay(failures, 1, self.__config.retry_interval)
+                    logger.info(f"Retrying {self.__config.url} in {delay:.1f} seconds")
+                    await self.sleep(delay)
+            # values queued while closing
+            values = self.take_pending()
+            if len(values) > 0:
+                await self.send_values(values)
+        finally:
+            self.disconnect()
+
+    """
+    Send values as one delta, returns False when the request failed
+    """
+    async def send_values(self, values):
+        try:
+            await asyncio.wait_for(self.send(self.__encoder.encode(values).encode()), self.__config.timeout)
+            return True
+        except (OSError, TimeoutError, HttpStatusError, asyncio.IncompleteReadError, ValueError) as e:
+            self._failures.inc()
+            self.disconnect()
+            logger.warning(f"Unable to send {len(values)} values to {self.__config.url}: {e}")
+            return False
+
+    async def send(self, body: bytes):
+        if self.__writer is None:
+            self.__reader, self.__writer = await asyncio.open_connection(self.__host, self.__port,
+                                                                         ssl=True if self.__secure else None)
+
+        headers = (f"{self.__config.method} {self.__target} HTTP/1.1\r\n"
+                   f"Host: {self.__host_header}\r\n"
+                   "User-Agent: vvmble_to_signalk/1.0\r\n"
+                   "Content-Type: application/json\r\n"
+                   f"Content-Length: {len(body)}\r\n")
+        if self.__config.token is not None:
+            headers += f"Authorization: Bearer {self.__config.token}\r\n"
+        self.__writer.write(headers.encode() + b"\r\n" + body)
+        await self.__writer.drain()
+
+        status, reason, keep_alive = await self.read_response()
+        if not keep_alive:
+            self.disconnect()
+        if status >= 300:
+            raise HttpStatusError(status, reason)
+
+    """
+    Read the response, returns the status, reason and whether the connection can be reused
+    """
+    async def read_response(self):
+        status_line = (await self.__reader.readuntil(b"\r\n")).decode("latin-1").split(" ", 2)
+        if len(status_line) < 2 or not status_line[0].startswith("HTTP/"):
+            raise ValueError(f"Invalid HTTP response: {' '.join(status_line).strip()}")
+        status = int(status_line[1])
+        reason = status_line[2].strip() if len(status_line) > 2 else ""
+
+        length = 0
+        chunked = False
+        keep_alive = status_line[0] != "HTTP/1.0"
+        while True:
+            line = (await self.__reader.readuntil(b"\r\n")).decode("latin-1")
+            if line == "\r\n":
+                break
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding":
+                chunked = "chunked" in value
+            elif name == "connection":
+                keep_alive = value != "close"
+
+        # the body isn't used, but has to be read to reuse the connection
+        if chunked:
+            while True:
+                size = int((await self.__reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await self.__reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif length > 0:
+            await self.__reader.readexactly(length)
+        return status, reason, keep_alive
+
+    def disconnect(self):
+        if self.__writer is not None:
+            self.__writer.close()
+        self.__reader = None
+        self.__writer = None
+
+
+class HttpSinkConfig:
+    def __init__(self):
+        self.__url = None
+        self.__method = "POST"
+        self.__token = None
+        self.__source = "vvm_monitor"
+        self.__batch_window = 1.0
+        self.__timeout = 10
+        self.__retry_interval = 30
+        self.__queue_size = 1000
+
+    """
+    The REST endpoint deltas are sent to, the sink is disabled when it isn't set
+    """
+    @property
+    def url(self):
+        return self.__url
+
+    @url.setter
+    def url(self, value):
+        self.__url = value
+
+    @property
+    def method(self):
+        return self.__method
+
+    @method.setter
+    def method(self, value):
+        self.__method = value
+
+    """
+    Bearer token sent with every request
+    """
+    @property
+    def token(self):
+        return self.__token
+
+    @token.setter
+    def token(self, value):
+        self.__token = value
+
+    @property
+    def source(self):
+        return self.__source
+
+    @source.setter
+    def source(self, value):
+        self.__source = value
+
+    @property
+    def batch_window(self):
+        return self.__batch_window
+
+    @batch_window.setter
+    def batch_window(self, value):
+        self.__batch_window = value
+
+    @property
+    def timeout(self):
+        return self.__timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.__timeout = value
+
+    @property
+    def retry_interval(self):
+        return self.__retry_interval
+
+    @retry_interval.setter
+    def retry_interval(self, value):
+        self.__retry_interval = value
+
+    @property
+    def queue_size(self):
+        return self.__queue_size
+
+    @queue_size.setter
+    def queue_size(self, value):
+        self.__queue_size = value
+
+    @property
+    def valid(self):
+        return self.__url is not None
@@ -1,21 +1,58 @@
 import asyncio
 import websockets
-import json
 import logging
+import time
 import uuid
-from futures_queue import FuturesQueue
+import metrics
+from backoff import reconnect_delay
+from clock import now_ns
+from correlation_registry import CorrelationRegistry
+from outbound_buffer import OutboundBuffer
+from publish_queue import PublishQueue
+from signalk_codec import DeltaEncoder, decode_response, dumps
 
 logger = logging.getLogger(__name__)
 
+QUEUE_DEPTH = metrics.REGISTRY.gauge("vvm_signalk_queue_depth", "Values waiting to be sent to SignalK")
+DROPPED_VALUES = metrics.REGISTRY.counter("vvm_signalk_dropped_values_total",
+                                          "Values dropped because the send queue was full")
+DELTAS_SENT = metrics.REGISTRY.counter("vvm_signalk_deltas_sent_total", "Deltas sent to SignalK")
+SEND_SECONDS = metrics.REGISTRY.histogram("vvm_signalk_send_seconds", "Time to send a delta on the websocket")
+BUFFERED_DELTAS = metrics.REGISTRY.gauge("vvm_signalk_buffered_deltas",
+                                          "Deltas buffered while the SignalK server is unreachable")
+BUFFER_DROPPED = metrics.REGISTRY.counter("vvm_signalk_buffer_dropped_total",
+                                          "Buffered deltas dropped because the outbound buffer was full")
+SIGNALK_CONNECTIONS = metrics.REGISTRY.counter("vvm_signalk_connections_total", "SignalK websocket connection attempts",
+                                               labels=("result",))
+
 class SignalKPublisher:
+    name = "signalk"
+    reconnect_initial_delay_seconds = 1
+
     def __init__(self, config: 'SignalKConfig'):
         self.__config = config
         
         self.__websocket = None
         self.__socket_connected = False
         self.__abort = False
-        self.__notifications = FuturesQueue()
+        self.__notifications = CorrelationRegistry()
         self.__auth_token = None
+        self.__send_queue = PublishQueue(config.send_queue_size, config.overflow_policy)
+        self.__sender_task = None
+        self.__in_flight = None
+        self.__delta_encoder = DeltaEncoder(source=config.source)
+        self.__buffer = OutboundBuffer(config.buffer_size, config.buffer_directory, config.buffer_max_segments)
+        self.__send_lock = asyncio.Lock()
+        self.__flush_task = None
+        self.__login = None
+        self.__login_pending = False
+        self.__login_failures = 0
+        QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+        DROPPED_VALUES.set_function(lambda: self.dropped_count)
+        BUFFERED_DELTAS.set_function(lambda: self.buffered_count)
+        BUFFER_DROPPED.set_function(lambda: self.__buffer.dropped_count)
+        self.__connection_successes = SIGNALK_CONNECTIONS.labels("success")
+        self.__connection_failures = SIGNALK_CONNECTIONS.labels("failure")
 
     @property
     def websocket_url(self):
@@ -33,6 +70,25 @@ class SignalKPublisher:
     def retry_interval_seconds(self):
         return self.__config.retry_interval
     
+    @property
+    def batch_window_seconds(self):
+        return self.__config.batch_window
+
+    @property
+    def queue_depth(self):
+        return self.__send_queue.depth
+
+    @property
+    def dropped_count(self):
+        return self.__send_queue.dropped_count
+
+    """
+    Deltas waiting to be sent once the SignalK server is reachable again
+    """
+    @property
+    def buffered_count(self):
+        return len(self.__buffer)
+
     @property
     def socket_connected(self):
         return self.__socket_connected
@@ -45,10 +101,15 @@ class SignalKPublisher:
         """Connect to the Signal K server using a websocket."""
         logger.info("Connecting to SignalK: %s", self.websocket_url)
         user_agent_string = "vvmble_to_signalk/1.0"
+        # reuse the token from the last login instead of logging in again
+        headers = None
+        if self.__auth_token is not None:
+            headers = {"Authorization": f"Bearer {self.__auth_token}"}
         try:
             self.__websocket = await websockets.connect(self.websocket_url,
                                                       logger=logger,
-                                                      user_agent_header=user_agent_string
+                                                      user_agent_header=user_agent_string,
+                                                      extra_headers=headers
                                                       )
             self.socket_connected = True
         except OSError:  # TCP connection fails
@@ -57,35 +118,71 @@ class SignalKPublisher:
         except websockets.exceptions.InvalidURI:
             logger.error("Invalid URI: %s", self.websocket_url)
             self.socket_connected = False
+        except websockets.exceptions.InvalidStatusCode as e:
+            if e.status_code == 401 and self.__auth_token is not None:
+                logger.info("SignalK server rejected the saved token, logging in again.")
+                self.__auth_token = None
+            else:
+                logger.error(f"Websocket service error: {e}")
+            self.socket_connected = False
         except websockets.exceptions.InvalidHandshake:
             logger.error("Websocket service error. Check that the service is running and working properly.")
             self.socket_connected = False
         except TimeoutError:
             logger.warn("Websocket connection timed out.")
             self.socket_connected = False
+
+        if self.socket_connected:
+            self.__connection_successes.inc()
+        else:
+            self.__connection_failures.inc()
         return self.socket_connected
                 
     async def close(self):
         logger.info("Closing websocket...")
+        self.__abort = True
+        if self.__sender_task is not None:
+            self.__sender_task.cancel()
+            self.__sender_task = None
+        if self.__flush_task is not None:
+            self.__flush_task.cancel()
+            self.__flush_task = None
+        await self.flush_pending_values()
+        # keep whatever is still buffered for the next run
+        self.__buffer.spill()
+        self.__notifications.clear()
         if self.socket_connected:
-            self.__abort = True
             await self.__websocket.close()
             self.socket_connected = False
         logger.info("Websocket closed.")
 
     async def run(self, task_group):
+        # run() is restarted if it fails, keep the sender that is already running
+        if self.__sender_task is None or self.__sender_task.done():
+            self.__sender_task = task_group.create_task(self.send_loop())
+
+        failures = 0
         while not self.__abort:
-            await self.connect_websocket()
-            while not self.socket_connected:
-                logger.warn("Unable to connect to signalk websocket. Will retry...")
-                await asyncio.sleep(self.reconnect_interval_seconds)
-                await self.connect_websocket()
-            
+            if not await self.connect_websocket():
+                failures += 1
+                delay = reconnect_delay(failures, self.reconnect_initial_delay_seconds, self.retry_interval_seconds)
+                logger.warning("Unable to connect to signalk websocket. Will retry in %.1f seconds...", delay)
+                await asyncio.sleep(delay)
+                continue
+
+            failures = 0
             logger.info("Connected to signalk websocket %s", self.websocket_url)
-        
-            # authenticate
-            if self.username is not None:
-                await self.authenticate(self.username, self.password)
+
+            # authenticate, unless the connection was made with the token from the last login
+            if self.username is not None and self.__auth_token is None:
+                try:
+                    await self.login()
+                except websockets.exceptions.ConnectionClosed as e:
+                    logger.error(f"Websocket connection was closed: {e}.")
+                    self.socket_connected = False
+            else:
+                self.__login_pending = False
+                self.start_flush()
 
             # receive messages
             while self.socket_connected:
@@ -97,18 +194,61 @@ class SignalKPublisher:
                     logger.error(f"Websocket connection was closed: {e}.")
                     self.socket_connected = False
 
+            if self.__login_failures > 0 and not self.__abort:
+                delay = reconnect_delay(self.__login_failures, self.reconnect_initial_delay_seconds,
+                                        self.retry_interval_seconds)
+                logger.warning("Logging in to SignalK again in %.1f seconds...", delay)
+                await asyncio.sleep(delay)
+
     def process_websocket_message(self, msg):
-        logger.debug("Websocket message received: %s", msg)
+        # most frames are the server echoing deltas, only responses to our requests are parsed
         try:
-            data = json.loads(msg)
-            if "requestId" in data:
-                request_id = data["requestId"]
-                self.__notifications.trigger(request_id, data)
-            else:
-                logger.debug(f"No request ID was in received websocket message: {msg}")
-        except Exception as e:
-            raise
+            data = decode_response(msg)
+        except ValueError as e:
             logger.warning(f"Error parsing websocket message: {e}")
+            return
+
+        if data is not None:
+            logger.debug("Websocket response received: %s", msg)
+            self.__notifications.trigger(data["requestId"], data)
+
+    """
+    Log in on a new connection. Values are buffered until the login is answered.
+    """
+    async def login(self):
+        self.__login = None
+        self.__login_pending = True
+        self.__login = await self.authenticate(self.username, self.password)
+        self.__login.add_done_callback(self.login_completed)
+
+    """
+    Values are only sent once the server accepted the login. Otherwise they stay
+    buffered and the connection is closed, so run() reconnects and logs in again.
+    """
+    def login_completed(self, future):
+        # ignore logins from earlier connections
+        if future is not self.__login:
+            return
+
+        if login_token(future) is None:
+            self.__login_failures += 1
+            if self.socket_connected:
+                asyncio.create_task(self.__websocket.close())
+            return
+
+        self.__login_failures = 0
+        self.__login_pending = False
+        self.start_flush()
+
+    """
+    Send what was buffered while the server was unreachable, in the background
+    so the receive loop keeps running
+    """
+    def start_flush(self):
+        if self.__flush_task is not None and not self.__flush_task.done():
+            return
+        if self.socket_connected and self.buffered_count > 0:
+            self.__flush_task = asyncio.create_task(self.flush_buffer())
 
     async def authenticate(self, username, password):
         logger.info("Authenticating with websocket...")
@@ -123,52 +263,133 @@ class SignalKPublisher:
         }
 
         def process_login(future):
-            response_json = future.result()
-            logger.debug(f"response_json: {response_json}")
-            if response_json is not None:
-                # Check to see if the response was successful
-                if response_json["statusCode"] == 200:
-                    logger.info("authenticated with singalk successfully")
-                    self.__auth_token = response_json["login"]["token"]
-                else:
-                    logger.critical("Unable to authenticate with SignalK server. Username or password may be incorrect.")
-
-        self.__notifications.register_callback(login_request, process_login)
-        await self.__websocket.send(json.dumps(data))
-        
+            if future.cancelled() or future.exception() is not None:
+                logger.warning("No response from SignalK server to the login request")
+                return
+            logger.debug(f"response_json: {future.result()}")
+            token = login_token(future)
+            if token is not None:
+                logger.info("authenticated with singalk successfully")
+                self.__auth_token = token
+            else:
+                logger.critical("Unable to authenticate with SignalK server. Username or password may be incorrect.")
+
+        future = self.__notifications.register_callback(login_request, process_login, timeout=10)
+        await self.__websocket.send(dumps(data))
+        return future
+
 
     def generate_request_id(self):
         return str(uuid.uuid4())
 
-    def generate_delta(self, path, value):
-        delta = {
-            "requestId": self.generate_request_id(),
-            "context": "vessels.self",
-            "updates": [
-                {
-                    "values": [
-                        {
-                            "path": path,
-                            "value": value
-                        }
-                    ]
-                }
-            ]
-        }
-        return delta
+    """
+    Queue a value to be published to SignalK. This never blocks the caller,
+    the value is sent by the sender coroutine in order with everything else
+    that has been queued. The timestamp is when the value was produced, in
+    nanoseconds since the epoch (see clock.py), and defaults to now.
+    """
+    def publish_delta(self, path, value, timestamp = None):
+        logger.debug("Received delta to publish: '%s', value '%s'", path, value)
+        if timestamp is None:
+            timestamp = now_ns()
+        self.__send_queue.put(path, value, timestamp)
+
+    def publish(self, path, value, timestamp):
+        self.__send_queue.put(path, value, timestamp)
+
+    """
+    Long running sender coroutine. Values which arrive within the batch window
+    are coalesced into a single delta, and only the latest value for each
+    path is sent, with the time it was produced.
+    """
+    async def send_loop(self):
+        while not self.__abort:
+            path, value, timestamp = await self.__send_queue.get()
+            # values taken off the queue are kept where close() can flush them
+            # if the loop is cancelled before they are sent
+            self.__in_flight = {path: (value, timestamp)}
+            if self.batch_window_seconds > 0:
+                await asyncio.sleep(self.batch_window_seconds)
+
+            values = self.__in_flight
+            self.drain_queue(values)
+            await self.send_values(values)
+            self.__in_flight = None
+
+    def drain_queue(self, values: dict):
+        while not self.__send_queue.empty():
+            path, value, timestamp = self.__send_queue.get_nowait()
+            values[path] = (value, timestamp)
+
+    async def flush_pending_values(self):
+        values = self.__in_flight or dict()
+        self.__in_flight = None
+        self.drain_queue(values)
+        if len(values) > 0:
+            await self.send_values(values)
+
+    @property
+    def ready(self):
+        return self.socket_connected and not self.__login_pending
+
+    """
+    Send a delta for a dictionary of path: (value, timestamp), or buffer it
+    when the websocket is down or the login hasn't been answered yet. Anything
+    already buffered is sent first so values arrive in order.
+    """
+    async def send_values(self, values: dict):
+        async with self.__send_lock:
+            if self.ready and self.buffered_count > 0:
+                await self.send_buffered()
+            if self.ready and self.buffered_count == 0:
+                if await self.send_message(self.__delta_encoder.encode(values)):
+                    return
+            self.__buffer.append(values)
+
+    async def flush_buffer(self):
+        async with self.__send_lock:
+            count = self.buffered_count
+            await self.send_buffered()
+            if count > 0:
+                logger.info("Sent %s buffered deltas, %s still buffered", count - self.buffered_count, self.buffered_count)
+
+    """
+    Send the buffered deltas in batches of flush_batch_size per message
+    """
+    async def send_buffered(self):
+        batch_size = self.__config.flush_batch_size
+        while self.ready and self.buffered_count > 0:
+            batches = self.__buffer.peek(batch_size)
+            if not await self.send_message(self.__delta_encoder.encode_batches(batches)):
+                return
+            self.__buffer.remove(len(batches))
+
+    async def send_message(self, message):
+        started = time.perf_counter()
+        try:
+            await self.__websocket.send(message)
+            SEND_SECONDS.observe(time.perf_counter() - started)
+            DELTAS_SENT.inc()
+            return True
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning("Websocket connection closed. Buffering data until it is reconnected.")
+            self.socket_connected = False
+        except Exception as e:
+            logger.warning(f"Error sending on websocket: {e}")
+        return False
+
+"""
+The token from a successful login response, None if the login failed or wasn't answered
+"""
+def login_token(future):
+    if future.cancelled() or future.exception() is not None:
+        return None
+    response = future.result()
+    if not isinstance(response, dict) or response.get("statusCode") != 200:
+        return None
+    login = response.get("login")
+    return login.get("token") if isinstance(login, dict) else None
 
-    async def publish_delta(self, path, value):
-        logger.debug(f"Received delta to publish: '{path}', value '{value}'")        
-        if self.socket_connected:
-            delta = self.generate_delta(path, value)
-            try:
-                await self.__websocket.send(json.dumps(delta))
-            except websockets.exceptions.ConnectionClosed:
-                logger.warn(f"Websocket connection closed. Data delta may not have been published.")
-            except Exception as e:
-                logger.warn(f"Error sending on websocket: {e}")
-        else:
-            logger.warn(f"Websocket connection closed. No data was sent.")
 
 class SignalKConfig:
     def __init__(self):
@@ -176,6 +397,14 @@ class SignalKConfig:
         self.__username = None
         self.__password = None
         self.__retry_interval = 30
+        self.__batch_window = 0.1
+        self.__send_queue_size = 1000
+        self.__overflow_policy = PublishQueue.DROP_OLDEST
+        self.__buffer_size = 1000
+        self.__buffer_directory = "./logs/signalk-buffer"
+        self.__buffer_max_segments = 100
+        self.__flush_batch_size = 100
+        self.__source = "vvm_monitor"
 
     @property
     def websocket_url(self):
@@ -209,6 +438,82 @@ class SignalKConfig:
     def retry_interval(self, value):
         self.__retry_interval = value
 
+    @property
+    def batch_window(self):
+        return self.__batch_window
+
+    @batch_window.setter
+    def batch_window(self, value):
+        self.__batch_window = value
+
+    @property
+    def send_queue_size(self):
+        return self.__send_queue_size
+
+    @send_queue_size.setter
+    def send_queue_size(self, value):
+        self.__send_queue_size = value
+
+    @property
+    def overflow_policy(self):
+        return self.__overflow_policy
+
+    @overflow_policy.setter
+    def overflow_policy(self, value):
+        self.__overflow_policy = value
+
+    """
+    Deltas kept in memory while the server is unreachable before they are written to buffer_directory
+    """
+    @property
+    def buffer_size(self):
+        return self.__buffer_size
+
+    @buffer_size.setter
+    def buffer_size(self, value):
+        self.__buffer_size = value
+
+    """
+    Where buffered deltas are written, None keeps them in memory only
+    """
+    @property
+    def buffer_directory(self):
+        return self.__buffer_directory
+
+    @buffer_directory.setter
+    def buffer_directory(self, value):
+        self.__buffer_directory = value
+
+    @property
+    def buffer_max_segments(self):
+        return self.__buffer_max_segments
+
+    @buffer_max_segments.setter
+    def buffer_max_segments(self, value):
+        self.__buffer_max_segments = value
+
+    """
+    Buffered deltas sent in each message after reconnecting
+    """
+    @property
+    def flush_batch_size(self):
+        return self.__flush_batch_size
+
+    @flush_batch_size.setter
+    def flush_batch_size(self, value):
+        self.__flush_batch_size = value
+
+    """
+    The $source label sent with every update
+    """
+    @property
+    def source(self):
+        return self.__source
+
+    @source.setter
+    def source(self, value):
+        self.__source = value
+
     @property
     def valid(self):
         return self.__websocket_url is not None
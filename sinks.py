@@ -0,0 +1,166 @@
+import abc
+import asyncio
+import logging
+
+import metrics
+from backoff import reconnect_delay
+from publish_queue import PublishQueue
+
+logger = logging.getLogger(__name__)
+
+SINK_QUEUE_DEPTH = metrics.REGISTRY.gauge("vvm_sink_queue_depth", "Values waiting to be sent by an output", labels=("sink",))
+SINK_DROPPED = metrics.REGISTRY.counter("vvm_sink_dropped_values_total",
+                                        "Values dropped because an output's queue was full", labels=("sink",))
+SINK_FAILURES = metrics.REGISTRY.counter("vvm_sink_failures_total", "Failed sends and restarts of an output",
+                                         labels=("sink",))
+
+"""
+Fans decoded values out to every output. Each value is produced once by the
+receivers and handed to each sink's publish(), which only queues it, so a
+slow or failing output never holds up the BLE notification callback or the
+other outputs. Each sink runs as its own task and is restarted with backoff
+if it fails.
+
+A sink is anything with a name, publish(path, value, timestamp), run(task_group)
+and close().
+"""
+class SinkFanout:
+    restart_initial_delay_seconds = 1
+    restart_max_delay_seconds = 30
+
+    def __init__(self, sinks = ()):
+        self.__sinks = list(sinks)
+        self.__closed = False
+
+    @property
+    def sinks(self):
+        return self.__sinks
+
+    def add(self, sink):
+        self.__sinks.append(sink)
+
+    def publish(self, path, value, timestamp):
+        for sink in self.__sinks:
+            try:
+                sink.publish(path, value, timestamp)
+            except Exception as e:
+                logger.warning(f"Unable to queue value for {sink.name}: {e}")
+
+    def run(self, task_group):
+        return [task_group.create_task(self.run_sink(sink, task_group)) for sink in self.__sinks]
+
+    async def run_sink(self, sink, task_group):
+        failures = 0
+        while not self.__closed:
+            try:
+                await sink.run(task_group)
+                return
+            except Exception as e:
+                failures += 1
+                SINK_FAILURES.labels(sink.name).inc()
+                delay = reconnect_delay(failures, self.restart_initial_delay_seconds, self.restart_max_delay_seconds)
+                logger.exception(f"Output {sink.name} failed, restarting in {delay:.1f} seconds: {e}")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        self.__closed = True
+        for sink in self.__sinks:
+            try:
+                await sink.close()
+            except Exception as e:
+                logger.warning(f"Error closing {sink.name}: {e}")
+
+
+"""
+Base class for outputs with their own bounded queue of values, consumed by
+send_loop() in the sink's task. close() wakes the send loop and gives it
+close_timeout_seconds to send what is still queued before it is cancelled.
+"""
+class OutputSink(abc.ABC):
+    close_timeout_seconds = 5
+
+    def __init__(self, name, queue_size = 1000, overflow_policy = PublishQueue.LATEST_PER_PATH):
+        self.name = name
+        self.queue = PublishQueue(queue_size, overflow_policy)
+        self.closed = False
+        self.__closing = asyncio.Event()
+        self.__task = None
+        SINK_QUEUE_DEPTH.labels(name).set_function(lambda: self.queue.depth)
+        SINK_DROPPED.labels(name).set_function(lambda: self.queue.dropped_count)
+        self._failures = SINK_FAILURES.labels(name)
+
+    def publish(self, path, value, timestamp):
+        self.queue.put(path, value, timestamp)
+
+    async def run(self, task_group):
+        self.__task = asyncio.current_task()
+        try:
+            await self.send_loop()
+        finally:
+            self.__task = None
+
+    """
+    Sends values from the queue until the sink is closed, then sends what is
+    left in the queue (see take_pending)
+    """
+    @abc.abstractmethod
+    async def send_loop(self):
+        pass
+
+    """
+    Wait for the next value, then collect everything queued within window
+    seconds into a dictionary of path: (value, timestamp). Returns early, with
+    whatever is queued, when the sink is closed or nothing arrives within
+    timeout seconds (None waits indefinitely).
+    """
+    async def next_batch(self, window, timeout = None):
+        values = dict()
+        if self.queue.empty() and not self.closed:
+            get = asyncio.ensure_future(self.queue.get())
+            closing = asyncio.ensure_future(self.__closing.wait())
+            try:
+                await asyncio.wait([get, closing], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                closing.cancel()
+                # a cancelled get leaves its value in the queue
+                get.cancel()
+            if get.done() and not get.cancelled():
+                path, value, timestamp = get.result()
+                values[path] = (value, timestamp)
+            elif self.queue.empty():
+                return values
+
+        if window > 0 and not self.closed:
+            await self.sleep(window)
+        return self.take_pending(values)
+
+    """
+    Everything that is queued, added to values
+    """
+    def take_pending(self, values = None):
+        if values is None:
+            values = dict()
+        while not self.queue.empty():
+            path, value, timestamp = self.queue.get_nowait()
+            values[path] = (value, timestamp)
+        return values
+
+    """
+    Sleep for delay seconds, returns early when the sink is closed
+    """
+    async def sleep(self, delay):
+        try:
+            await asyncio.wait_for(self.__closing.wait(), delay)
+        except TimeoutError:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self.__closing.set()
+        task = self.__task
+        if task is None or task is asyncio.current_task():
+            return
+        done, _ = await asyncio.wait([task], timeout=self.close_timeout_seconds)
+        if len(done) == 0:
+            logger.warning(f"Output {self.name} didn't finish sending within {self.close_timeout_seconds} seconds")
+            task.cancel()
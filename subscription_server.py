@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import urllib.parse
+
+import websockets
+
+import metrics
+from publish_queue import PublishQueue
+from signalk_codec import DeltaEncoder
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBERS = metrics.REGISTRY.gauge("vvm_subscribers", "Clients connected to the local subscription server")
+SUBSCRIBER_DISCONNECTS = metrics.REGISTRY.counter("vvm_subscriber_disconnects_total",
+                                                  "Subscribers disconnected because they didn't keep up")
+
+"""
+Local endpoint that streams engine data straight from the receivers, so
+dashboards on the boat don't each need their own SignalK subscription.
+Clients connect over a websocket or a plain TCP socket and receive SignalK
+delta messages (one per line on TCP): first a snapshot with the latest value
+of every path, then deltas as values change.
+
+Every client has its own bounded queue that keeps the latest value of each
+path, and receives at most max_rate messages per second, with values that
+change in between coalesced. Websocket clients can ask for a lower rate
+with ?rate=<messages per second>. A client that doesn't accept a message
+within send_timeout is disconnected, so a stalled client never holds up
+the others or grows memory.
+"""
+class SubscriptionServer:
+    name = "subscriptions"
+
+    def __init__(self, config: 'SubscriptionConfig'):
+        self.__config = config
+        self.__encoder = DeltaEncoder(source=config.source)
+        self.__latest = dict()
+        self.__subscribers = set()
+        self.__servers = []
+        SUBSCRIBERS.set_function(lambda: len(self.__subscribers))
+
+    @property
+    def subscriber_count(self):
+        return len(self.__subscribers)
+
+    @property
+    def ports(self):
+        return [server.sockets[0].getsockname()[1] for server in self.__servers]
+
+    def publish(self, path, value, timestamp):
+        self.__latest[path] = (value, timestamp)
+        for subscriber in self.__subscribers:
+            subscriber.queue.put(path, value, timestamp)
+
+    """
+    Start the endpoints. If one can't be started, the ones already started
+    are closed again so a restart can bind them.
+    """
+    async def start(self):
+        config = self.__config
+        try:
+            if config.websocket_port is not None:
+                server = await websockets.serve(self.handle_websocket, config.host, config.websocket_port)
+                self.__servers.append(server)
+                logger.info("Serving subscriptions on ws://%s:%s", config.host, server.sockets[0].getsockname()[1])
+            if config.tcp_port is not None:
+                server = await asyncio.start_server(self.handle_tcp, config.host, config.tcp_port)
+                self.__servers.append(server)
+                logger.info("Serving subscriptions on tcp://%s:%s", config.host, server.sockets[0].getsockname()[1])
+        except BaseException:
+            servers = self.__servers
+            self.__servers = []
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+            raise
+
+    async def run(self, task_group):
+        await self.start()
+        await asyncio.gather(*[server.wait_closed() for server in self.__servers])
+
+    async def close(self):
+        servers = self.__servers
+        self.__servers = []
+        for server in servers:
+            server.close()
+        for subscriber in list(self.__subscribers):
+            subscriber.close()
+        for server in servers:
+            await server.wait_closed()
+
+    async def handle_websocket(self, websocket):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(websocket.path).query)
+        rate = self.__config.max_rate
+        try:
+            requested = float(query["rate"][0])
+            if requested > 0:
+                rate = requested if rate <= 0 else min(rate, requested)
+        except (KeyError, ValueError):
+            pass
+        peer = websocket.remote_address
+        await self.serve_subscriber(f"ws {peer[0]}:{peer[1]}" if peer else "ws", websocket.send,
+                                    websocket.wait_closed(), rate)
+
+    async def handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def send(message):
+            writer.write(message.encode() + b"\n")
+            await writer.drain()
+
+        # subscribers don't send anything, reading only notices when they disconnect
+        async def wait_closed():
+            while len(await reader.read(1024)) > 0:
+                pass
+
+        peer = writer.get_extra_info("peername")
+        try:
+            await self.serve_subscriber(f"tcp {peer[0]}:{peer[1]}" if peer else "tcp", send, wait_closed(),
+                                        self.__config.max_rate)
+        finally:
+            writer.close()
+
+    """
+    Streams values to a subscriber until it disconnects (closed completes),
+    falls behind or the server is closed
+    """
+    async def serve_subscriber(self, name, send, closed, rate):
+        subscriber = Subscriber(name, self.__config.queue_size)
+        subscriber.task = asyncio.create_task(self.send_loop(subscriber, send, rate))
+        closed = asyncio.ensure_future(closed)
+        self.__subscribers.add(subscriber)
+        logger.info("Subscriber %s connected", name)
+        try:
+            await asyncio.wait([subscriber.task, closed], return_when=asyncio.FIRST_COMPLETED)
+            if subscriber.task.done() and not subscriber.task.cancelled():
+                e = subscriber.task.exception()
+                if isinstance(e, TimeoutError):
+                    SUBSCRIBER_DISCONNECTS.inc()
+                    logger.warning("Disconnecting subscriber %s, it isn't keeping up", name)
+                elif e is not None and not isinstance(e, (ConnectionError, websockets.exceptions.ConnectionClosed)):
+                    logger.warning(f"Subscriber {name} failed: {e}")
+        finally:
+            self.__subscribers.discard(subscriber)
+            subscriber.close()
+            closed.cancel()
+            logger.info("Subscriber %s disconnected", name)
+
+    async def send_loop(self, subscriber: 'Subscriber', send, rate):
+        interval = 1.0 / rate if rate > 0 else 0
+        timeout = self.__config.send_timeout
+        if len(self.__latest) > 0:
+            await asyncio.wait_for(send(self.__encoder.encode(dict(self.__latest))), timeout)
+        while True:
+            values = await subscriber.next_batch()
+            await asyncio.wait_for(send(self.__encoder.encode(values)), timeout)
+            # values published meanwhile are coalesced in the queue
+            if interval > 0:
+                await asyncio.sleep(interval)
+
+
+class Subscriber:
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.queue = PublishQueue(queue_size, PublishQueue.LATEST_PER_PATH)
+        self.task = None
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    """
+    Wait for a value, then take everything that is queued
+    """
+    async def next_batch(self):
+        path, value, timestamp = await self.queue.get()
+        values = {path: (value, timestamp)}
+        while not self.queue.empty():
+            path, value, timestamp = self.queue.get_nowait()
+            values[path] = (value, timestamp)
+        return values
+
+
+class SubscriptionConfig:
+    def __init__(self):
+        self.__enabled = False
+        self.__host = "127.0.0.1"
+        self.__websocket_port = 3100
+        self.__tcp_port = None
+        self.__queue_size = 100
+        self.__max_rate = 10
+        self.__send_timeout = 5
+        self.__source = "vvm_monitor"
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.__enabled = value
+
+    @property
+    def host(self):
+        return self.__host
+
+    @host.setter
+    def host(self, value):
+        self.__host = value
+
+    """
+    Port for websocket subscribers, None disables the websocket endpoint
+    """
+    @property
+    def websocket_port(self):
+        return self.__websocket_port
+
+    @websocket_port.setter
+    def websocket_port(self, value):
+        self.__websocket_port = value
+
+    """
+    Port for line delimited JSON over TCP, None disables the TCP endpoint
+    """
+    @property
+    def tcp_port(self):
+        return self.__tcp_port
+
+    @tcp_port.setter
+    def tcp_port(self, value):
+        self.__tcp_port = value
+
+    """
+    Paths each subscriber can have waiting before the oldest is dropped
+    """
+    @property
+    def queue_size(self):
+        return self.__queue_size
+
+    @queue_size.setter
+    def queue_size(self, value):
+        self.__queue_size = value
+
+    """
+    Messages per second sent to each subscriber, 0 sends every change
+    """
+    @property
+    def max_rate(self):
+        return self.__max_rate
+
+    @max_rate.setter
+    def max_rate(self, value):
+        self.__max_rate = value
+
+    @property
+    def send_timeout(self):
+        return self.__send_timeout
+
+    @send_timeout.setter
+    def send_timeout(self, value):
+        self.__send_timeout = value
+
+    @property
+    def source(self):
+        return self.__source
+
+    @source.setter
+    def source(self, value):
+        self.__source = value
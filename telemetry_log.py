@@ -0,0 +1,183 @@
+import argparse
+import csv
+import logging
+import struct
+import sys
+import uuid as uuid_lib
+from datetime import datetime, timezone
+
+import clock
+from data_logger import SegmentedRecorder
+
+logger = logging.getLogger(__name__)
+
+"""
+Compact binary recording of raw engine notifications.
+
+A telemetry log is a 64 byte file header followed by fixed-width 32 byte records:
+
+    header:  magic (8) | version u16 | record size u16 | payload size u16 | reserved u16 |
+             anchor wall clock ns i64 | anchor monotonic ns i64 | base uuid (16) | reserved (16)
+    record:  timestamp ns i64 | characteristic id u16 | payload length u8 | payload (21, zero padded)
+
+Timestamps are nanoseconds since the unix epoch, taken from the monotonic clock
+anchored to the wall clock (see clock.py). The header holds the anchor when the
+segment was opened. Timestamps only jump if the system clock is stepped while
+recording, so they can go back (telemetry_query.py handles that). The characteristic id is the 16-bit short id of
+the UUID (0102 for 00000102-<base uuid>).
+"""
+
+MAGIC = b"VVMTLOG\x00"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sHHHHqq16s16x")
+RECORD = struct.Struct("<qHB21s")
+MAX_PAYLOAD = 21
+
+VVM_BASE_UUID = "00000000-0000-1000-8000-ec55f9f5b963"
+
+
+class TelemetryLogFormatError(Exception):
+    pass
+
+
+def characteristic_id(uuid: str):
+    return int(uuid[4:8], 16)
+
+
+def characteristic_uuid(short_id: int, base_uuid: str = VVM_BASE_UUID):
+    return f"{short_id:08x}{base_uuid[8:]}"
+
+
+"""
+Appends notifications to a telemetry log. Records are packed into a buffer on
+the event loop and written in batches by the SegmentedRecorder task.
+"""
+class TelemetryLogWriter(SegmentedRecorder):
+
+    binary = True
+
+    def __init__(self, filename, **kwargs):
+        # segments stay uncompressed so they can be memory mapped
+        kwargs["compression"] = "none"
+        super().__init__(filename, **kwargs)
+        self.__pending = bytearray()
+        self.__ids = dict()
+        self.__truncated = 0
+
+    def segment_opened(self, new_segment):
+        if new_segment:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, RECORD.size, MAX_PAYLOAD, 0,
+                                              clock.ANCHOR_WALL_NS, clock.ANCHOR_MONOTONIC_NS,
+                                              uuid_lib.UUID(VVM_BASE_UUID).bytes))
+
+    """
+    Record a raw notification payload received at timestamp (see clock.py), now by default
+    """
+    def record(self, uuid: str, data, timestamp = None):
+        short_id = self.__ids.get(uuid)
+        if short_id is None:
+            short_id = characteristic_id(uuid)
+            self.__ids[uuid] = short_id
+
+        length = len(data)
+        if length > MAX_PAYLOAD:
+            self.__truncated += 1
+            length = MAX_PAYLOAD
+
+        if timestamp is None:
+            timestamp = clock.now_ns()
+        self.__pending += RECORD.pack(timestamp, short_id, length, bytes(data))
+
+    def has_pending(self):
+        return len(self.__pending) > 0
+
+    def write_pending(self):
+        if len(self.__pending) == 0:
+            return False
+
+        self._file.write(self.__pending)
+        self.__pending.clear()
+        if self.__truncated > 0:
+            logger.warning("Truncated %s notifications longer than %s bytes", self.__truncated, MAX_PAYLOAD)
+            self.__truncated = 0
+        return True
+
+
+class TelemetryLogHeader:
+    def __init__(self, values):
+        _, self.version, self.record_size, self.payload_size, _, \
+            self.anchor_wall_ns, self.anchor_monotonic_ns, base_uuid = values
+        self.base_uuid = str(uuid_lib.UUID(bytes=base_uuid))
+
+
+def read_header(file):
+    data = file.read(FILE_HEADER.size)
+    if len(data) < FILE_HEADER.size:
+        raise TelemetryLogFormatError("File is too short to be a telemetry log")
+
+    values = FILE_HEADER.unpack(data)
+    if values[0] != MAGIC:
+        raise TelemetryLogFormatError("Missing telemetry log signature")
+
+    header = TelemetryLogHeader(values)
+    if header.record_size != RECORD.size:
+        raise TelemetryLogFormatError(f"Unsupported record size: {header.record_size}")
+    return header
+
+
+"""
+Streams (timestamp ns, uuid, payload) tuples from a telemetry log
+"""
+def read_records(path, chunk_records = 4096):
+    with open(path, "rb") as file:
+        header = read_header(file)
+        uuids = dict()
+        while True:
+            chunk = file.read(RECORD.size * chunk_records)
+            usable = len(chunk) - len(chunk) % RECORD.size
+            for timestamp, short_id, length, payload in RECORD.iter_unpack(chunk[:usable]):
+                uuid = uuids.get(short_id)
+                if uuid is None:
+                    uuid = characteristic_uuid(short_id, header.base_uuid)
+                    uuids[short_id] = uuid
+                yield timestamp, uuid, payload[:length]
+
+            if len(chunk) < RECORD.size * chunk_records:
+                return
+
+
+def format_timestamp(timestamp_ns):
+    return datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+
+"""
+Converts telemetry logs to CSV with one row per notification
+"""
+def convert_to_csv(paths, output):
+    writer = csv.writer(output)
+    writer.writerow(["timestamp", "uuid", "data", "value"])
+    rows = 0
+    for path in paths:
+        for timestamp, uuid, payload in read_records(path):
+            value = int.from_bytes(payload[2:], byteorder="little")
+            writer.writerow([format_timestamp(timestamp), uuid, payload.hex(), value])
+            rows += 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert binary telemetry logs to CSV")
+    parser.add_argument("input", nargs="+", help="telemetry log file(s)")
+    parser.add_argument("-o", "--output", help="CSV file to write, defaults to stdout")
+    args = parser.parse_args()
+
+    if args.output is None:
+        convert_to_csv(args.input, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as output:
+            rows = convert_to_csv(args.input, output)
+        print(f"Wrote {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
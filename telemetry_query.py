@@ -0,0 +1,244 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+from datetime import datetime, time as datetime_time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ble_connection import SIGNALK_PARAMETER_MAP
+from telemetry_log import FILE_HEADER, RECORD, characteristic_id, format_timestamp, read_header
+
+logger = logging.getLogger(__name__)
+
+"""
+Range queries and downsampling over binary telemetry logs (see telemetry_log.py).
+Files are memory mapped and never parsed row by row: each file is an array of
+fixed-width records, normally sorted so a time range is two binary searches,
+and decoding / downsampling is done with vectorized NumPy operations.
+
+Timestamps go back when the system clock is stepped back while recording
+(see clock.py). Such a file is filtered with a mask instead, and query
+results are sorted when files go back in time or overlap.
+"""
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("NumPy is required for querying telemetry logs: pip install numpy")
+
+
+def record_dtype():
+    return np.dtype([("timestamp", "<i8"), ("id", "<u2"), ("length", "u1"), ("payload", "u1", (21,))])
+
+
+"""
+Parameter names accepted by queries: the SignalK path relative to
+propulsion.<engine id> (e.g. 'revolutions', 'fuel.rate') or a characteristic
+UUID for parameters that aren't published
+"""
+def parameter_lookup():
+    parameters = dict()
+    for uuid, options in SIGNALK_PARAMETER_MAP.items():
+        entry = (characteristic_id(uuid), options.get("convert"))
+        parameters[uuid] = entry
+        if "path" in options:
+            parameters[options["path"]] = entry
+    return parameters
+
+
+class TelemetryFile:
+    def __init__(self, path):
+        require_numpy()
+        self.path = path
+        with open(path, "rb") as file:
+            self.header = read_header(file)
+
+        count = (os.path.getsize(path) - FILE_HEADER.size) // RECORD.size
+        if count > 0:
+            self.records = np.memmap(path, dtype=record_dtype(), mode="r", offset=FILE_HEADER.size, shape=(count,))
+            timestamps = self.records["timestamp"]
+            self.ordered = bool(np.all(np.diff(timestamps) >= 0))
+            if self.ordered:
+                self.start_ns = int(timestamps[0])
+                self.end_ns = int(timestamps[-1])
+            else:
+                logger.info("Timestamps in %s go back, the system clock was stepped while recording", path)
+                self.start_ns = int(timestamps.min())
+                self.end_ns = int(timestamps.max())
+        else:
+            self.records = None
+            self.ordered = True
+            self.start_ns = self.end_ns = None
+
+    def __len__(self):
+        return 0 if self.records is None else len(self.records)
+
+    """
+    Records with start_ns <= timestamp <= end_ns
+    """
+    def slice(self, start_ns, end_ns):
+        timestamps = self.records["timestamp"]
+        if not self.ordered:
+            return self.records[(timestamps >= start_ns) & (timestamps <= end_ns)]
+        first = np.searchsorted(timestamps, start_ns, side="left")
+        last = np.searchsorted(timestamps, end_ns, side="right")
+        return self.records[first:last]
+
+
+"""
+Time index over a set of telemetry log files
+"""
+class TelemetryIndex:
+    def __init__(self, paths):
+        require_numpy()
+        files = []
+        for path in paths:
+            try:
+                telemetry_file = TelemetryFile(path)
+            except Exception as e:
+                logger.warning("Skipping %s: %s", path, e)
+                continue
+            if len(telemetry_file) > 0:
+                files.append(telemetry_file)
+
+        self.files = sorted(files, key=lambda f: f.start_ns)
+        self.__parameters = parameter_lookup()
+
+    @property
+    def start_ns(self):
+        return self.files[0].start_ns if len(self.files) > 0 else None
+
+    @property
+    def end_ns(self):
+        return max(f.end_ns for f in self.files) if len(self.files) > 0 else None
+
+    """
+    Returns (timestamps, values) arrays for a parameter between start_ns and
+    end_ns, with values converted to SignalK units
+    """
+    def query(self, parameter, start_ns, end_ns):
+        if parameter not in self.__parameters:
+            raise KeyError(f"Unknown parameter: {parameter}")
+        short_id, convert = self.__parameters[parameter]
+
+        timestamps = []
+        values = []
+        for telemetry_file in self.files:
+            if telemetry_file.end_ns < start_ns or telemetry_file.start_ns > end_ns:
+                continue
+
+            records = telemetry_file.slice(start_ns, end_ns)
+            records = records[records["id"] == short_id]
+            if len(records) == 0:
+                continue
+
+            # the value is the little endian integer after the 2 header bytes,
+            # unused payload bytes are zero so 8 bytes covers every parameter
+            raw = np.ascontiguousarray(records["payload"][:, 2:10]).view("<u8").ravel()
+            timestamps.append(np.asarray(records["timestamp"]))
+            values.append(raw)
+
+        if len(timestamps) == 0:
+            return np.empty(0, dtype="<i8"), np.empty(0, dtype="f8")
+
+        timestamps = np.concatenate(timestamps)
+        values = np.concatenate(values).astype("f8")
+        if np.any(np.diff(timestamps) < 0):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+        if convert is not None:
+            values = convert(values)
+        return timestamps, values
+
+
+"""
+Min / max / mean of the values in each bucket_ns wide bucket. Returns arrays of
+bucket start timestamps, min, max, mean and sample count for the non-empty buckets.
+"""
+def downsample(timestamps, values, bucket_ns, origin_ns = None):
+    require_numpy()
+    if len(timestamps) == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype="<i8"), empty, empty, empty, np.empty(0, dtype="<i8")
+
+    if origin_ns is None:
+        origin_ns = int(timestamps[0])
+
+    buckets = (timestamps - origin_ns) // bucket_ns
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    counts = np.diff(np.concatenate((starts, [len(values)])))
+
+    minimum = np.minimum.reduceat(values, starts)
+    maximum = np.maximum.reduceat(values, starts)
+    mean = np.add.reduceat(values, starts) / counts
+    return origin_ns + buckets[starts] * bucket_ns, minimum, maximum, mean, counts
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.vvmlog")
+        paths.extend(sorted(glob.glob(pattern)))
+    return paths
+
+
+"""
+Parses an ISO-8601 timestamp, or a time of day (e.g. 14:00) on the given date,
+in local time unless a UTC offset is included
+"""
+def parse_time(value, default_date):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.combine(default_date, datetime_time.fromisoformat(value))
+    return int(parsed.timestamp() * 1_000_000_000)
+
+
+def parse_duration(value):
+    units = {"ms": 1_000_000, "s": 1_000_000_000, "m": 60_000_000_000, "h": 3_600_000_000_000}
+    for suffix in ["ms", "s", "m", "h"]:
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * units[suffix])
+    return int(float(value) * units["s"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and downsample binary telemetry logs")
+    parser.add_argument("files", nargs="+", help="telemetry log files, globs or directories")
+    parser.add_argument("-p", "--parameter", action="append", required=True,
+                        help="parameter to query, e.g. revolutions or fuel.rate (repeatable)")
+    parser.add_argument("--start", help="start time, ISO-8601 or HH:MM")
+    parser.add_argument("--end", help="end time, ISO-8601 or HH:MM")
+    parser.add_argument("--date", help="date for HH:MM times, defaults to the first recording's date")
+    parser.add_argument("--bucket", default="60s", help="bucket width, e.g. 500ms, 10s, 5m, 1h")
+    args = parser.parse_args()
+
+    index = TelemetryIndex(expand_paths(args.files))
+    if len(index.files) == 0:
+        print("No telemetry recordings found", file=sys.stderr)
+        sys.exit(1)
+
+    if args.date is not None:
+        default_date = datetime.fromisoformat(args.date).date()
+    else:
+        default_date = datetime.fromtimestamp(index.start_ns / 1e9).date()
+    start_ns = parse_time(args.start, default_date) if args.start else index.start_ns
+    end_ns = parse_time(args.end, default_date) if args.end else index.end_ns
+    bucket_ns = parse_duration(args.bucket)
+
+    print("timestamp,parameter,min,max,mean,count")
+    for parameter in args.parameter:
+        timestamps, values = index.query(parameter, start_ns, end_ns)
+        buckets, minimum, maximum, mean, counts = downsample(timestamps, values, bucket_ns, start_ns)
+        for i in range(len(buckets)):
+            print(f"{format_timestamp(int(buckets[i]))},{parameter},{minimum[i]:g},{maximum[i]:g},{mean[i]:g},{counts[i]}")
+
+
+if __name__ == "__main__":
+    main()
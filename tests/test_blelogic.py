@@ -1,10 +1,17 @@
-from ble_connection import UUIDs, VesselViewMobileReceiver, BleConnectionConfig, Conversion
+from ble_connection import UUIDs, VesselViewMobileReceiver, BleConnectionConfig, Conversion, reconnect_delay
+from clock import now_ns
 import logging
 import unittest
 import asyncio
+import gc
+import json
 import math
+import os
+import tempfile
 import sys
+from unittest import mock
 from bleak import BleakGATTCharacteristic
+from bleak.exc import BleakError
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +43,186 @@ class BasicGATTCharacteristic(BleakGATTCharacteristic):
         return self.uuid
 
 
+"""
+Stand-in for BleakClient that answers the VVM initialization requests
+"""
+class FakeVVMClient:
+    dump = [bytes.fromhex(h) for h in [
+        "0028b6000100000001000001d2000002e8000003",
+        "0170170004960000050a000006401f0007102700",
+        "0208b5000009d400000ab600000bfb00000c0000",
+        "03000d0000000e00000100000001010000010200",
+    ]] + [bytes([i]) + bytes(19) for i in range(4, 10)]
+
+    def __init__(self):
+        self.address = "11:22:33:44:55:66"
+        self.is_connected = True
+        self.handlers = dict()
+        self.writes = []
+        self.pending_subscriptions = 0
+        self.max_pending_subscriptions = 0
+        self.subscriptions = []
+        # the responses observed from a VVM
+        self.handshake_responses = {data.hex(): expected for data, expected in VesselViewMobileReceiver.handshakes}
+
+    async def start_notify(self, uuid, handler):
+        self.pending_subscriptions += 1
+        self.max_pending_subscriptions = max(self.max_pending_subscriptions, self.pending_subscriptions)
+        await asyncio.sleep(0.01)
+        self.pending_subscriptions -= 1
+        self.subscriptions.append(uuid)
+        self.handlers[uuid] = handler
+
+    async def stop_notify(self, uuid):
+        self.handlers.pop(uuid, None)
+
+    async def read_gatt_char(self, uuid):
+        if uuid == UUIDs.FIRMWARE_REV_UUID:
+            return bytearray(b"1.2.3")
+        return bytearray(b"test")
+
+    async def write_gatt_char(self, uuid, data, response=True):
+        self.writes.append((uuid, bytes(data)))
+        loop = asyncio.get_running_loop()
+        char = BasicGATTCharacteristic(uuid, None, None)
+        if uuid == UUIDs.DEVICE_CONFIG_UUID and data[0] == 0x28:
+            for chunk in self.dump:
+                loop.call_soon(self.handlers[uuid], char, bytearray(chunk))
+        elif uuid == UUIDs.DEVICE_NEXT_UUID:
+            response = self.handshake_responses.get(bytes(data).hex())
+            if response is None:
+                response = "00" + bytes(data[:2]).hex() + "01010001"
+            loop.call_soon(self.handlers[uuid], char, bytearray.fromhex(response))
+
+
 class Test_DataDecoderTests(unittest.IsolatedAsyncioTestCase):
 
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, "device_cache.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def test_bring_up_streaming(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        config.device_cache_file = self.cache_file
+
+        decoder = VesselViewMobileReceiver(config, None)
+        client = FakeVVMClient()
+        timings = dict()
+        async with asyncio.timeout(5):
+            await decoder.bring_up_streaming(client, timings)
+
+        # the data subscriptions are issued together rather than one at a time
+        assert client.max_pending_subscriptions > 2
+        assert UUIDs.ENGINE_RPM_UUID in client.handlers
+        assert UUIDs.OIL_PRESSURE_UUID in client.handlers
+        # streaming is only enabled once everything is subscribed
+        assert client.writes[-1] == (UUIDs.DEVICE_CONFIG_UUID, bytes([0xD, 0x1]))
+        assert set(timings) >= {"initialize", "notifications", "streaming"}
+
+    async def test_cached_bring_up(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        config.device_cache_file = self.cache_file
+
+        async with asyncio.timeout(5):
+            await VesselViewMobileReceiver(config, None).bring_up_streaming(FakeVVMClient(), dict())
+
+        # the second connection is set up from the cache without the parameter dump or handshakes
+        published = []
+        decoder = VesselViewMobileReceiver(config, lambda path, value, timestamp: published.append((path, value)))
+        client = FakeVVMClient()
+        async with asyncio.timeout(5):
+            await decoder.bring_up_streaming(client, dict())
+        assert client.writes == [(UUIDs.DEVICE_CONFIG_UUID, bytes([0xD, 0x1]))]
+
+        # the header table was restored from the cache
+        char = BasicGATTCharacteristic(UUIDs.UNK_10B_UUID, None, None)
+        decoder.notification_handler(char, bytes([0x01, 0x00, 0x5e, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]))
+        assert published == [("propulsion.0.revolutions", 606 / 60.0)]
+
+        # the cache is refreshed in the background once data is streaming, with streaming
+        # paused while the parameter dump and handshakes run
+        client.writes.clear()
+        async with asyncio.timeout(5):
+            await decoder.refresh_device_cache(client)
+        config_writes = [data for uuid, data in client.writes if uuid == UUIDs.DEVICE_CONFIG_UUID]
+        assert config_writes == [bytes([0xD, 0x0]), bytes([0x28, 0x00, 0x03, 0x01]), bytes([0xD, 0x1])]
+        assert client.writes[-1] == (UUIDs.DEVICE_CONFIG_UUID, bytes([0xD, 0x1]))
+        assert client.subscriptions.count(UUIDs.DEVICE_CONFIG_UUID) == 1
+        with open(self.cache_file) as file:
+            entry = json.load(file)[client.address]
+        assert entry["firmware_revision"] == "1.2.3"
+        assert entry["device_info"]["Firmware Revision"] == "1.2.3"
+        assert entry["handshakes"]["102700"] == "00102701010001"
+
+    async def test_cache_with_unexpected_handshakes_is_not_used(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        config.device_cache_file = self.cache_file
+
+        client = FakeVVMClient()
+        client.handshake_responses["ca0f00"] = "00ca0f01010001"
+        async with asyncio.timeout(5):
+            await VesselViewMobileReceiver(config, None).bring_up_streaming(client, dict())
+
+        # the next connection repeats the parameter dump and handshakes
+        client = FakeVVMClient()
+        async with asyncio.timeout(5):
+            await VesselViewMobileReceiver(config, None).bring_up_streaming(client, dict())
+        assert (UUIDs.DEVICE_CONFIG_UUID, bytes([0x28, 0x00, 0x03, 0x01])) in client.writes
+
+    async def test_failed_cache_refresh_is_logged(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        config.device_cache_file = self.cache_file
+        decoder = VesselViewMobileReceiver(config, None)
+
+        decoder._VesselViewMobileReceiver__refresh_device_cache = True
+
+        client = FakeVVMClient()
+        async def write_gatt_char(uuid, data, response=True):
+            raise BleakError("disconnected")
+        client.write_gatt_char = write_gatt_char
+        with self.assertLogs("ble_connection", logging.WARNING) as logs:
+            await decoder.refresh_device_cache(client)
+        assert "Unable to refresh the device configuration: disconnected" in logs.output[-1]
+
+    async def test_incomplete_parameter_dump(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        decoder = VesselViewMobileReceiver(config, None)
+        decoder.parameter_config_timeout_seconds = 0.05
+
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        client = FakeVVMClient()
+        client.dump = FakeVVMClient.dump[:3]
+        async with asyncio.timeout(5):
+            assert await decoder.request_device_parameter_config(client) is None
+            await asyncio.sleep(0.1)
+
+        # a failed request doesn't leave its segments waiting either
+        async def write_gatt_char(uuid, data, response=True):
+            raise BleakError("write failed")
+        client.write_gatt_char = write_gatt_char
+        async with asyncio.timeout(5):
+            with self.assertRaises(BleakError):
+                await decoder.request_device_parameter_config(client)
+            await asyncio.sleep(0.1)
+
+        # the segments that never arrived don't leave unretrieved exceptions behind
+        gc.collect()
+        assert errors == []
+
     async def test_notifications(self):
 
         config = BleConnectionConfig()
@@ -92,6 +277,73 @@ class Test_DataDecoderTests(unittest.IsolatedAsyncioTestCase):
                                        27566)
 
 
+    async def test_unawaited_notifications_skip_triggers(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+
+        decoder = VesselViewMobileReceiver(config, None)
+        waiters = decoder._VesselViewMobileReceiver__notification_waiters
+        char = BasicGATTCharacteristic(UUIDs.ENGINE_RPM_UUID, None, None)
+        data = bytes([0x01, 0x00, 0x5e, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+
+        promise = decoder.future_data_for_uuid(UUIDs.ENGINE_RPM_UUID)
+        decoder.notification_handler(char, data)
+        assert await promise == 606
+        await asyncio.sleep(0)
+
+        # nothing is waiting any more so the registry isn't consulted
+        decoder.notification_handler(char, data)
+        assert waiters.triggered_count == 1
+        assert waiters.unmatched_count == 0
+
+    async def test_header_dispatch(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+
+        published = []
+        timestamps = []
+        def publish(path, value, timestamp):
+            published.append((path, value))
+            timestamps.append(timestamp)
+        decoder = VesselViewMobileReceiver(config, publish)
+
+        dump = [bytes.fromhex(h) for h in [
+            "0028b6000100000001000001d2000002e8000003",
+            "0170170004960000050a000006401f0007102700",
+            "0208b5000009d400000ab600000bfb00000c0000",
+            "03000d0000000e00000100000001010000010200",
+        ]]
+        parameters = decoder.decode_parameter_configuration(dump)
+        assert parameters["0000"] == "0100"
+        assert parameters["0008"] == "b500"
+
+        decoder.apply_parameter_configuration(parameters)
+
+        recorded = []
+        decoder.data_recorder = mock.Mock()
+        decoder.data_recorder.update_property = lambda uuid, value, timestamp: recorded.append((uuid, value))
+
+        # RPM payload arriving on a different characteristic is routed by its header
+        char = BasicGATTCharacteristic(UUIDs.UNK_10B_UUID, None, None)
+        promise = decoder.future_data_for_uuid(UUIDs.ENGINE_RPM_UUID)
+        before = now_ns()
+        decoder.notification_handler(char, bytes([0x01, 0x00, 0x5e, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]))
+        assert published == [("propulsion.0.revolutions", 606 / 60.0)]
+        # stamped when the notification was received
+        assert before <= timestamps[0] <= now_ns()
+        # and recorded and triggered as the parameter it carries
+        assert recorded == [(UUIDs.ENGINE_RPM_UUID, 606)]
+        async with asyncio.timeout(1):
+            assert await promise == 606
+
+        # characteristics that aren't engine parameters aren't routed by header
+        published.clear()
+        char = BasicGATTCharacteristic(UUIDs.DEVICE_201_UUID, None, None)
+        decoder.notification_handler(char, bytes([0x01, 0x00, 0x5e, 0x02, 0x00, 0x00]))
+        assert published == []
+
     async def run_char_validation(self, decoder, uuid: str, data, expected_result):
         char = BasicGATTCharacteristic(uuid, None, None)        
         promise = decoder.future_data_for_uuid(uuid)
@@ -101,6 +353,79 @@ class Test_DataDecoderTests(unittest.IsolatedAsyncioTestCase):
             assert result == expected_result
 
 
+class Test_Reconnect(unittest.IsolatedAsyncioTestCase):
+
+    def test_reconnect_delay(self):
+        for failures, upper in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 30)]:
+            delay = reconnect_delay(failures, 1, 30)
+            assert upper / 2 <= delay <= upper
+
+    async def test_recorder_is_restarted_once(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+        receiver = VesselViewMobileReceiver(config, None)
+        receiver.reconnect_initial_delay_seconds = 0.01
+
+        class FailingRecorder:
+            def __init__(self):
+                self.runs = 0
+                self.closed = asyncio.Event()
+
+            async def run(self):
+                self.runs += 1
+                if self.runs == 1:
+                    raise OSError("recording failed")
+                await self.closed.wait()
+
+            async def close(self):
+                self.closed.set()
+
+        recorder = FailingRecorder()
+        receiver.data_recorder = recorder
+        async with asyncio.timeout(5):
+            task = asyncio.create_task(receiver.run_recorder())
+            while recorder.runs < 2:
+                await asyncio.sleep(0.01)
+            await receiver.close()
+            await task
+        assert recorder.runs == 2
+
+    async def test_direct_connect_falls_back_to_scan(self):
+        config = BleConnectionConfig()
+        config.device_address = "11:22:33:44:55:66"
+        config.csv_output_enabled = False
+        receiver = VesselViewMobileReceiver(config, None)
+        receiver.reconnect_initial_delay_seconds = 0.01
+        attempts = []
+
+        class FailingClient:
+            def __init__(self, target, **kwargs):
+                attempts.append(target)
+                if len(attempts) == 2:
+                    asyncio.get_running_loop().create_task(receiver.close())
+
+            async def __aenter__(self):
+                raise BleakError("connection failed")
+
+            async def __aexit__(self, *args):
+                pass
+
+        scanned = []
+        async def find_device_by_filter(filterfunc, timeout, service_uuids):
+            scanned.append(timeout)
+            return "scanned-device"
+
+        with mock.patch("ble_connection.BleakClient", FailingClient), \
+             mock.patch("ble_connection.BleakScanner.find_device_by_filter", find_device_by_filter):
+            async with asyncio.timeout(5):
+                await receiver.run()
+
+        # the known address is tried first, then the device is found by a time limited scan
+        assert attempts == ["11:22:33:44:55:66", "scanned-device"]
+        assert scanned == [receiver.rescan_timeout_seconds]
+
+
 class Test_Conversions(unittest.TestCase):
 
     def test_hertz(self):
@@ -0,0 +1,84 @@
+from btsnoop import BtSnoopReader, BtSnoopFormatError, BTSNOOP_EPOCH_DELTA_US
+from replay import CaptureReplayer, PublishCounter
+from ble_connection import VesselViewMobileReceiver, BleConnectionConfig, UUIDs
+import io
+import logging
+import os
+import struct
+import unittest
+import sys
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_FILE = os.path.join(os.path.dirname(__file__), "..", "bt-logs", "btsnoop_hci.log")
+
+def build_capture(packets):
+    data = bytearray(b"btsnoop\x00" + struct.pack(">II", 1, 1002))
+    for timestamp, packet in packets:
+        data.extend(struct.pack(">IIIIq", len(packet), len(packet), 1, 0, timestamp + BTSNOOP_EPOCH_DELTA_US))
+        data.extend(packet)
+    return io.BytesIO(bytes(data))
+
+def acl_packet(boundary, payload):
+    return bytes([0x02]) + struct.pack("<HH", 0x0040 | (boundary << 12), len(payload)) + payload
+
+def att_frame(att):
+    return struct.pack("<HH", len(att), 0x0004) + att
+
+
+class Test_BtSnoopReader(unittest.TestCase):
+
+    def test_notification(self):
+        att = bytes([0x1B, 0x1D, 0x00, 0x01, 0x00, 0x5e, 0x02])
+        reader = BtSnoopReader(build_capture([(1000, acl_packet(2, att_frame(att)))]))
+
+        notifications = list(reader.notifications())
+        assert len(notifications) == 1
+        assert notifications[0].handle == 0x001d
+        assert notifications[0].value == bytes([0x01, 0x00, 0x5e, 0x02])
+        assert notifications[0].timestamp_us == 1000
+        assert not notifications[0].indication
+
+    def test_fragmented_indication(self):
+        frame = att_frame(bytes([0x1D, 0x15, 0x00]) + bytes(range(20)))
+        reader = BtSnoopReader(build_capture([(0, acl_packet(2, frame[:10])), (1, acl_packet(1, frame[10:]))]))
+
+        notifications = list(reader.notifications())
+        assert len(notifications) == 1
+        assert notifications[0].indication
+        assert notifications[0].value == bytes(range(20))
+
+    def test_characteristic_discovery(self):
+        uuid = bytes(reversed(bytes.fromhex(UUIDs.ENGINE_RPM_UUID.replace("-", ""))))
+        att = bytes([0x09, 21, 0x1C, 0x00, 0x18, 0x1D, 0x00]) + uuid
+        reader = BtSnoopReader(build_capture([(0, acl_packet(2, att_frame(att)))]))
+
+        list(reader.notifications())
+        assert reader.handle_uuids == {0x001d: UUIDs.ENGINE_RPM_UUID}
+
+    def test_invalid_file(self):
+        reader = BtSnoopReader(io.BytesIO(b"not a capture file"))
+        with self.assertRaises(BtSnoopFormatError):
+            list(reader.notifications())
+
+
+class Test_CaptureReplay(unittest.IsolatedAsyncioTestCase):
+
+    async def test_replay_capture(self):
+        config = BleConnectionConfig()
+        config.device_name = "UnitTestRunner"
+        config.csv_output_enabled = False
+
+        counter = PublishCounter()
+        replayer = CaptureReplayer(VesselViewMobileReceiver(config, counter))
+        stats = await replayer.replay_file(CAPTURE_FILE)
+
+        assert stats.notifications > 0
+        assert stats.skipped == 0
+        assert counter.count > 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
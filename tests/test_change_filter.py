@@ -0,0 +1,53 @@
+from change_filter import ChangeFilter, FilterRule
+import logging
+import unittest
+import sys
+
+logger = logging.getLogger(__name__)
+
+class Test_ChangeFilter(unittest.TestCase):
+
+    def test_no_rule_publishes_everything(self):
+        change_filter = ChangeFilter()
+        assert change_filter.should_publish("revolutions", 10, 0)
+        assert change_filter.should_publish("revolutions", 10, 0.1)
+
+    def test_absolute_deadband(self):
+        change_filter = ChangeFilter({"temperature": FilterRule(deadband=0.5)})
+        assert change_filter.should_publish("temperature", 350.0, 0)
+        assert not change_filter.should_publish("temperature", 350.4, 1)
+        assert change_filter.should_publish("temperature", 350.6, 2)
+        assert not change_filter.should_publish("temperature", 350.2, 3)
+        assert change_filter.suppressed_count == 2
+
+    def test_relative_deadband(self):
+        change_filter = ChangeFilter(default_rule=FilterRule(relative_deadband=0.01))
+        assert change_filter.should_publish("alternatorVoltage", 12.0, 0)
+        assert not change_filter.should_publish("alternatorVoltage", 12.1, 1)
+        assert change_filter.should_publish("alternatorVoltage", 12.2, 2)
+
+    def test_min_interval(self):
+        change_filter = ChangeFilter({"revolutions": FilterRule(min_interval=0.25)})
+        assert change_filter.should_publish("revolutions", 10, 0)
+        assert not change_filter.should_publish("revolutions", 20, 0.1)
+        assert change_filter.should_publish("revolutions", 30, 0.3)
+
+    def test_heartbeat(self):
+        change_filter = ChangeFilter({"runTime": FilterRule(deadband=60, heartbeat_interval=10)})
+        assert change_filter.should_publish("runTime", 3600, 0)
+        assert not change_filter.should_publish("runTime", 3600, 5)
+        assert change_filter.should_publish("runTime", 3600, 10)
+
+    def test_rule_from_config(self):
+        default_rule = FilterRule.from_config({"heartbeat-seconds": 10})
+        rule = FilterRule.from_config({"deadband-percent": 2, "min-interval-ms": 250}, default_rule)
+        assert rule.heartbeat_interval == 10
+        assert rule.relative_deadband == 0.02
+        assert rule.min_interval == 0.25
+        assert rule.deadband == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
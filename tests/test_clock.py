@@ -0,0 +1,65 @@
+import clock
+from clock import TimestampFormatter, format_iso, monotonic_seconds, now_ns, now_stamp, check_wall_clock
+import logging
+import unittest
+import sys
+import time
+from datetime import datetime
+from unittest import mock
+
+
+class Test_Clock(unittest.TestCase):
+
+    def test_now_is_wall_clock_time(self):
+        assert abs(now_ns() - time.time_ns()) < 1_000_000_000
+        assert abs(monotonic_seconds(now_ns()) - time.monotonic()) < 0.01
+
+    def test_follows_clock_steps(self):
+        anchors = (clock.ANCHOR_WALL_NS, clock.ANCHOR_MONOTONIC_NS, clock.OFFSET_NS)
+        real_time_ns = time.time_ns
+        try:
+            # small adjustments don't move the anchor
+            with mock.patch("time.time_ns", lambda: real_time_ns() + 10_000_000):
+                assert check_wall_clock() == 0
+            assert clock.OFFSET_NS == anchors[2]
+
+            # NTP stepping the clock forward an hour after startup
+            with mock.patch("time.time_ns", lambda: real_time_ns() + 3600_000_000_000):
+                with self.assertLogs("clock", logging.WARNING):
+                    step = check_wall_clock()
+                assert abs(step - 3600_000_000_000) < 100_000_000
+                assert abs(now_ns() - time.time_ns()) < 100_000_000
+                assert abs(monotonic_seconds(now_ns()) - time.monotonic()) < 0.01
+                stepped = now_stamp()
+
+            # a stamp taken before the step keeps its monotonic time, for interval checks
+            clock.ANCHOR_WALL_NS, clock.ANCHOR_MONOTONIC_NS, clock.OFFSET_NS = anchors
+            timestamp, received = now_stamp()
+            assert abs(stepped[0] - timestamp - 3600_000_000_000) < 100_000_000
+            assert abs(stepped[1] - received) < 0.01
+            assert abs(received - time.monotonic()) < 0.01
+        finally:
+            clock.ANCHOR_WALL_NS, clock.ANCHOR_MONOTONIC_NS, clock.OFFSET_NS = anchors
+
+    def test_iso_format(self):
+        timestamp = 1700000000123456789
+        assert format_iso(timestamp) == "2023-11-14T22:13:20.123Z"
+        assert format_iso(timestamp + 500_000) == "2023-11-14T22:13:20.123Z"
+        assert format_iso(timestamp + 1_000_000) == "2023-11-14T22:13:20.124Z"
+        assert format_iso(timestamp + 1_000_000_000) == "2023-11-14T22:13:21.123Z"
+        assert format_iso(timestamp + 877_000_000) == "2023-11-14T22:13:21.000Z"
+
+    def test_matches_datetime(self):
+        formatter = TimestampFormatter("%Y-%m-%d %H:%M:%S", utc=False)
+        for timestamp in range(1700000000000000000, 1700000003000000000, 7_654_321):
+            expected = datetime.fromtimestamp(timestamp // 1_000_000 / 1000).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            assert formatter.format(timestamp) == expected
+
+        seconds = TimestampFormatter("%H:%M:%S", milliseconds=False)
+        assert seconds.format(1700000000999000000) == "22:13:20"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
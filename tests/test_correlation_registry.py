@@ -0,0 +1,80 @@
+from correlation_registry import CorrelationRegistry
+import logging
+import unittest
+import asyncio
+import sys
+
+
+class Test_CorrelationRegistry(unittest.IsolatedAsyncioTestCase):
+
+    async def test_multiple_waiters(self):
+        registry = CorrelationRegistry()
+        first = registry.register(("0001", None))
+        second = registry.register(("0001", None))
+        segment = registry.register(("0001", 3))
+        assert registry.outstanding_count == 3
+
+        assert registry.trigger(("0001", None), b"data") == 2
+        assert await first == b"data"
+        assert await second == b"data"
+        assert not segment.done()
+        assert ("0001", None) not in registry
+
+        assert registry.trigger(("0001", None), b"again") == 0
+        assert registry.unmatched_count == 1
+
+        registry.trigger(("0001", 3), b"\x03")
+        assert await segment == b"\x03"
+        await asyncio.sleep(0)
+        assert registry.outstanding_count == 0
+        assert registry.triggered_count == 3
+
+    async def test_deadlines_expire(self):
+        registry = CorrelationRegistry()
+        short = registry.register("short", timeout=0.01)
+        long = registry.register("long", timeout=0.05)
+        kept = registry.register("kept", timeout=0.05)
+        registry.trigger("kept", 1)
+
+        with self.assertRaises(TimeoutError):
+            await short
+        assert not long.done()
+        assert "short" not in registry
+
+        with self.assertRaises(TimeoutError):
+            await long
+        assert await kept == 1
+        assert registry.expired_count == 2
+        assert registry.outstanding_count == 0
+
+    async def test_cancelled_waiters_are_removed(self):
+        registry = CorrelationRegistry()
+        with self.assertRaises(TimeoutError):
+            async with asyncio.timeout(0.01):
+                await registry.register("request", timeout=10)
+
+        await asyncio.sleep(0)
+        assert "request" not in registry
+        assert registry.outstanding_count == 0
+
+    async def test_callback(self):
+        registry = CorrelationRegistry()
+        results = []
+        registry.register_callback("login", lambda future: results.append(future.result()))
+        registry.trigger("login", {"statusCode": 200})
+        await asyncio.sleep(0)
+        assert results == [{"statusCode": 200}]
+
+    async def test_clear(self):
+        registry = CorrelationRegistry()
+        future = registry.register("request")
+        registry.clear()
+        assert future.cancelled()
+        await asyncio.sleep(0)
+        assert registry.outstanding_count == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
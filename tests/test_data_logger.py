@@ -0,0 +1,168 @@
+from data_logger import CSVLogger
+import asyncio
+import csv
+import glob
+import gzip
+import logging
+import os
+import tempfile
+import time
+import unittest
+import sys
+from unittest import mock
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class Test_CSVLogger(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "logs", "data.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_rows(self):
+        with open(self.filename, newline='') as csvfile:
+            return list(csv.DictReader(csvfile))
+
+    async def test_rows_are_batched_until_close(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm", "temp"], row_interval=0.01, write_interval=60)
+        task = asyncio.create_task(recorder.run())
+
+        recorder.update_property("rpm", 600)
+        await asyncio.sleep(0.05)
+        recorder.update_property("temp", 64)
+        await asyncio.sleep(0.05)
+
+        assert self.read_rows() == []
+
+        await recorder.close()
+        await task
+
+        rows = self.read_rows()
+        assert len(rows) == 2
+        assert rows[0]["rpm"] == "600" and rows[0]["temp"] == ""
+        assert rows[1]["rpm"] == "600" and rows[1]["temp"] == "64"
+
+    async def test_unchanged_values_do_not_add_rows(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"], row_interval=0.01, write_interval=0)
+        task = asyncio.create_task(recorder.run())
+
+        recorder.update_property("rpm", 600)
+        await asyncio.sleep(0.1)
+        assert len(self.read_rows()) == 1
+
+        await recorder.close()
+        await task
+
+    async def test_close_waits_for_fsync(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"], row_interval=0.01, fsync_interval=0)
+        task = asyncio.create_task(recorder.run())
+        recorder.update_property("rpm", 600)
+
+        real_fsync = os.fsync
+        synced = []
+        def slow_fsync(fd):
+            time.sleep(0.1)
+            real_fsync(fd)
+            synced.append(fd)
+
+        with mock.patch("os.fsync", slow_fsync):
+            await asyncio.sleep(0.05)
+            # close while the recorder's fsync is still running on the worker thread
+            await recorder.close()
+            await task
+
+        assert len(synced) >= 2
+        assert self.read_rows()[0]["rpm"] == "600"
+
+    async def test_close_before_run(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"])
+        recorder.update_property("rpm", 600)
+        task = asyncio.create_task(recorder.run())
+
+        # the rows are written even though run() never opened the file, and run() doesn't open it afterwards
+        await recorder.close()
+        await task
+        assert recorder._file is None
+        assert self.read_rows()[0]["rpm"] == "600"
+
+        # nothing to write, no file
+        os.remove(self.filename)
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"])
+        await recorder.close()
+        assert not os.path.exists(self.filename)
+
+    async def test_unknown_properties_are_ignored(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"])
+        recorder.open()
+        recorder.update_property("rpm", 600)
+        recorder.update_property("unknown", 1)
+        await recorder.close()
+
+        assert self.read_rows()[0]["rpm"] == "600"
+
+    async def test_rows_are_stamped_with_the_value_time(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"])
+        recorder.open()
+        timestamp = 1700000000123456789
+        recorder.update_property("rpm", 600, timestamp)
+        recorder.snapshot()
+        await recorder.close()
+
+        expected = datetime.fromtimestamp(1700000000.123).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        assert self.read_rows()[0]["timestamp"] == expected
+
+    async def test_header_written_once_per_segment(self):
+        for value in [600, 700]:
+            recorder = CSVLogger(self.filename, ["timestamp", "rpm"])
+            recorder.open()
+            recorder.update_property("rpm", value)
+            await recorder.close()
+
+        rows = self.read_rows()
+        assert [row["rpm"] for row in rows] == ["600", "700"]
+
+    async def test_rotation_by_size(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"], rotate_size=10, keep=2)
+        recorder.open()
+        for value in range(4):
+            recorder.update_property("rpm", value)
+            recorder.snapshot()
+            recorder.write_rows()
+            assert recorder.should_rotate()
+            recorder.rotate()
+        await recorder.close()
+
+        segments = sorted(glob.glob(os.path.join(self.directory.name, "logs", "data-*.csv.gz")))
+        assert len(segments) == 2
+        with gzip.open(segments[-1], "rt") as segment:
+            lines = segment.read().splitlines()
+        assert lines[0] == "timestamp,rpm"
+        assert lines[1].endswith(",3")
+        assert self.read_rows() == []
+
+    async def test_rotated_segments_are_finished_in_order(self):
+        recorder = CSVLogger(self.filename, ["timestamp", "rpm"], keep=1)
+        recorder.open()
+        loop = asyncio.get_running_loop()
+        for value in range(3):
+            recorder.update_property("rpm", value)
+            recorder.snapshot()
+            recorder.write_rows()
+            recorder.rotate(loop)
+        # close waits for the segments that are still being compressed
+        await recorder.close()
+
+        segments = sorted(glob.glob(os.path.join(self.directory.name, "logs", "data-*")))
+        assert len(segments) == 1 and segments[0].endswith(".csv.gz")
+        with gzip.open(segments[0], "rt") as segment:
+            assert segment.read().splitlines()[1].endswith(",2")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
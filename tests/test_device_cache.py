@@ -0,0 +1,52 @@
+from device_cache import DeviceCache
+import logging
+import unittest
+import os
+import sys
+import tempfile
+
+
+class Test_DeviceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "cache", "devices.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_keyed_by_firmware_revision(self):
+        cache = DeviceCache(self.filename)
+        cache.update("11:22", "1.0", parameters={"0000": "0100"})
+
+        cache = DeviceCache(self.filename)
+        assert cache.get("11:22", "1.0")["parameters"] == {"0000": "0100"}
+        assert cache.get("11:22", "2.0") is None
+        assert cache.get("11:22")["parameters"] == {"0000": "0100"}
+        assert cache.get("33:44") is None
+
+        # a new firmware revision replaces the entry
+        cache.update("11:22", "2.0", device_info={"Model Number": "VVM"})
+        assert cache.get("11:22", "2.0") == {"firmware_revision": "2.0", "device_info": {"Model Number": "VVM"}}
+
+    def test_shared_file(self):
+        first = DeviceCache(self.filename)
+        second = DeviceCache(self.filename)
+        first.update("11:22", "1.0", parameters={"0000": "0100"})
+        second.update("33:44", "1.0", parameters={"0000": "0200"})
+
+        cache = DeviceCache(self.filename)
+        assert cache.get("11:22", "1.0") is not None
+        assert cache.get("33:44", "1.0") is not None
+
+    def test_unreadable_file(self):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, "w") as file:
+            file.write("not json")
+        assert DeviceCache(self.filename).get("11:22") is None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
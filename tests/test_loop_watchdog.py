@@ -0,0 +1,44 @@
+from loop_watchdog import LoopWatchdog, WatchdogConfig, SlowHandlerMonitor
+import logging
+import unittest
+import asyncio
+import sys
+import time
+
+
+class Test_LoopWatchdog(unittest.IsolatedAsyncioTestCase):
+
+    async def test_measures_stalls(self):
+        config = WatchdogConfig()
+        config.interval_ms = 5
+        config.report_interval = 0
+        watchdog = LoopWatchdog(config)
+        task = asyncio.create_task(watchdog.run())
+
+        await asyncio.sleep(0.05)
+        # block the loop so the watchdog timer fires late
+        time.sleep(0.06)
+        await asyncio.sleep(0.02)
+        watchdog.close()
+        await task
+
+        assert watchdog.max_lag >= 0.05
+        percentiles = watchdog.percentiles()
+        assert percentiles["p50"] <= 0.01
+        assert percentiles["max"] == watchdog.max_lag
+
+        watchdog.report()
+        assert watchdog.max_lag == 0
+
+    def test_slow_handler_logging_is_rate_limited(self):
+        monitor = SlowHandlerMonitor("test")
+        with self.assertLogs("loop_watchdog", logging.WARNING) as logs:
+            for _ in range(5):
+                monitor.record("00000102-0000-1000-8000-ec55f9f5b963", 0.02)
+        assert len(logs.records) == 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
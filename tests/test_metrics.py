@@ -0,0 +1,72 @@
+from metrics import MetricsRegistry, MetricsServer, MetricsConfig
+import logging
+import unittest
+import asyncio
+import sys
+
+
+class Test_Metrics(unittest.IsolatedAsyncioTestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        notifications = registry.counter("notifications_total", "Notifications", labels=("uuid",))
+        rpm = notifications.labels("0102")
+        rpm.inc()
+        rpm.inc()
+        assert notifications.labels("0102") is rpm
+
+        depth = registry.gauge("queue_depth", "Queue depth")
+        depth.set_function(lambda: 7)
+        dropped = registry.gauge("dropped", "Dropped values", labels=("sink",))
+        dropped.labels("udp").set_function(lambda: 3)
+
+        latency = registry.histogram("send_seconds", "Send time", buckets=(0.001, 0.01))
+        latency.observe(0.0005)
+        latency.observe(0.005)
+        latency.observe(1.0)
+
+        text = registry.render()
+        assert '# TYPE notifications_total counter' in text
+        assert 'notifications_total{uuid="0102"} 2' in text
+        assert 'queue_depth 7' in text
+        assert 'dropped{sink="udp"} 3' in text
+        assert 'send_seconds_bucket{le="0.001"} 1' in text
+        assert 'send_seconds_bucket{le="0.01"} 2' in text
+        assert 'send_seconds_bucket{le="+Inf"} 3' in text
+        assert 'send_seconds_count 3' in text
+
+    def test_quantile(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("lag_seconds", "Lag", buckets=(0.001, 0.01, 0.1)).labels()
+        for _ in range(98):
+            histogram.observe(0.0005)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        assert histogram.quantile(0.5) == 0.001
+        assert histogram.quantile(0.99) == 0.1
+        assert histogram.quantile(1.0) == float("inf")
+
+    async def test_server(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests").inc()
+        config = MetricsConfig()
+        config.port = 0
+        server = MetricsServer(config, registry)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        finally:
+            await server.close()
+
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"requests_total 1" in response
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,81 @@
+from outbound_buffer import OutboundBuffer
+import logging
+import unittest
+import os
+import sys
+import tempfile
+
+
+class Test_OutboundBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, "buffer")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def drain(self, buffer, limit = 3):
+        entries = []
+        while len(buffer) > 0:
+            batch = buffer.peek(limit)
+            entries.extend(batch)
+            buffer.remove(len(batch))
+        return entries
+
+    def test_memory_only_ring_drops_oldest(self):
+        buffer = OutboundBuffer(3)
+        for i in range(5):
+            buffer.append({"a": (i, i)})
+
+        assert len(buffer) == 3
+        assert buffer.dropped_count == 2
+        assert [values["a"][1] for values in self.drain(buffer)] == [2, 3, 4]
+
+    def test_spills_to_segments_in_order(self):
+        buffer = OutboundBuffer(4, self.directory)
+        for i in range(10):
+            buffer.append({"a": (i, 1700000000000000000 + i)})
+
+        assert len(buffer) == 10
+        assert buffer.segment_count == 2
+        entries = self.drain(buffer)
+        assert [list(values["a"]) for values in entries] == [[i, 1700000000000000000 + i] for i in range(10)]
+        assert os.listdir(self.directory) == []
+
+    def test_segments_survive_restart(self):
+        buffer = OutboundBuffer(4, self.directory)
+        for i in range(6):
+            buffer.append({"a": (i, i)})
+        buffer.spill()
+
+        buffer = OutboundBuffer(4, self.directory)
+        assert len(buffer) == 6
+        buffer.append({"a": (6, 6)})
+        assert [values["a"][0] for values in self.drain(buffer)] == list(range(7))
+
+    def test_oldest_segment_is_dropped_when_full(self):
+        buffer = OutboundBuffer(2, self.directory, max_segments=2)
+        for i in range(7):
+            buffer.append({"a": (i, i)})
+
+        assert buffer.segment_count == 2
+        assert buffer.dropped_count == 2
+        assert [values["a"][0] for values in self.drain(buffer)] == [2, 3, 4, 5, 6]
+
+    def test_partially_sent_segment_is_dropped(self):
+        buffer = OutboundBuffer(2, self.directory, max_segments=2)
+        for i in range(4):
+            buffer.append({"a": (i, i)})
+        buffer.remove(len(buffer.peek(1)))
+
+        buffer.append({"a": (4, 4)})
+        buffer.append({"a": (5, 5)})
+        assert buffer.dropped_count == 1
+        assert [values["a"][0] for values in self.drain(buffer)] == [2, 3, 4, 5]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,90 @@
+from profiler import SamplingProfiler, ProfilerConfig, collapse_stack
+import logging
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class Test_SamplingProfiler(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_collapse_stack(self):
+        stack = collapse_stack(sys._getframe())
+        assert stack.endswith("test_profiler.py:test_collapse_stack")
+
+    async def test_profile_window(self):
+        config = ProfilerConfig()
+        config.interval_ms = 1
+        config.slow_callback_ms = 20
+        config.directory = self.temp_dir.name
+        profiler = SamplingProfiler(config)
+        debug = asyncio.get_running_loop().get_debug()
+
+        profiler.start(duration=0)
+        assert profiler.running
+        asyncio.get_running_loop().call_soon(busy_wait, 0.05)
+        await asyncio.sleep(0.1)
+        folded, slow_callbacks = await profiler.stop()
+        assert not profiler.running
+
+        with open(folded) as file:
+            stacks = file.read()
+        assert "test_profiler.py:busy_wait" in stacks
+        with open(slow_callbacks) as file:
+            assert "busy_wait" in file.read()
+        assert asyncio.get_running_loop().get_debug() == debug
+
+    async def test_window_stops_after_duration(self):
+        config = ProfilerConfig()
+        config.directory = self.temp_dir.name
+        config.duration = 0.05
+        profiler = SamplingProfiler(config)
+        profiler.toggle()
+        assert profiler.running
+        await asyncio.sleep(0.1)
+        assert not profiler.running
+        assert len(os.listdir(self.temp_dir.name)) == 2
+
+        # a second window in the same second doesn't overwrite the first
+        profiler.start(duration=0)
+        await profiler.stop()
+        assert len(os.listdir(self.temp_dir.name)) == 4
+
+    async def test_slow_callbacks_with_quiet_asyncio_logger(self):
+        config = ProfilerConfig()
+        config.slow_callback_ms = 20
+        config.directory = self.temp_dir.name
+        profiler = SamplingProfiler(config)
+        asyncio_logger = logging.getLogger("asyncio")
+        level = asyncio_logger.level
+        asyncio_logger.setLevel(logging.ERROR)
+        try:
+            profiler.start(duration=0)
+            asyncio.get_running_loop().call_soon(busy_wait, 0.05)
+            await asyncio.sleep(0.1)
+            folded, slow_callbacks = await profiler.stop()
+            with open(slow_callbacks) as file:
+                assert "busy_wait" in file.read()
+            assert asyncio_logger.level == logging.ERROR
+        finally:
+            asyncio_logger.setLevel(level)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,85 @@
+from signalk_codec import DeltaEncoder, decode_response, encode_value
+import logging
+import unittest
+import json
+import sys
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP = 1700000000123456789
+
+class Test_SignalKCodec(unittest.TestCase):
+
+    def test_delta_matches_json(self):
+        encoder = DeltaEncoder(source="vvm_monitor")
+        values = {
+            "propulsion.0.revolutions": 11,
+            "propulsion.0.temperature": 350.15,
+            "propulsion.0.state": "started",
+            "propulsion.0.trim": None,
+            'notifications."quoted"': {"state": "alert"},
+        }
+
+        delta = json.loads(encoder.encode({path: (value, TIMESTAMP) for path, value in values.items()}))
+        assert delta["context"] == "vessels.self"
+        assert delta["updates"] == [{
+            "$source": "vvm_monitor",
+            "timestamp": "2023-11-14T22:13:20.123Z",
+            "values": [{"path": path, "value": value} for path, value in values.items()]
+        }]
+
+    def test_updates_are_grouped_by_millisecond(self):
+        encoder = DeltaEncoder()
+        values = {"a": (1, TIMESTAMP), "c": (3, TIMESTAMP + 500_000), "b": (2, TIMESTAMP + 2_000_000)}
+
+        delta = json.loads(encoder.encode(values))
+        assert delta["updates"] == [
+            {"timestamp": "2023-11-14T22:13:20.123Z", "values": [{"path": "a", "value": 1}, {"path": "c", "value": 3}]},
+            {"timestamp": "2023-11-14T22:13:20.125Z", "values": [{"path": "b", "value": 2}]},
+        ]
+
+        batches = json.loads(encoder.encode_batches([{"a": (1, TIMESTAMP)}, {"a": [2, TIMESTAMP + 1_000_000_000]}]))
+        assert [update["timestamp"] for update in batches["updates"]] == ["2023-11-14T22:13:20.123Z", "2023-11-14T22:13:21.123Z"]
+
+    def test_request_ids_are_unique(self):
+        encoder = DeltaEncoder()
+        first = json.loads(encoder.encode({"a": (1, TIMESTAMP)}))["requestId"]
+        second = json.loads(encoder.encode({"a": (1, TIMESTAMP)}))["requestId"]
+        assert first != second
+        assert first != json.loads(DeltaEncoder().encode({"a": (1, TIMESTAMP)}))["requestId"]
+
+    def test_non_finite_values_are_null(self):
+        assert encode_value(float("nan")) == "null"
+        assert encode_value(float("inf")) == "null"
+        assert encode_value(True) == "true"
+        assert encode_value(0.1) == "0.1"
+        assert json.loads(DeltaEncoder().encode({"a": (float("nan"), TIMESTAMP)}))["updates"][0]["values"][0]["value"] is None
+
+    def test_decode_skips_frames_without_request_id(self):
+        assert decode_response('{"context":"vessels.self","updates":[]}') is None
+        assert decode_response('{"name":"signalk-server","version":"2.0.0"}') is None
+        response = decode_response('{"requestId":"abc","statusCode":200,"login":{"token":"t"}}')
+        assert response["requestId"] == "abc"
+        assert response["login"]["token"] == "t"
+
+    def test_decode_binary_frames(self):
+        assert decode_response(b'{"context":"vessels.self","updates":[]}') is None
+        assert decode_response(b'{"requestId":"abc","statusCode":200}')["requestId"] == "abc"
+
+    def test_decode_rejects_invalid_json(self):
+        with self.assertRaises(ValueError):
+            decode_response('{"requestId":')
+        with self.assertRaises(ValueError):
+            decode_response(b'{"requestId":"\xff"}')
+
+    def test_empty_values(self):
+        encoder = DeltaEncoder()
+        assert json.loads(encoder.encode({}))["updates"] == []
+        batches = json.loads(encoder.encode_batches([{}, {"a": (1, TIMESTAMP)}, {}]))
+        assert [update["values"] for update in batches["updates"]] == [[{"path": "a", "value": 1}]]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
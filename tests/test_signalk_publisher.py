@@ -0,0 +1,191 @@
+from signalk_publisher import SignalKPublisher, SignalKConfig
+from publish_queue import PublishQueue
+import logging
+import unittest
+import asyncio
+import json
+import sys
+import tempfile
+from websockets.exceptions import ConnectionClosedError
+
+logger = logging.getLogger(__name__)
+
+class FakeWebsocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self):
+        self.closed = True
+
+
+class Test_SignalKPublisher(unittest.IsolatedAsyncioTestCase):
+
+    def create_publisher(self, batch_window, queue_size = 1000, buffer_directory = None):
+        config = SignalKConfig()
+        config.websocket_url = "ws://127.0.0.1:3000/signalk/v1/stream"
+        config.batch_window = batch_window
+        config.send_queue_size = queue_size
+        config.buffer_size = 2
+        config.buffer_directory = buffer_directory
+        config.flush_batch_size = 2
+
+        publisher = SignalKPublisher(config)
+        websocket = FakeWebsocket()
+        publisher._SignalKPublisher__websocket = websocket
+        publisher.socket_connected = True
+        return publisher, websocket
+
+    async def test_values_in_window_are_coalesced(self):
+        publisher, websocket = self.create_publisher(0.05)
+        asyncio.create_task(publisher.send_loop())
+
+        publisher.publish_delta("propulsion.0.revolutions", 10)
+        publisher.publish_delta("propulsion.0.temperature", 350.15)
+        publisher.publish_delta("propulsion.0.revolutions", 11)
+        await asyncio.sleep(0)
+        assert len(websocket.sent) == 0
+
+        await asyncio.sleep(0.1)
+        assert len(websocket.sent) == 1
+
+        values = websocket.sent[0]["updates"][0]["values"]
+        assert values == [
+            {"path": "propulsion.0.revolutions", "value": 11},
+            {"path": "propulsion.0.temperature", "value": 350.15},
+        ]
+
+    async def test_no_window_sends_in_order(self):
+        publisher, websocket = self.create_publisher(0)
+        asyncio.create_task(publisher.send_loop())
+
+        publisher.publish_delta("propulsion.0.revolutions", 10)
+        await asyncio.sleep(0.01)
+        publisher.publish_delta("propulsion.0.revolutions", 11)
+        await asyncio.sleep(0.01)
+
+        sent = [delta["updates"][0]["values"][0]["value"] for delta in websocket.sent]
+        assert sent == [10, 11]
+
+    async def test_close_flushes_pending_values(self):
+        publisher, websocket = self.create_publisher(10)
+
+        publisher.publish_delta("propulsion.0.oilPressure", 275100)
+        await publisher.close()
+        assert len(websocket.sent) == 1
+
+    async def test_close_flushes_batch_in_window(self):
+        publisher, websocket = self.create_publisher(10)
+        publisher._SignalKPublisher__sender_task = asyncio.create_task(publisher.send_loop())
+
+        # the sender has taken the value off the queue and is waiting out the batch window
+        publisher.publish_delta("propulsion.0.oilPressure", 275100)
+        await asyncio.sleep(0.01)
+        assert publisher.queue_depth == 0
+        await publisher.close()
+        assert [delta["updates"][0]["values"][0]["value"] for delta in websocket.sent] == [275100]
+
+    async def test_queue_is_bounded(self):
+        publisher, websocket = self.create_publisher(0, queue_size=2)
+
+        for i in range(5):
+            publisher.publish_delta("propulsion.0.revolutions", i)
+
+        assert publisher.queue_depth == 2
+        assert publisher.dropped_count == 3
+
+    async def test_values_are_buffered_while_disconnected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            publisher, websocket = self.create_publisher(0, buffer_directory=directory)
+            publisher.socket_connected = False
+            for i in range(5):
+                await publisher.send_values({"propulsion.0.revolutions": (i, (1700000000 + i) * 1_000_000_000)})
+            assert publisher.buffered_count == 5
+            assert len(websocket.sent) == 0
+
+            # buffered deltas go first, in batches, with the time they were produced
+            publisher.socket_connected = True
+            await publisher.send_values({"propulsion.0.revolutions": (5, 1700000005 * 1_000_000_000)})
+            assert publisher.buffered_count == 0
+            updates = [update for delta in websocket.sent for update in delta["updates"]]
+            assert [len(delta["updates"]) for delta in websocket.sent] == [2, 2, 1, 1]
+            assert [update["values"][0]["value"] for update in updates] == list(range(6))
+            assert [update["timestamp"] for update in updates] == [f"2023-11-14T22:13:2{i}.000Z" for i in range(6)]
+
+    async def test_failed_send_is_buffered(self):
+        publisher, websocket = self.create_publisher(0)
+
+        async def send(message):
+            raise ConnectionClosedError(None, None)
+        websocket.send = send
+
+        await publisher.send_values({"propulsion.0.revolutions": (10, 1700000000 * 1_000_000_000)})
+        assert not publisher.socket_connected
+        assert publisher.buffered_count == 1
+
+    async def test_values_are_buffered_until_login_succeeds(self):
+        publisher, websocket = self.create_publisher(0)
+        values = {"propulsion.0.revolutions": (10, 1700000000 * 1_000_000_000)}
+
+        # a rejected login keeps the values buffered and closes the connection to log in again
+        await publisher.login()
+        await publisher.send_values(values)
+        publisher.process_websocket_message(json.dumps({"requestId": websocket.sent[0]["requestId"], "statusCode": 401}))
+        await asyncio.sleep(0.01)
+        assert not publisher.ready
+        assert websocket.closed
+        assert publisher.buffered_count == 1
+        assert len(websocket.sent) == 1
+
+        # so does a successful response without a token
+        await publisher.login()
+        publisher.process_websocket_message(json.dumps({"requestId": websocket.sent[1]["requestId"], "statusCode": 200}))
+        await asyncio.sleep(0.01)
+        assert not publisher.ready
+        assert len(websocket.sent) == 2
+
+        await publisher.login()
+        publisher.process_websocket_message(json.dumps({"requestId": websocket.sent[2]["requestId"], "statusCode": 200,
+                                                        "login": {"token": "secret"}}))
+        await asyncio.sleep(0.01)
+        assert publisher.ready
+        assert publisher.buffered_count == 0
+        assert websocket.sent[3]["updates"][0]["values"] == [{"path": "propulsion.0.revolutions", "value": 10}]
+
+
+class Test_PublishQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_drop_oldest(self):
+        queue = PublishQueue(2, PublishQueue.DROP_OLDEST)
+        queue.put("a", 1, 100)
+        queue.put("b", 2, 200)
+        queue.put("a", 3, 300)
+
+        assert queue.dropped_count == 1
+        assert await queue.get() == ("b", 2, 200)
+        assert await queue.get() == ("a", 3, 300)
+
+    async def test_latest_per_path(self):
+        queue = PublishQueue(2, PublishQueue.LATEST_PER_PATH)
+        queue.put("a", 1, 100)
+        queue.put("b", 2, 200)
+        queue.put("a", 3, 300)
+        queue.put("c", 4, 400)
+
+        assert queue.depth == 2
+        assert queue.dropped_count == 2
+        assert await queue.get() == ("b", 2, 200)
+        assert await queue.get() == ("c", 4, 400)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            PublishQueue(2, "newest")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
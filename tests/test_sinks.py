@@ -0,0 +1,232 @@
+from sinks import SinkFanout, OutputSink
+from signalk_http import SignalKHttpSink, HttpSinkConfig
+from nmea2000_udp import Nmea2000UdpSink, Nmea2000Config, encode_engine_rapid, encode_engine_dynamic, format_plain
+import asyncio
+import json
+import logging
+import unittest
+import sys
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP = 1700000000123456789
+
+
+class RecordingSink(OutputSink):
+    def __init__(self, name, delay = 0):
+        super().__init__(name)
+        self.delay = delay
+        self.received = []
+        self.runs = 0
+
+    async def send_loop(self):
+        self.runs += 1
+        while not self.closed:
+            values = await self.next_batch(0)
+            await self.sleep(self.delay)
+            self.received.extend(values.items())
+
+
+class FailingSink(RecordingSink):
+    def publish(self, path, value, timestamp):
+        raise RuntimeError("queue is broken")
+
+    async def send_loop(self):
+        self.runs += 1
+        raise RuntimeError("output failed")
+
+
+class Test_SinkFanout(unittest.IsolatedAsyncioTestCase):
+
+    async def test_values_reach_every_sink(self):
+        fast = RecordingSink("fast")
+        slow = RecordingSink("slow", delay=10)
+        failing = FailingSink("failing")
+        fanout = SinkFanout([failing, slow, fast])
+        fanout.restart_initial_delay_seconds = 0.01
+
+        async with asyncio.timeout(5):
+            async with asyncio.TaskGroup() as tg:
+                tasks = fanout.run(tg)
+                fanout.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+                fanout.publish("propulsion.0.temperature", 350.15, TIMESTAMP)
+                await asyncio.sleep(0.1)
+
+                # the failing sink is restarted without affecting the others, and a
+                # slow sink only backs up its own queue
+                assert fast.received == [("propulsion.0.revolutions", (10, TIMESTAMP)),
+                                         ("propulsion.0.temperature", (350.15, TIMESTAMP))]
+                assert failing.runs > 1
+                fanout.publish("propulsion.0.revolutions", 11, TIMESTAMP)
+                await asyncio.sleep(0.01)
+                assert fast.received[-1] == ("propulsion.0.revolutions", (11, TIMESTAMP))
+                assert slow.queue.depth == 1
+
+                await fanout.close()
+                for task in tasks:
+                    task.cancel()
+
+
+class Test_SignalKHttpSink(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.statuses = []
+        self.connections = 0
+        self.server = await asyncio.start_server(self.handle_client, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = dict()
+                while True:
+                    line = (await reader.readline()).decode()
+                    if line == "\r\n":
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers["content-length"]))
+                self.requests.append((request_line.decode().strip(), headers, json.loads(body)))
+                status = self.statuses.pop(0) if self.statuses else "200 OK"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 2\r\n\r\nok".encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def create_sink(self, batch_window = 0.01):
+        config = HttpSinkConfig()
+        config.url = f"http://127.0.0.1:{self.port}/signalk/v1/api/deltas"
+        config.token = "secret"
+        config.batch_window = batch_window
+        config.retry_interval = 0.01
+        return SignalKHttpSink(config)
+
+    async def test_batches_are_posted(self):
+        sink = self.create_sink()
+        task = asyncio.create_task(sink.run(None))
+
+        sink.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+        sink.publish("propulsion.0.revolutions", 11, TIMESTAMP)
+        await asyncio.sleep(0.1)
+        sink.publish("propulsion.0.temperature", 350.15, TIMESTAMP)
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+        assert len(self.requests) == 2
+        request_line, headers, delta = self.requests[0]
+        assert request_line == "POST /signalk/v1/api/deltas HTTP/1.1"
+        assert headers["authorization"] == "Bearer secret"
+        assert delta["updates"][0]["values"] == [{"path": "propulsion.0.revolutions", "value": 11}]
+        # the connection is kept alive between requests
+        assert self.connections == 1
+
+    async def test_failed_request_is_retried(self):
+        self.statuses = ["503 Service Unavailable"]
+        sink = self.create_sink()
+        task = asyncio.create_task(sink.run(None))
+
+        sink.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+        await asyncio.sleep(0.1)
+        sink.publish("propulsion.0.revolutions", 11, TIMESTAMP)
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+        assert len(self.requests) == 2
+        assert self.requests[1][2]["updates"][0]["values"][0]["value"] == 11
+
+    async def test_close_sends_pending_values(self):
+        sink = self.create_sink(batch_window=10)
+        sink.close_timeout_seconds = 2
+        task = asyncio.create_task(sink.run(None))
+        await asyncio.sleep(0.01)
+
+        # close wakes the send loop in the batch window and waits for it to send
+        sink.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+        await asyncio.sleep(0)
+        await sink.close()
+
+        assert task.done()
+        assert len(self.requests) == 1
+        assert self.requests[0][2]["updates"][0]["values"] == [{"path": "propulsion.0.revolutions", "value": 10}]
+
+
+class Test_Nmea2000(unittest.TestCase):
+
+    def test_engine_rapid(self):
+        data = encode_engine_rapid(1, {"revolutions": 606 / 60.0})
+        assert data.hex() == "017809ffff7fffff"
+        assert encode_engine_rapid(0, {}).hex() == "00ffffffff7fffff"
+
+    def test_engine_dynamic(self):
+        data = encode_engine_dynamic(0, {
+            "oilPressure": 275100,
+            "temperature": 350.15,
+            "alternatorVoltage": 12.4,
+            "fuel.rate": 6.325 / 3600000,
+            "runTime": 3600,
+        })
+        assert len(data) == 26
+        assert data[1:3] == (2751).to_bytes(2, "little")
+        assert data[3:5] == b"\xff\xff"
+        assert data[5:7] == (35015).to_bytes(2, "little")
+        assert data[7:9] == (1240).to_bytes(2, "little")
+        assert data[9:11] == (63).to_bytes(2, "little")
+        assert data[11:15] == (3600).to_bytes(4, "little")
+        # out of range values are flagged rather than wrapped
+        assert encode_engine_dynamic(0, {"temperature": 1000})[5:7] == b"\xfe\xff"
+
+    def test_plain_format(self):
+        line = format_plain(TIMESTAMP, 2, 127488, 0, 255, bytes.fromhex("017809ffff7fffff"))
+        assert line == "2023-11-14T22:13:20.123Z,2,127488,0,255,8,01,78,09,ff,ff,7f,ff,ff"
+
+    def test_pgns_for_changed_engines(self):
+        config = Nmea2000Config()
+        config.engine_instances = {"port": 0, "starboard": 1}
+        sink = Nmea2000UdpSink(config)
+
+        lines = sink.update({
+            "propulsion.starboard.revolutions": (10.1, TIMESTAMP),
+            "propulsion.starboard.temperature": (350.15, TIMESTAMP),
+            "propulsion.unknown.revolutions": (10.1, TIMESTAMP),
+            "environment.depth.belowKeel": (3.0, TIMESTAMP),
+        }, 100.0)
+        assert [line.split(",")[2:5] for line in lines] == [["127488", "0", "255"], ["127489", "0", "255"]]
+        assert all(line.split(",")[6] == "01" for line in lines)
+
+        # the dynamic PGN is limited to once per dynamic interval
+        lines = sink.update({"propulsion.starboard.temperature": (351.15, TIMESTAMP)}, 100.1)
+        assert lines == []
+        lines = sink.update({"propulsion.starboard.revolutions": (10.2, TIMESTAMP)}, 100.6)
+        assert [line.split(",")[2] for line in lines] == ["127488", "127489"]
+
+    def test_held_back_dynamic_is_sent(self):
+        sink = Nmea2000UdpSink(Nmea2000Config())
+        sink.update({"propulsion.0.temperature": (350.15, TIMESTAMP)}, 100.0)
+        assert sink.dynamic_delay(100.0) is None
+
+        # the last value is sent when the dynamic interval expires, without waiting for another change
+        assert sink.update({"propulsion.0.oilPressure": (275100, TIMESTAMP)}, 100.1) == []
+        assert sink.dynamic_delay(100.1) == 100.5 - 100.1
+        lines = sink.update({}, 100.5)
+        assert [line.split(",")[2] for line in lines] == ["127489"]
+        assert lines[0].split(",")[7:9] == ["bf", "0a"]
+        assert sink.dynamic_delay(100.5) is None
+
+        # and when the sink is closed
+        sink.update({"propulsion.0.runTime": (3600, TIMESTAMP)}, 100.6)
+        assert [line.split(",")[2] for line in sink.update({}, 100.7, final=True)] == ["127489"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
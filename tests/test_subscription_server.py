@@ -0,0 +1,121 @@
+from subscription_server import SubscriptionServer, SubscriptionConfig
+import asyncio
+import json
+import logging
+import unittest
+import sys
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP = 1700000000123456789
+
+
+def delta_values(message):
+    data = json.loads(message)
+    return {value["path"]: value["value"] for update in data["updates"] for value in update["values"]}
+
+
+class Test_SubscriptionServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        config = SubscriptionConfig()
+        config.enabled = True
+        config.websocket_port = 0
+        config.tcp_port = 0
+        config.max_rate = 20
+        config.send_timeout = 0.2
+        self.config = config
+        self.server = SubscriptionServer(config)
+        await self.server.start()
+        self.websocket_port, self.tcp_port = self.server.ports
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def wait_for_subscribers(self, count):
+        while self.server.subscriber_count != count:
+            await asyncio.sleep(0.01)
+
+    async def test_websocket_snapshot_then_deltas(self):
+        self.server.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+        self.server.publish("propulsion.0.temperature", 350.15, TIMESTAMP)
+        self.server.publish("propulsion.0.revolutions", 11, TIMESTAMP)
+
+        async with asyncio.timeout(5):
+            async with websockets.connect(f"ws://127.0.0.1:{self.websocket_port}/") as websocket:
+                snapshot = delta_values(await websocket.recv())
+                assert snapshot == {"propulsion.0.revolutions": 11, "propulsion.0.temperature": 350.15}
+
+                self.server.publish("propulsion.0.revolutions", 12, TIMESTAMP + 1_000_000)
+                assert delta_values(await websocket.recv()) == {"propulsion.0.revolutions": 12}
+            await self.wait_for_subscribers(0)
+
+    async def test_rate_limit_coalesces_values(self):
+        async with asyncio.timeout(5):
+            async with websockets.connect(f"ws://127.0.0.1:{self.websocket_port}/?rate=5") as websocket:
+                await self.wait_for_subscribers(1)
+                self.server.publish("propulsion.0.revolutions", 1, TIMESTAMP)
+                assert delta_values(await websocket.recv()) == {"propulsion.0.revolutions": 1}
+
+                # values published while the client is rate limited are sent as one message
+                # with the latest value of each path
+                for value in range(2, 50):
+                    self.server.publish("propulsion.0.revolutions", value, TIMESTAMP)
+                    self.server.publish("propulsion.0.temperature", value + 273.15, TIMESTAMP)
+                    await asyncio.sleep(0.001)
+                assert delta_values(await websocket.recv()) == {"propulsion.0.revolutions": 49,
+                                                                "propulsion.0.temperature": 49 + 273.15}
+
+    async def test_tcp_lines(self):
+        self.server.publish("propulsion.0.revolutions", 10, TIMESTAMP)
+        async with asyncio.timeout(5):
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.tcp_port)
+            try:
+                assert delta_values(await reader.readline()) == {"propulsion.0.revolutions": 10}
+                self.server.publish("propulsion.0.temperature", 350.15, TIMESTAMP)
+                assert delta_values(await reader.readline()) == {"propulsion.0.temperature": 350.15}
+            finally:
+                writer.close()
+
+    async def test_stalled_client_does_not_hold_up_others(self):
+        self.config.max_rate = 0
+        async with asyncio.timeout(20):
+            # the stalled client never reads, so its socket buffers fill up
+            stalled_reader, stalled_writer = await asyncio.open_connection("127.0.0.1", self.tcp_port)
+            stalled_writer.transport.pause_reading()
+            async with websockets.connect(f"ws://127.0.0.1:{self.websocket_port}/", max_size=None) as websocket:
+                await self.wait_for_subscribers(2)
+                padding = "x" * 100000
+                value = 0
+                while self.server.subscriber_count == 2:
+                    value += 1
+                    self.server.publish("propulsion.0.label", padding + str(value), TIMESTAMP)
+                    self.server.publish("propulsion.0.revolutions", value, TIMESTAMP)
+                    # the websocket subscriber keeps receiving every value
+                    while delta_values(await websocket.recv()).get("propulsion.0.revolutions") != value:
+                        pass
+            stalled_writer.close()
+
+    async def test_failed_start_closes_started_servers(self):
+        await self.server.close()
+        blocker = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        self.config.websocket_port = self.websocket_port
+        self.config.tcp_port = blocker.sockets[0].getsockname()[1]
+        self.server = SubscriptionServer(self.config)
+        with self.assertRaises(OSError):
+            await self.server.start()
+        assert self.server.ports == []
+
+        # the websocket port was released, so a restart binds it again
+        blocker.close()
+        await blocker.wait_closed()
+        await self.server.start()
+        assert self.server.ports == [self.websocket_port, self.config.tcp_port]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
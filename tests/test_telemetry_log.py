@@ -0,0 +1,73 @@
+from telemetry_log import TelemetryLogWriter, TelemetryLogFormatError, read_records, convert_to_csv, RECORD, FILE_HEADER
+from ble_connection import UUIDs
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import time
+import unittest
+import sys
+
+logger = logging.getLogger(__name__)
+
+class Test_TelemetryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "data.vvmlog")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_records(self, records):
+        writer = TelemetryLogWriter(self.filename)
+        writer.open()
+        for uuid, data in records:
+            writer.record(uuid, data)
+        asyncio.run(writer.close())
+
+    def test_round_trip(self):
+        start = time.time_ns()
+        rpm = bytes([0x01, 0x00, 0x5e, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        runtime = bytes([0x96, 0x00, 0xab, 0x16] + [0x00] * 14)
+        self.write_records([(UUIDs.ENGINE_RPM_UUID, rpm), (UUIDs.ENGINE_RUNTIME_UUID, runtime)])
+
+        assert os.path.getsize(self.filename) == FILE_HEADER.size + 2 * RECORD.size
+
+        records = list(read_records(self.filename))
+        assert [(uuid, payload) for _, uuid, payload in records] == [
+            (UUIDs.ENGINE_RPM_UUID, rpm),
+            (UUIDs.ENGINE_RUNTIME_UUID, runtime)
+        ]
+        assert start <= records[0][0] <= records[1][0] <= time.time_ns()
+
+    def test_append_keeps_single_header(self):
+        rpm = bytes([0x01, 0x00, 0x5e, 0x02])
+        self.write_records([(UUIDs.ENGINE_RPM_UUID, rpm)])
+        self.write_records([(UUIDs.ENGINE_RPM_UUID, rpm)])
+
+        assert len(list(read_records(self.filename))) == 2
+
+    def test_convert_to_csv(self):
+        self.write_records([(UUIDs.OIL_PRESSURE_UUID, bytes([0xB5, 0x00, 0xAE, 0x6B, 0x00, 0x00]))])
+
+        output = io.StringIO()
+        assert convert_to_csv([self.filename], output) == 1
+
+        lines = output.getvalue().splitlines()
+        assert lines[0] == "timestamp,uuid,data,value"
+        assert lines[1].endswith(f",{UUIDs.OIL_PRESSURE_UUID},b500ae6b0000,27566")
+
+    def test_invalid_file(self):
+        with open(self.filename, "wb") as file:
+            file.write(b"timestamp,rpm\n" * 10)
+
+        with self.assertRaises(TelemetryLogFormatError):
+            list(read_records(self.filename))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,99 @@
+from telemetry_log import FILE_HEADER, RECORD, MAGIC, VERSION, MAX_PAYLOAD, VVM_BASE_UUID, characteristic_id
+from ble_connection import UUIDs
+import logging
+import os
+import tempfile
+import unittest
+import uuid
+import sys
+
+try:
+    import numpy as np
+    from telemetry_query import TelemetryIndex, downsample
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SECOND = 1_000_000_000
+
+def write_log(path, records):
+    with open(path, "wb") as file:
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, RECORD.size, MAX_PAYLOAD, 0, 0, 0, uuid.UUID(VVM_BASE_UUID).bytes))
+        for timestamp, characteristic, value in records:
+            payload = bytes([0x01, 0x00]) + value.to_bytes(8, byteorder="little")
+            file.write(RECORD.pack(timestamp, characteristic_id(characteristic), len(payload), payload))
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class Test_TelemetryQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        # two files covering 0-9s and 10-19s, RPM every second and fuel flow every other second
+        for segment in range(2):
+            records = []
+            for second in range(segment * 10, segment * 10 + 10):
+                records.append((second * SECOND, UUIDs.ENGINE_RPM_UUID, 600 + second * 60))
+                if second % 2 == 0:
+                    records.append((second * SECOND + 1, UUIDs.CURRENT_FUEL_FLOW_UUID, 100))
+            write_log(os.path.join(self.directory.name, f"data-{segment}.vvmlog"), records)
+
+        paths = [os.path.join(self.directory.name, f"data-{segment}.vvmlog") for segment in [1, 0]]
+        self.index = TelemetryIndex(paths)
+
+    def tearDown(self):
+        del self.index
+        self.directory.cleanup()
+
+    def test_index_is_time_ordered(self):
+        assert self.index.start_ns == 0
+        assert self.index.end_ns == 19 * SECOND
+        assert self.index.files[0].path.endswith("data-0.vvmlog")
+
+    def test_range_query_across_files(self):
+        timestamps, values = self.index.query("revolutions", 8 * SECOND, 11 * SECOND)
+        assert list(timestamps) == [8 * SECOND, 9 * SECOND, 10 * SECOND, 11 * SECOND]
+        assert list(values) == [(600 + s * 60) / 60.0 for s in [8, 9, 10, 11]]
+
+        timestamps, values = self.index.query(UUIDs.CURRENT_FUEL_FLOW_UUID, 0, 20 * SECOND)
+        assert len(timestamps) == 10
+
+    def test_downsample(self):
+        timestamps, values = self.index.query("revolutions", 0, 20 * SECOND)
+        buckets, minimum, maximum, mean, counts = downsample(timestamps, values, 5 * SECOND, 0)
+
+        assert list(buckets) == [0, 5 * SECOND, 10 * SECOND, 15 * SECOND]
+        assert list(counts) == [5, 5, 5, 5]
+        assert minimum[0] == 10 and maximum[0] == 14 and mean[0] == 12
+
+    def test_clock_stepped_back(self):
+        # recorded 30-34s, then the clock was stepped back and recording continued at 25-29s
+        path = os.path.join(self.directory.name, "stepped.vvmlog")
+        write_log(path, [(second * SECOND, UUIDs.ENGINE_RPM_UUID, second * 60) for second in [30, 31, 32, 33, 34, 25, 26, 27, 28, 29]])
+        index = TelemetryIndex([path])
+        assert (index.start_ns, index.end_ns) == (25 * SECOND, 34 * SECOND)
+
+        timestamps, values = index.query("revolutions", 28 * SECOND, 31 * SECOND)
+        assert list(timestamps) == [28 * SECOND, 29 * SECOND, 30 * SECOND, 31 * SECOND]
+        assert list(values) == [28, 29, 30, 31]
+
+        # and an earlier file overlaps the stepped one
+        earlier = os.path.join(self.directory.name, "earlier.vvmlog")
+        write_log(earlier, [(second * SECOND + 1, UUIDs.ENGINE_RPM_UUID, second * 60) for second in range(20, 28)])
+        index = TelemetryIndex([path, earlier])
+        timestamps, values = index.query("revolutions", 26 * SECOND, 30 * SECOND)
+        assert list(timestamps) == [26 * SECOND, 26 * SECOND + 1, 27 * SECOND, 27 * SECOND + 1,
+                                    28 * SECOND, 29 * SECOND, 30 * SECOND]
+        del index
+
+    def test_unknown_parameter(self):
+        with self.assertRaises(KeyError):
+            self.index.query("boostPressure", 0, SECOND)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
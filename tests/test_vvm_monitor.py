@@ -0,0 +1,68 @@
+from vvm_monitor import VesselViewMobileDataRecorder, VVMConfig
+from ble_connection import BleConnectionConfig
+from metrics import MetricsConfig
+import asyncio
+import logging
+import unittest
+import sys
+
+
+class Test_MultipleDevices(unittest.TestCase):
+
+    def test_parse_devices(self):
+        recorder = VesselViewMobileDataRecorder()
+        config = VVMConfig()
+        devices = []
+        for index, device in enumerate([{'name': 'VVM 1', 'engine-id': 'port'}, {'address': '11:22:33:44:55:66'}]):
+            ble_config = BleConnectionConfig()
+            ble_config.engine_id = str(index)
+            recorder.parse_ble_device_config(ble_config, device)
+            devices.append(ble_config)
+        config.bluetooth_devices = devices
+
+        self.assertEqual(2, len(config.bluetooth_devices))
+        self.assertIs(config.bluetooth, config.bluetooth_devices[0])
+        self.assertEqual("port", config.bluetooth_devices[0].engine_id)
+        self.assertEqual("1", config.bluetooth_devices[1].engine_id)
+        self.assertTrue(config.bluetooth_devices[1].valid)
+
+    def test_recording_files(self):
+        recorder = VesselViewMobileDataRecorder()
+        devices = [BleConnectionConfig(), BleConnectionConfig(), BleConnectionConfig()]
+        devices[0].engine_id = "port"
+        devices[1].engine_id = "starboard"
+        devices[2].engine_id = "2"
+        devices[0].csv_output_file = devices[1].csv_output_file = "./logs/data.csv"
+        devices[2].csv_output_file = "./logs/other.csv"
+        recorder.assign_recording_files(devices)
+
+        self.assertEqual("./logs/data-port.csv", devices[0].csv_output_file)
+        self.assertEqual("./logs/data-starboard.csv", devices[1].csv_output_file)
+        self.assertEqual("./logs/other.csv", devices[2].csv_output_file)
+
+    def test_requires_device(self):
+        with self.assertRaises(ValueError):
+            VVMConfig().bluetooth_devices = []
+
+
+class Test_Metrics(unittest.IsolatedAsyncioTestCase):
+
+    async def test_metrics_port_in_use(self):
+        blocker = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        config = MetricsConfig()
+        config.host = "127.0.0.1"
+        config.port = blocker.sockets[0].getsockname()[1]
+        recorder = VesselViewMobileDataRecorder()
+        try:
+            with self.assertLogs("vvm_monitor", logging.WARNING):
+                await recorder.start_metrics_server(config)
+            assert recorder.metrics_server is None
+        finally:
+            blocker.close()
+            await blocker.wait_closed()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream = sys.stderr )
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -7,7 +7,16 @@ import yaml
 
 from logging.handlers import RotatingFileHandler
 from signalk_publisher import SignalKPublisher, SignalKConfig
+from signalk_http import SignalKHttpSink, HttpSinkConfig
+from nmea2000_udp import Nmea2000UdpSink, Nmea2000Config
+import clock
+from sinks import SinkFanout
+from subscription_server import SubscriptionServer, SubscriptionConfig
 from ble_connection import VesselViewMobileReceiver, BleConnectionConfig
+from change_filter import FilterRule
+from metrics import MetricsServer, MetricsConfig
+from profiler import SamplingProfiler, ProfilerConfig
+from loop_watchdog import LoopWatchdog, WatchdogConfig, install_uvloop
 
 logger = logging.getLogger("vvm_monitor")
 
@@ -15,16 +24,25 @@ class VesselViewMobileDataRecorder:
     
     def __init__(self):
         self.signalk_socket = None
-        self.ble_connection = None
-
-    async def main(self):
-        loop = asyncio.get_event_loop()
-        loop.add_signal_handler(signal.SIGINT, lambda : asyncio.create_task(self.signal_handler()))
+        self.sinks = SinkFanout()
+        self.ble_connections = []
+        self.metrics_server = None
+        self.profiler = None
+        self.watchdog = None
 
+    def load_config(self):
         config = VVMConfig()
         self.parse_config_file(config)
         self.parse_arguments(config)
         self.parse_env_variables(config)
+        return config
+
+    async def main(self, config: 'VVMConfig' = None):
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGINT, lambda : asyncio.create_task(self.signal_handler()))
+
+        if config is None:
+            config = self.load_config()
 
         # enable logging
         logging.basicConfig(
@@ -40,33 +58,97 @@ class VesselViewMobileDataRecorder:
             logging.getLogger().addHandler(handler)
 
         # start the main loops
-        if config.bluetooth.valid:
-            self.ble_connection = VesselViewMobileReceiver(config.bluetooth, self.publish_data_func)
-        else:
-            logger.warning("Skipping bluetooth connection - configuration is invalid.")
+        VesselViewMobileReceiver.slow_handler_seconds = config.watchdog.handler_threshold_ms / 1000.0
+        self.assign_recording_files(config.bluetooth_devices)
+        for device_config in config.bluetooth_devices:
+            if device_config.valid:
+                self.ble_connections.append(VesselViewMobileReceiver(device_config, self.sinks.publish))
+            else:
+                logger.warning("Skipping bluetooth connection for engine %s - configuration is invalid.",
+                               device_config.engine_id)
             
+        # every decoded value is fanned out to each configured output
         if config.signalk.valid:
             self.signalk_socket = SignalKPublisher(config.signalk)
+            self.sinks.add(self.signalk_socket)
         else:
             logger.warning("Skipping signalk connection - configuration is invalid.")
+        if config.signalk_http.valid:
+            self.sinks.add(SignalKHttpSink(config.signalk_http))
+        if config.nmea2000.enabled:
+            self.sinks.add(Nmea2000UdpSink(config.nmea2000))
+        if config.subscriptions.enabled:
+            self.sinks.add(SubscriptionServer(config.subscriptions))
+        if len(self.sinks.sinks) == 0:
+            logger.warning("No outputs are configured, decoded values will only be recorded.")
+
+        # SIGUSR1 starts or stops a profiling window while the bridge is running
+        self.profiler = SamplingProfiler(config.profiling)
+        loop.add_signal_handler(signal.SIGUSR1, self.profiler.toggle)
+        if config.profiling.enabled:
+            self.profiler.start()
+
+        if config.metrics.enabled:
+            await self.start_metrics_server(config.metrics)
+
+        if config.watchdog.enabled:
+            self.watchdog = LoopWatchdog(config.watchdog)
 
         background_tasks = set()
         async with asyncio.TaskGroup() as tg:
-            if self.ble_connection is not None:
-                task = tg.create_task(self.ble_connection.run(tg))
+            if self.watchdog is not None:
+                task = tg.create_task(self.watchdog.run())
+            else:
+                # the watchdog follows clock steps, without it they're checked on their own
+                task = tg.create_task(clock.watch_wall_clock())
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+            for ble_connection in self.ble_connections:
+                for coroutine in [self.run_ble_connection(ble_connection), ble_connection.run_recorder()]:
+                    task = tg.create_task(coroutine)
+                    background_tasks.add(task)
+                    task.add_done_callback(background_tasks.discard)
+            for task in self.sinks.run(tg):
                 background_tasks.add(task)
                 task.add_done_callback(background_tasks.discard)
-            if self.signalk_socket is not None:
-               task = tg.create_task(self.signalk_socket.run(tg))
-               background_tasks.add(task)
-               task.add_done_callback(background_tasks.discard)
         logger.debug("All event loops are completed")
 
-    async def publish_data_func(self, path, value):
-        if self.signalk_socket is not None:
-            await self.signalk_socket.publish_delta(path, value)
-        else:
-            logger.debug("Couldn't publish data - no signalk socket")
+    """
+    Metrics are optional, the bridge keeps running without them if the
+    endpoint can't be started
+    """
+    async def start_metrics_server(self, config: MetricsConfig):
+        metrics_server = MetricsServer(config)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.warning(f"Skipping metrics endpoint - unable to listen on {config.host}:{config.port}: {e}")
+            return
+        self.metrics_server = metrics_server
+
+    """
+    Runs one BLE device connection. Errors are contained to this device so a
+    failing or reconnecting VVM doesn't cancel the other devices or SignalK.
+    """
+    async def run_ble_connection(self, ble_connection: VesselViewMobileReceiver):
+        while ble_connection in self.ble_connections:
+            try:
+                await ble_connection.run()
+                return
+            except Exception as e:
+                logger.exception(f"BLE connection for engine {ble_connection.engine_id} failed: {e}")
+                await asyncio.sleep(ble_connection.retry_interval)
+
+    """
+    Each device records to its own file. When several devices share the same
+    recording file the engine id is added to the file name.
+    """
+    def assign_recording_files(self, device_configs):
+        files = [c.csv_output_file for c in device_configs]
+        for device_config in device_configs:
+            if files.count(device_config.csv_output_file) > 1:
+                base, extension = os.path.splitext(device_config.csv_output_file)
+                device_config.csv_output_file = f"{base}-{device_config.engine_id}{extension}"
 
     def parse_arguments(self, config: 'VVMConfig'):
         parser = argparse.ArgumentParser()
@@ -126,12 +208,22 @@ class VesselViewMobileDataRecorder:
     async def signal_handler(self):
         logger.info("Gracefully shutting down...")
 
-        if self.ble_connection is not None:
-            await self.ble_connection.close()
-            self.ble_connection = None
-        if self.signalk_socket is not None:
-            await self.signalk_socket.close()
-            self.signalk_socket = None
+        ble_connections = self.ble_connections
+        self.ble_connections = []
+        for ble_connection in ble_connections:
+            await ble_connection.close()
+        await self.sinks.close()
+        self.signalk_socket = None
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+            self.metrics_server = None
+        if self.profiler is not None:
+            writing = self.profiler.stop()
+            if writing is not None:
+                await writing
+        if self.watchdog is not None:
+            self.watchdog.close()
+            self.watchdog = None
 
         logger.info("Exiting.")
         asyncio.get_event_loop().stop()
@@ -172,17 +264,20 @@ class VesselViewMobileDataRecorder:
             with open(file_path, 'r') as file:
                 logger.info(f"Reading configuration from {file_path}.")
                 data = yaml.safe_load(file)
+                # either a single 'ble-device' or a list of 'ble-devices', one per engine
                 ble_device_config = data.get('ble-device')
                 if ble_device_config is not None:
-                    config.bluetooth.device_address = ble_device_config.get('address')
-                    config.bluetooth.device_name = ble_device_config.get('name')
-                    config.bluetooth.retry_interval = ble_device_config.get('retry-interval-seconds', 30)
-                    csv_data_recording_config = ble_device_config.get('data-recording')
-                    if csv_data_recording_config is not None:
-                        config.bluetooth.csv_output_enabled = csv_data_recording_config.get('enabled', False)
-                        config.bluetooth.csv_output_file = csv_data_recording_config.get('file')
-                        config.bluetooth.csv_output_keep = csv_data_recording_config.get('keep', 10)
-                        config.bluetooth.csv_output_raw = csv_data_recording_config.get('output', 'decoded') == 'raw'
+                    self.parse_ble_device_config(config.bluetooth, ble_device_config)
+
+                ble_devices_config = data.get('ble-devices')
+                if ble_devices_config is not None:
+                    devices = []
+                    for index, device_config in enumerate(ble_devices_config):
+                        ble_config = BleConnectionConfig()
+                        ble_config.engine_id = str(index)
+                        self.parse_ble_device_config(ble_config, device_config)
+                        devices.append(ble_config)
+                    config.bluetooth_devices = devices
 
                 signalk_config = data.get('signalk')
                 if signalk_config is not None:
@@ -190,6 +285,72 @@ class VesselViewMobileDataRecorder:
                     config.signalk.username = signalk_config.get('username')
                     config.signalk.password = signalk_config.get('password')
                     config.signalk.retry_interval = signalk_config.get('retry-interval-seconds', 30)
+                    config.signalk.batch_window = signalk_config.get('batch-window-ms', 100) / 1000.0
+                    config.signalk.send_queue_size = signalk_config.get('send-queue-size', 1000)
+                    config.signalk.overflow_policy = signalk_config.get('overflow-policy', 'drop-oldest')
+                    config.signalk.buffer_size = signalk_config.get('buffer-size', 1000)
+                    config.signalk.buffer_directory = signalk_config.get('buffer-directory', './logs/signalk-buffer')
+                    config.signalk.buffer_max_segments = signalk_config.get('buffer-max-segments', 100)
+                    config.signalk.flush_batch_size = signalk_config.get('flush-batch-size', 100)
+                    config.signalk.source = signalk_config.get('source', 'vvm_monitor')
+
+                http_config = data.get('signalk-http')
+                if http_config is not None:
+                    config.signalk_http.url = http_config.get('url')
+                    config.signalk_http.method = http_config.get('method', 'POST').upper()
+                    config.signalk_http.token = http_config.get('token')
+                    config.signalk_http.source = http_config.get('source', 'vvm_monitor')
+                    config.signalk_http.batch_window = http_config.get('batch-window-ms', 1000) / 1000.0
+                    config.signalk_http.timeout = http_config.get('timeout-seconds', 10)
+                    config.signalk_http.retry_interval = http_config.get('retry-interval-seconds', 30)
+                    config.signalk_http.queue_size = http_config.get('queue-size', 1000)
+
+                nmea2000_config = data.get('nmea2000')
+                if nmea2000_config is not None:
+                    config.nmea2000.enabled = nmea2000_config.get('enabled', False)
+                    config.nmea2000.host = nmea2000_config.get('host', '127.0.0.1')
+                    config.nmea2000.port = nmea2000_config.get('port', 10110)
+                    config.nmea2000.source_address = nmea2000_config.get('source-address', 0)
+                    config.nmea2000.priority = nmea2000_config.get('priority', 2)
+                    config.nmea2000.rapid_interval = nmea2000_config.get('rapid-interval-ms', 100) / 1000.0
+                    config.nmea2000.dynamic_interval = nmea2000_config.get('dynamic-interval-ms', 500) / 1000.0
+                    instances = nmea2000_config.get('engine-instances') or dict()
+                    config.nmea2000.engine_instances = {str(k): int(v) for k, v in instances.items()}
+                    config.nmea2000.queue_size = nmea2000_config.get('queue-size', 100)
+
+                subscriptions_config = data.get('subscriptions')
+                if subscriptions_config is not None:
+                    config.subscriptions.enabled = subscriptions_config.get('enabled', False)
+                    config.subscriptions.host = subscriptions_config.get('host', '127.0.0.1')
+                    config.subscriptions.websocket_port = subscriptions_config.get('websocket-port', 3100)
+                    config.subscriptions.tcp_port = subscriptions_config.get('tcp-port')
+                    config.subscriptions.queue_size = subscriptions_config.get('queue-size', 100)
+                    config.subscriptions.max_rate = subscriptions_config.get('max-rate', 10)
+                    config.subscriptions.send_timeout = subscriptions_config.get('send-timeout-seconds', 5)
+                    config.subscriptions.source = subscriptions_config.get('source', 'vvm_monitor')
+
+                metrics_config = data.get('metrics')
+                if metrics_config is not None:
+                    config.metrics.enabled = metrics_config.get('enabled', False)
+                    config.metrics.host = metrics_config.get('host', '127.0.0.1')
+                    config.metrics.port = metrics_config.get('port', 9108)
+
+                profiling_config = data.get('profiling')
+                if profiling_config is not None:
+                    config.profiling.enabled = profiling_config.get('enabled', False)
+                    config.profiling.duration = profiling_config.get('duration-seconds', 30)
+                    config.profiling.interval_ms = profiling_config.get('interval-ms', 5)
+                    config.profiling.slow_callback_ms = profiling_config.get('slow-callback-ms', 50)
+                    config.profiling.directory = profiling_config.get('directory', './logs/profiles')
+
+                watchdog_config = data.get('watchdog')
+                if watchdog_config is not None:
+                    config.watchdog.enabled = watchdog_config.get('enabled', True)
+                    config.watchdog.interval_ms = watchdog_config.get('interval-ms', 100)
+                    config.watchdog.lag_threshold_ms = watchdog_config.get('lag-threshold-ms', 250)
+                    config.watchdog.handler_threshold_ms = watchdog_config.get('handler-threshold-ms', 10)
+                    config.watchdog.report_interval = watchdog_config.get('report-interval-seconds', 300)
+                    config.watchdog.use_uvloop = watchdog_config.get('uvloop', False)
 
                 logging_config = data.get('logging')
                 if logging_config is not None:
@@ -216,11 +377,56 @@ class VesselViewMobileDataRecorder:
             logger.warn("Error loading configuration file: {e}")
 
 
+    def parse_ble_device_config(self, config: BleConnectionConfig, ble_device_config: dict):
+        config.device_address = ble_device_config.get('address')
+        config.device_name = ble_device_config.get('name')
+        config.engine_id = str(ble_device_config.get('engine-id', config.engine_id))
+        config.retry_interval = ble_device_config.get('retry-interval-seconds', 30)
+        config.publish_unknown_parameters = ble_device_config.get('publish-unknown-parameters', False)
+        config.device_cache_file = ble_device_config.get('device-cache-file', config.device_cache_file)
+        csv_data_recording_config = ble_device_config.get('data-recording')
+        if csv_data_recording_config is not None:
+            config.csv_output_enabled = csv_data_recording_config.get('enabled', False)
+            config.csv_output_file = csv_data_recording_config.get('file', config.csv_output_file)
+            keep = csv_data_recording_config.get('keep', 10)
+            config.csv_output_keep = 0 if keep == 'all' else int(keep)
+            config.csv_rotate_size = int(csv_data_recording_config.get('rotate-size-mb', 0) * 1024 * 1024)
+            config.csv_rotate_daily = csv_data_recording_config.get('rotate-daily', False)
+            config.csv_compression = csv_data_recording_config.get('compression', 'gzip')
+            config.recording_format = csv_data_recording_config.get('output', 'decoded')
+            config.csv_write_interval = csv_data_recording_config.get('write-interval-seconds', 10)
+            config.csv_fsync_interval = csv_data_recording_config.get('fsync-interval-seconds', 60)
+        publish_filters_config = ble_device_config.get('publish-filters')
+        if publish_filters_config is not None:
+            self.parse_publish_filters(config, publish_filters_config)
+
+    def parse_publish_filters(self, config: BleConnectionConfig, filters_config: dict):
+        # 'default' applies to every path which does not have its own rule,
+        # other keys are the path relative to propulsion.<engine id>
+        default_config = filters_config.get('default')
+        default_rule = None
+        if default_config is not None:
+            default_rule = FilterRule.from_config(default_config)
+        config.default_publish_filter = default_rule
+
+        rules = dict()
+        for path, rule_config in filters_config.items():
+            if path != 'default' and rule_config is not None:
+                rules[path] = FilterRule.from_config(rule_config, default_rule)
+        config.publish_filters = rules
+        logger.debug(f"Publish filters: default={default_rule}, rules={rules}")
+
 
 class VVMConfig:
     def __init__(self):
-        self._ble_config = BleConnectionConfig()
+        self._ble_configs = [BleConnectionConfig()]
         self._signalk_config = SignalKConfig()
+        self._signalk_http_config = HttpSinkConfig()
+        self._nmea2000_config = Nmea2000Config()
+        self._subscriptions_config = SubscriptionConfig()
+        self._metrics_config = MetricsConfig()
+        self._profiler_config = ProfilerConfig()
+        self._watchdog_config = WatchdogConfig()
 
         self._logging_level = logging.INFO
         self._logging_file = "./logs/vvm_monitor.log"
@@ -234,13 +440,75 @@ class VVMConfig:
     def signalk(self, value):
         self._signalk_config = value
     
+    @property
+    def signalk_http(self):
+        return self._signalk_http_config
+
+    @signalk_http.setter
+    def signalk_http(self, value):
+        self._signalk_http_config = value
+
+    @property
+    def nmea2000(self):
+        return self._nmea2000_config
+
+    @nmea2000.setter
+    def nmea2000(self, value):
+        self._nmea2000_config = value
+
+    @property
+    def subscriptions(self):
+        return self._subscriptions_config
+
+    @subscriptions.setter
+    def subscriptions(self, value):
+        self._subscriptions_config = value
+
+    @property
+    def metrics(self):
+        return self._metrics_config
+
+    @metrics.setter
+    def metrics(self, value):
+        self._metrics_config = value
+
+    @property
+    def profiling(self):
+        return self._profiler_config
+
+    @profiling.setter
+    def profiling(self, value):
+        self._profiler_config = value
+
+    @property
+    def watchdog(self):
+        return self._watchdog_config
+
+    @watchdog.setter
+    def watchdog(self, value):
+        self._watchdog_config = value
+
+    """
+    The first (or only) bluetooth device. Command line arguments and
+    environment variables apply to this device.
+    """
     @property
     def bluetooth(self):
-        return self._ble_config
+        return self._ble_configs[0]
     
     @bluetooth.setter
     def bluetooth(self, value):
-        self._ble_config = value
+        self._ble_configs[0] = value
+
+    @property
+    def bluetooth_devices(self):
+        return self._ble_configs
+
+    @bluetooth_devices.setter
+    def bluetooth_devices(self, value):
+        if len(value) == 0:
+            raise ValueError("At least one bluetooth device must be configured")
+        self._ble_configs = value
 
     @property
     def logging_level(self):
@@ -267,8 +535,12 @@ class VVMConfig:
         self._logging_keep = value
 
 if __name__ == "__main__":
+    recorder = VesselViewMobileDataRecorder()
+    config = recorder.load_config()
+    if config.watchdog.use_uvloop:
+        install_uvloop()
     try:
-        asyncio.run(VesselViewMobileDataRecorder().main())
+        asyncio.run(recorder.main(config))
     except RuntimeError:
         pass
 